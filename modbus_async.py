@@ -0,0 +1,461 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import struct
+import sys
+import time
+from pymodbus.client import AsyncModbusTcpClient
+from pymodbus.exceptions import ModbusException
+from modbus_cli import number_to_two_16bit, number_to_four_16bit, registers_to_number, parse_order, struct_orders, parse_tag, compile_plan, load_tag_map, decode_block, make_writer, write_results, flush_writer, OUTPUT_FORMATS, make_change_filter, filter_changes, parse_deadband, make_metrics, instrument_client, serve_metrics, write_metrics_file, snapshot_metrics, add_metrics, make_device_policy, apply_policy, policy_timeout, record_failure, bits_to_int, int_to_bits, READ_FUNCTIONS, DEFAULT_MAX_GAP
+
+"""
+  ------------- ASYNC CLIENT FUNCTIONS  -------------
+ These work the same as the functions in modbus_cli.py, but take an AsyncModbusTcpClient and must be awaited
+
+ - get_coil_async(client, coil_address, device_id)
+ - get_discrete_coil_async(client, coil_address, device_id)
+ - set_coil_async(client, coil_address, new_value, device_id)
+ - get_coils_async(client, coil_address, count, device_id)
+ - get_discrete_coils_async(client, coil_address, count, device_id)
+ - set_coils_async(client, coil_address, new_value, count, device_id)
+ - get_64bit_register_async(client, starting_address, data_type, device_id, order)
+ - set_64bit_register_async(client, starting_address, new_value, data_type, device_id, order)
+ - get_32bit_register_async(client, starting_address, data_type, device_id, order)
+ - set_32bit_register_async(client, starting_address, new_value, data_type, device_id, order)
+ - get_16bit_register_async(client, address, data_type, device_id, order)
+ - set_16bit_register_async(client, address, new_value, data_type, device_id, order)
+ - get_input_register_async(client, starting_address, size, data_type, device_id, order)
+
+ - read_block_async(client, block, device_id)
+	-> client -- pymodbus async client object
+	-> block -- read block from plan_reads
+	-> device_id -- set the modbus slave_id of the client
+	RETURN: pymodbus response for the whole block
+"""
+
+#Get the coil value at the specified address
+async def get_coil_async(client, coil_address, device_id):
+	result = await client.read_coils(coil_address, device_id=device_id)
+	return None if result.isError() else result.bits[0]
+
+#Get the discrete coil value at the specified address
+async def get_discrete_coil_async(client, coil_address, device_id):
+	result = await client.read_discrete_inputs(coil_address, device_id=device_id)
+	return None if result.isError() else result.bits[0]
+
+#Set the coil value at the given address
+async def set_coil_async(client, coil_address, new_value, device_id):
+	result = await client.write_coil(coil_address, new_value, device_id=device_id)
+	return not result.isError()
+
+#Get count coils from the address in a single request, as a bitset
+async def get_coils_async(client, coil_address, count, device_id):
+	result = await client.read_coils(coil_address, count=count, device_id=device_id)
+	return None if result.isError() else bits_to_int(result.bits[:count])
+
+#Get count discrete coils from the address in a single request, as a bitset
+async def get_discrete_coils_async(client, coil_address, count, device_id):
+	result = await client.read_discrete_inputs(coil_address, count=count, device_id=device_id)
+	return None if result.isError() else bits_to_int(result.bits[:count])
+
+#Set count coils from the address to the bits of new_value in a single request
+async def set_coils_async(client, coil_address, new_value, count, device_id):
+	result = await client.write_coils(coil_address, int_to_bits(new_value, count), device_id=device_id)
+	return not result.isError()
+
+#Read count registers and decode them, None if the read failed
+async def get_register_async(client, starting_address, count, data_type, device_id, order="ABCD"):
+	result = await client.read_holding_registers(address=starting_address, count=count, device_id=device_id)
+	if result.isError():
+		return None
+	return registers_to_number(result.registers, data_type, order)
+
+#Get the value in a register - 64bit
+async def get_64bit_register_async(client, starting_address, data_type, device_id, order="ABCD"):
+	return await get_register_async(client, starting_address, 4, data_type, device_id, order)
+
+#Set the value of the given 64bit register in a single request
+async def set_64bit_register_async(client, starting_address, new_value, data_type, device_id, order="ABCD"):
+	new_values = number_to_four_16bit(new_value, data_type, client, order)
+	result = await client.write_registers(address=starting_address, values=new_values, device_id=device_id)
+	return not result.isError()
+
+#Get the value in a register - 32bit
+async def get_32bit_register_async(client, starting_address, data_type, device_id, order="ABCD"):
+	return await get_register_async(client, starting_address, 2, data_type, device_id, order)
+
+#Set the value of the given 32bit register in a single request
+async def set_32bit_register_async(client, starting_address, new_value, data_type, device_id, order="ABCD"):
+	new_values = number_to_two_16bit(new_value, data_type, client, order)
+	result = await client.write_registers(address=starting_address, values=new_values, device_id=device_id)
+	return not result.isError()
+
+#Get the value of a 16bit register from the address
+async def get_16bit_register_async(client, address, data_type, device_id, order="ABCD"):
+	return await get_register_async(client, address, 1, data_type, device_id, order)
+
+#Set the value of a 16bit register from the address
+async def set_16bit_register_async(client, address, new_value, data_type, device_id, order="ABCD"):
+	buffer_order, value_order = struct_orders(*parse_order(order))
+	register_value = struct.unpack(buffer_order + 'H', struct.pack(value_order + data_type.value[0], new_value))[0]
+	result = await client.write_register(address=address, value=register_value, device_id=device_id)
+	return not result.isError()
+
+#Get the value of an input register (function code 4)
+async def get_input_register_async(client, starting_address, size, data_type, device_id, order="ABCD"):
+	result = await client.read_input_registers(starting_address, count=size // 16, device_id=device_id)
+	if result.isError():
+		return None
+	return registers_to_number(result.registers, data_type, order)
+
+#Send the read request for a block from plan_reads
+async def read_block_async(client, block, device_id):
+	return await getattr(client, READ_FUNCTIONS[block["type"]])(block["start"], count=block["count"], device_id=device_id)
+
+"""
+  ------------- MULTI DEVICE FUNCTIONS  -------------
+ - load_inventory(path, max_gap, use_plan_cache)
+	-> path -- JSON file with a list of devices, [{"ip": "10.0.0.5", "port": 502, "device_id": 1, "tags": ["1024:16:INT", "0:COIL"]}], or "tag_map": "plc.csv" in place of "tags", and an optional "order" (ABCD, CDAB, BADC, DCBA) for the device
+	-> max_gap -- see plan_reads
+	-> use_plan_cache -- see the use_cache option of load_tag_map (Default: True)
+	RETURN: list of device dictionaries {"ip", "port", "device_id", "tags", "blocks"}; raises ValueError on a bad device or tag
+
+ - scan_devices(devices, on_device, max_in_flight, per_device, interval, count, metrics, policy_options)
+	-> devices -- list of device dictionaries from load_inventory
+	-> on_device -- function called as on_device(device, results) as soon as each device has been read, results are the same as read_batch
+	-> max_in_flight -- largest number of requests waiting on a response across all devices
+	-> per_device -- number of connections (and so requests in flight) per device
+	-> interval -- seconds between the start of each scan, None to scan once
+	-> count -- number of scans to take with interval, None to scan until interrupted
+	-> metrics -- metrics dictionary from make_metrics to record every request in, None to not record them
+	-> policy_options -- dictionary of make_device_policy options used for every device (Default: the make_device_policy defaults)
+	RETURN: None; a device that cannot be connected to is tried again on the first scan after its cooldown
+"""
+
+#Load the device inventory, and plan the reads for every device once
+def load_inventory(path, max_gap=DEFAULT_MAX_GAP, use_plan_cache=True):
+	with open(path) as inventory_file:
+		inventory = json.load(inventory_file)
+
+	devices = []
+	for entry in inventory:
+		if "ip" not in entry or not (entry.get("tags") or entry.get("tag_map")):
+			raise ValueError(f"device {entry} requires an ip and a list of tags or a tag_map")
+		#Devices with a tag map use its compiled (and cached) plan
+		#The device order is used for every tag that does not give its own
+		order = entry.get("order", "ABCD")
+		if entry.get("tag_map"):
+			plan = load_tag_map(entry["tag_map"], max_gap, use_plan_cache, order)
+		else:
+			plan = compile_plan([parse_tag(tag, order) for tag in entry["tags"]], max_gap)
+		devices.append({
+			"ip": entry["ip"],
+			"port": int(entry.get("port", 502)),
+			"device_id": int(entry.get("device_id", 1)),
+			"tags": plan["tags"],
+			"blocks": plan["blocks"],
+		})
+	return devices
+
+#Open the connections to a device, a device that cannot be reached gets no connections
+#With a policy the connections use its timeout, and a failed connection counts towards skipping the device
+async def connect_device(device, per_device, metrics=None):
+	device["clients"] = asyncio.Queue()
+	policy = device.get("policy")
+	for _ in range(per_device):
+		client = AsyncModbusTcpClient(device["ip"], port=device["port"])
+		if metrics is not None:
+			instrument_client(client, metrics, f"{device['ip']}:{device['port']}")
+		if policy is not None:
+			apply_policy(client, policy)
+			client.ctx.comm_params.timeout_connect = policy_timeout(policy)
+		if not await client.connect():
+			client.close()
+			if policy is not None:
+				record_failure(policy)
+			break
+		device["clients"].put_nowait(client)
+	device["connected"] = not device["clients"].empty()
+
+#Read one block of a device, waiting for a free connection and then a free global slot
+#The connection is taken first so a busy device does not hold global slots other devices could use
+async def read_device_block(device, block, in_flight, values):
+	client = await device["clients"].get()
+	try:
+		async with in_flight:
+			result = await read_block_async(client, block, device["device_id"])
+	except (ModbusException, OSError):
+		result = None
+	finally:
+		device["clients"].put_nowait(client)
+
+	#A connection error fails every tag in the block
+	if result is None:
+		for tag in block["tags"]:
+			values[id(tag)] = None
+	else:
+		decode_block(block, result, values)
+
+#Read every block of a device at once, limited by the free connections
+async def scan_device(device, in_flight, on_device, per_device=1, metrics=None):
+	values = {}
+	#A device that could not be connected to is tried again once its policy stops skipping it
+	policy = device.get("policy")
+	if not device["connected"] and policy is not None and time.monotonic() >= policy["state"]["open_until"]:
+		await connect_device(device, per_device, metrics)
+	if device["connected"]:
+		await asyncio.gather(*(read_device_block(device, block, in_flight, values) for block in device["blocks"]))
+	on_device(device, [[tag, values.get(id(tag))] for tag in device["tags"]])
+
+#Connect to every device, then scan all of them at the same time
+#Each scan takes about as long as the slowest device instead of the sum of all of them
+async def scan_devices(devices, on_device, max_in_flight=64, per_device=1, interval=None, count=None, metrics=None, policy_options=None):
+	in_flight = asyncio.Semaphore(max_in_flight)
+	#Each device gets its own timeout, retries and circuit breaker, so a dead device does not hold up the scan
+	for device in devices:
+		device["policy"] = make_device_policy(**(policy_options or {}))
+	await asyncio.gather(*(connect_device(device, per_device, metrics) for device in devices))
+	try:
+		start = time.monotonic()
+		scans = 0
+		while True:
+			await asyncio.gather(*(scan_device(device, in_flight, on_device, per_device, metrics) for device in devices))
+			scans += 1
+			if interval is None or (count is not None and scans >= count):
+				break
+			#Keep the scans on a fixed schedule, skipping any scan times that were missed
+			slot = max(scans, int((time.monotonic() - start) / interval) + 1)
+			await asyncio.sleep(max(0, start + slot * interval - time.monotonic()))
+	finally:
+		for device in devices:
+			while not device["clients"].empty():
+				device["clients"].get_nowait().close()
+
+"""
+  ------------- SHARDED SCAN FUNCTIONS  -------------
+ - shard_devices(devices, workers)
+	-> devices -- list of device dictionaries from load_inventory
+	-> workers -- largest number of shards
+	RETURN: list of shards, each a run of the inventory in order, split so every shard has about the same number of tags to decode
+
+ - make_device_output(writer, change_filter)
+	-> writer -- writer dictionary from make_writer
+	-> change_filter -- change filter dictionary from make_change_filter, None to output every tag
+	RETURN: on_device function for scan_devices that writes the results of each device to the writer
+
+ - scan_sharded(devices, workers, writer, change_options, max_in_flight, per_device, interval, count, metrics, policy_options)
+	-> devices -- list of device dictionaries from load_inventory
+	-> workers -- number of processes to scan with, each gets one shard from shard_devices with its own connections
+	-> writer -- writer dictionary from make_writer the output of every process is written to
+	-> change_options -- [deadband, heartbeat] for make_change_filter to only output changes, None to output every tag
+	-> max_in_flight -- largest number of requests waiting on a response across all devices, shared out between the processes
+	-> per_device, interval, count, policy_options -- see scan_devices
+	-> metrics -- metrics dictionary from make_metrics the requests of every process are added to after each scan, None to not record them
+	RETURN: None; each scan is written once every process has finished it, in inventory order. Raises RuntimeError if a process stops with an error
+"""
+
+#Split the inventory into runs with about the same number of tags, so each process has the same amount of decoding to do
+#Runs keep the inventory order, so the output of the processes only has to be joined one after the other
+def shard_devices(devices, workers):
+	total = max(1, sum(len(device["tags"]) for device in devices))
+	shards = [[] for _ in range(min(workers, len(devices)))]
+	tags = 0
+	for device in devices:
+		shards[tags * len(shards) // total].append(device)
+		tags += len(device["tags"])
+	#A device with most of the tags can leave later shards empty
+	return [shard for shard in shards if shard]
+
+#Write each device as soon as it has been read, only the tags that changed with a change filter
+def make_device_output(writer, change_filter=None):
+	def on_device(device, results):
+		timestamp = time.time()
+		if not device["connected"]:
+			#With a change filter a device that cannot be reached is only reported once
+			#In the text format it is one message, the other formats give an error record for each tag
+			if change_filter is None or not device.get("reported_down"):
+				if writer["format"] == "text":
+					writer["pending"].append(f"Error: Unable to connect to {device['ip']}:{device['port']}\n")
+					if time.monotonic() - writer["last_flush"] >= writer["flush_interval"]:
+						flush_writer(writer)
+				else:
+					write_results(writer, f"{device['ip']}:{device['port']}", results, timestamp)
+			device["reported_down"] = True
+			return
+		device["reported_down"] = False
+		if change_filter is not None:
+			results = filter_changes(change_filter, results, time.monotonic())
+		if results:
+			write_results(writer, f"{device['ip']}:{device['port']}", results, timestamp)
+	return on_device
+
+#Take the records waiting in a writer as bytes
+def take_output(writer):
+	pending = writer["pending"]
+	data = b"".join(pending) if writer["format"] == "binary" else "".join(pending).encode()
+	pending.clear()
+	return data
+
+#Scan one shard in a worker process, sending the output of each scan (and the metrics) back over the connection
+#The records are formatted here, so the coordinator only has to write the bytes out
+def scan_shard(connection, devices, output_format, change_options, max_in_flight, per_device, interval, count, send_metrics, policy_options):
+	#The writer is never flushed, its records are taken after each device
+	writer = make_writer(output_format, float("inf"))
+	writer["pending"].clear()
+	on_device = make_device_output(writer, make_change_filter(*change_options) if change_options is not None else None)
+	metrics = make_metrics() if send_metrics else None
+
+	#Devices finish in any order, the output of each is kept in its place until the whole scan is done
+	positions = {id(device): position for position, device in enumerate(devices)}
+	outputs = [b""] * len(devices)
+	finished = [0]
+	def on_shard_device(device, results):
+		on_device(device, results)
+		outputs[positions[id(device)]] = take_output(writer)
+		finished[0] += 1
+		if finished[0] == len(devices):
+			connection.send_bytes(b"".join(outputs))
+			#Only the requests since the last scan are sent, every request has finished by the end of a scan
+			if metrics is not None:
+				connection.send(snapshot_metrics(metrics, reset=True))
+			finished[0] = 0
+
+	try:
+		asyncio.run(scan_devices(devices, on_shard_device, max_in_flight, per_device, interval, count, metrics, policy_options))
+	#The coordinator closes its end when it is interrupted or stops on an error
+	except (KeyboardInterrupt, BrokenPipeError):
+		pass
+	finally:
+		connection.close()
+
+#Scan the inventory with a process for each shard, and write their output as one stream
+def scan_sharded(devices, workers, writer, change_options=None, max_in_flight=64, per_device=1, interval=None, count=None, metrics=None, policy_options=None):
+	shards = shard_devices(devices, workers)
+	#Workers are started fresh, rather than forked, so they do not copy the metrics server or any open connections
+	context = multiprocessing.get_context("spawn")
+	processes = []
+	stream = None
+	pending = []
+	try:
+		for shard in shards:
+			receiver, sender = context.Pipe(duplex=False)
+			process = context.Process(target=scan_shard, args=(sender, shard, writer["format"], change_options, -(-max_in_flight // len(shards)), per_device, interval, count, metrics is not None, policy_options), daemon=True)
+			process.start()
+			sender.close()
+			processes.append((process, receiver))
+
+		#The CSV header goes out before the first scan, after it the records are written straight to the byte stream
+		flush_writer(writer)
+		stream = writer["stream"] if writer["format"] == "binary" else writer["stream"].buffer
+		while True:
+			for number, (process, receiver) in enumerate(processes):
+				try:
+					pending.append(receiver.recv_bytes())
+					if metrics is not None:
+						add_metrics(metrics, receiver.recv())
+				except EOFError:
+					#Every process takes the same number of scans, so the first one finishing means the scan is over
+					process.join()
+					if process.exitcode != 0:
+						raise RuntimeError(f"scan process {number} stopped with exit status {process.exitcode}")
+					return
+			if time.monotonic() - writer["last_flush"] >= writer["flush_interval"]:
+				stream.writelines(pending)
+				stream.flush()
+				pending.clear()
+				writer["last_flush"] = time.monotonic()
+	finally:
+		if pending:
+			stream.writelines(pending)
+			stream.flush()
+		#The processes end on their own after the last scan or an interrupt, any still running after a second are stopped
+		deadline = time.monotonic() + 1
+		for process, receiver in processes:
+			process.join(max(0, deadline - time.monotonic()))
+			if process.is_alive():
+				process.terminate()
+				process.join()
+			receiver.close()
+
+def client():
+	parser = argparse.ArgumentParser(description="Read the tags of many Modbus Devices at the same time")
+	parser.add_argument("inventory", help="JSON file with the list of devices and tags to read")
+	parser.add_argument("--max-in-flight", type=int, default=64, help="Largest number of requests waiting on a response across all devices (Default: 64)")
+	parser.add_argument("--per-device", type=int, default=1, help="Number of connections, and so requests in flight, per device (Default: 1)")
+	parser.add_argument("--max-gap", type=int, default=DEFAULT_MAX_GAP, help=f"Largest number of unused addresses read between two tags to save a request (Default: {DEFAULT_MAX_GAP})")
+	parser.add_argument("--no-plan-cache", action="store_true", help="Compile the tag maps in the inventory every run, without loading or saving the compiled plans in $XDG_CACHE_HOME/modbus_cli")
+	parser.add_argument("--poll", type=float, metavar="INTERVAL", help="Keep scanning every INTERVAL seconds until interrupted")
+	parser.add_argument("--count", type=int, help="Number of scans to take with --poll (Default: until interrupted)")
+	parser.add_argument("-f", "--format", choices=OUTPUT_FORMATS, default="text", help="Output format: text, ndjson, csv or binary (length prefixed records) (Default: text)")
+	parser.add_argument("--flush-interval", type=float, default=0, metavar="SECONDS", help="Write the output at most every SECONDS, 0 to write after every device (Default: 0)")
+	parser.add_argument("--on-change", action="store_true", help="With --poll only output a tag when its value changes")
+	parser.add_argument("--deadband", type=parse_deadband, help="With --on-change only output numbers that change by more than this amount (0.5) or percent (2%%) (Default: any change)")
+	parser.add_argument("--heartbeat", type=float, metavar="SECONDS", help="With --on-change also output a tag that has not changed for SECONDS")
+	parser.add_argument("--timeout", type=float, default=3, metavar="SECONDS", help="Longest time to wait for a response. Once a device has answered its timeout follows its round trip time (Default: 3)")
+	parser.add_argument("--retries", type=int, default=1, help="Number of times a request that timed out or got DEVICE_BUSY is sent again, with backoff (Default: 1)")
+	parser.add_argument("--cooldown", type=float, default=30, metavar="SECONDS", help="Seconds a device is skipped for after 3 requests in a row have failed (Default: 30)")
+	parser.add_argument("--metrics-port", type=int, metavar="PORT", help="Serve the request metrics in the Prometheus format at http://127.0.0.1:PORT/metrics while scanning")
+	parser.add_argument("--metrics-file", metavar="FILE", help="Write the request metrics in the Prometheus format to FILE on exit")
+	parser.add_argument("--workers", type=int, default=1, help="Number of processes to scan with, each reads and decodes a part of the inventory with its own connections. The output of each scan is written in inventory order once every process has finished it (Default: 1, devices are output as soon as they are read)")
+	args = parser.parse_args()
+
+	if args.max_in_flight < 1 or args.per_device < 1:
+		parser.error("--max-in-flight and --per-device should be at least 1")
+	if args.max_gap < 0:
+		parser.error("--max-gap should not be negative")
+	if args.poll is not None and args.poll <= 0:
+		parser.error("--poll INTERVAL should be greater than 0")
+	if args.count is not None and (args.poll is None or args.count < 1):
+		parser.error("--count requires --poll and should be at least 1")
+	if args.on_change and args.poll is None:
+		parser.error("--on-change requires --poll")
+	if (args.deadband is not None or args.heartbeat is not None) and not args.on_change:
+		parser.error("--deadband and --heartbeat require --on-change")
+	if args.heartbeat is not None and args.heartbeat <= 0:
+		parser.error("--heartbeat should be greater than 0")
+	if args.timeout <= 0 or args.cooldown <= 0:
+		parser.error("--timeout and --cooldown should be greater than 0")
+	if args.retries < 0:
+		parser.error("--retries should not be negative")
+	if args.flush_interval < 0:
+		parser.error("--flush-interval should not be negative")
+	if args.workers < 1:
+		parser.error("--workers should be at least 1")
+
+	try:
+		devices = load_inventory(args.inventory, args.max_gap, not args.no_plan_cache)
+	except (OSError, ValueError) as e:
+		parser.error(f"unable to load inventory: {e}")
+
+	metrics = None
+	if args.metrics_port is not None or args.metrics_file is not None:
+		metrics = make_metrics()
+	if args.metrics_port is not None:
+		try:
+			serve_metrics(metrics, args.metrics_port)
+		except OSError as e:
+			parser.error(f"unable to serve metrics on port {args.metrics_port}: {e}")
+
+	#Output each device as soon as it has been read, only the tags that changed with --on-change
+	writer = make_writer(args.format, args.flush_interval)
+	policy_options = {"timeout": args.timeout, "retries": args.retries, "cooldown": args.cooldown}
+	try:
+		if args.workers > 1:
+			change_options = [args.deadband, args.heartbeat] if args.on_change else None
+			scan_sharded(devices, args.workers, writer, change_options, args.max_in_flight, args.per_device, args.poll, args.count, metrics, policy_options)
+		else:
+			change_filter = make_change_filter(args.deadband, args.heartbeat) if args.on_change else None
+			asyncio.run(scan_devices(devices, make_device_output(writer, change_filter), args.max_in_flight, args.per_device, args.poll, args.count, metrics, policy_options))
+	except KeyboardInterrupt:
+		pass
+	except RuntimeError as e:
+		print(f"Error: {e}", file=sys.stderr)
+		sys.exit(1)
+	finally:
+		flush_writer(writer)
+		if args.metrics_file is not None:
+			write_metrics_file(metrics, args.metrics_file)
+
+if __name__ == "__main__":
+	client()
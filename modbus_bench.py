@@ -0,0 +1,344 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from pymodbus.client import ModbusTcpClient
+from modbus_cli import number_to_two_16bit, number_to_four_16bit, struct_orders, get_data_type, decode_registers, encode_registers, get_coil, set_coil, get_coils, set_coils, get_input_register, get_16bit_register, set_16bit_register, get_32bit_register, set_32bit_register, get_64bit_register, set_64bit_register, parse_tag, compile_plan, read_plan, parse_write_tag, write_batch, make_metrics, instrument_client
+from modbus_async import connect_device, scan_device
+from modbus_sim import start_simulator, stop_simulator, free_port
+
+"""
+  ------------- BENCHMARK FUNCTIONS  -------------
+ - time_best(function, repeat)
+	-> function -- function to time, called with no arguments
+	-> repeat -- number of times to run the function
+	RETURN: fastest run time in seconds
+
+ - bench_codec(registers, repeat, use_numpy)
+	-> registers -- number of registers to decode/encode for each datatype
+	-> repeat -- number of times to run each benchmark, the fastest run is reported
+	-> use_numpy -- also time the NumPy backend
+	RETURN: list of [name, size, datatype, values, seconds] for every benchmark run
+
+ - bench_requests(name, function, requests, cpu_time)
+	-> name -- name of the benchmark
+	-> function -- function to time, called with no arguments for each request. It should return None or False when the request failed
+	-> requests -- number of times to call the function
+	-> cpu_time -- function returning the CPU seconds used so far (Default: time.process_time, the CPU time of this process)
+	RETURN: dictionary {"name", "requests", "errors", "seconds", "cpu", "p50", "p99"}; cpu, p50 and p99 are seconds per request
+
+ - bench_client(client, requests, device_id)
+	-> client -- connected pymodbus client object, writes are made to registers 0-999 and coils 0-99
+	-> requests -- number of requests for each benchmark
+	-> device_id -- set the modbus slave_id of the client
+	RETURN: list of bench_requests results for the get_*/set_* functions, read_plan and write_batch. read_plan sends one request at a time, pipelined reads are not timed as the simulator only answers the first request in each TCP segment
+
+ - bench_async(ip, port, devices, scans, device_id)
+	-> ip -- IP address of the modbus device, it is read as devices separate devices
+	-> port -- port of the modbus service
+	-> devices -- number of devices to scan at the same time
+	-> scans -- number of scans to time
+	-> device_id -- set the modbus slave_id of the clients
+	RETURN: bench_requests result where each request is a scan of every device
+
+ - bench_startup(ip, port, runs, device_id)
+	-> ip -- IP address of the modbus device, coil 0 is read and register 0 is written
+	-> port -- port of the modbus service
+	-> runs -- number of times to run each command
+	-> device_id -- set the modbus slave_id of the commands
+	RETURN: list of bench_requests results where each request is a new modbus_cli.py process, from start to exit. cpu is the CPU time of the process
+ - find_regressions(results, baseline, tolerance)
+	-> results -- list of bench_requests results
+	-> baseline -- results saved with --save from an earlier run
+	-> tolerance -- fraction the requests/sec can drop, or the p99 latency can rise, before it is a regression
+	RETURN: list of messages, one for each regression
+"""
+
+#Run the function repeat times and return the fastest run
+def time_best(function, repeat):
+	best = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		function()
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+#Make random values that fit in the given size and datatype
+def random_values(size, datatype, count):
+	if datatype == "FLOAT":
+		return [random.uniform(-1e6, 1e6) for _ in range(count)]
+	elif datatype == "INT":
+		return [random.randint(-2 ** (size - 1), 2 ** (size - 1) - 1) for _ in range(count)]
+	return [random.randint(0, 2 ** size - 1) for _ in range(count)]
+
+#Compare the per value path used by the get_*/set_* functions against the bulk codec
+def bench_codec(registers, repeat, use_numpy):
+	results = []
+	for size in [16, 32, 64]:
+		for datatype in ["INT", "UINT", "FLOAT"]:
+			if size == 16 and datatype == "FLOAT":
+				continue
+			count = size // 16
+			values = random_values(size, datatype, registers // count)
+			encoded = encode_registers(values, size, datatype)
+			data_type = get_data_type(ModbusTcpClient, size, datatype)
+
+			#Per value decode, the same as get_16/32/64bit_register
+			def per_value_decode():
+				for i in range(0, len(encoded), count):
+					ModbusTcpClient.convert_from_registers(encoded[i:i + count], data_type=data_type, word_order="big")
+
+			#Per value encode, the same as set_16/32/64bit_register
+			def per_value_encode():
+				if size == 64:
+					for value in values:
+						number_to_four_16bit(value, data_type, ModbusTcpClient)
+				elif size == 32:
+					for value in values:
+						number_to_two_16bit(value, data_type, ModbusTcpClient)
+				else:
+					buffer_order, value_order = struct_orders()
+					for value in values:
+						struct.unpack(buffer_order + "H", struct.pack(value_order + data_type.value[0], value))
+
+			benchmarks = [
+				["decode per value", per_value_decode],
+				["decode bulk", lambda: decode_registers(encoded, size, datatype)],
+				["encode per value", per_value_encode],
+				["encode bulk", lambda: encode_registers(values, size, datatype)],
+			]
+			if use_numpy:
+				benchmarks += [
+					["decode bulk numpy", lambda: decode_registers(encoded, size, datatype, use_numpy=True)],
+					["encode bulk numpy", lambda: encode_registers(values, size, datatype, use_numpy=True)],
+				]
+			for name, function in benchmarks:
+				results.append([name, size, datatype, len(values), time_best(function, repeat)])
+	return results
+
+#Print the benchmark results as a table
+def print_results(results):
+	print(f"{'benchmark':<20} {'type':<10} {'values':>8} {'ns/value':>10} {'values/sec':>14}")
+	for name, size, datatype, values, seconds in results:
+		print(f"{name:<20} {str(size) + 'bit ' + datatype:<10} {values:>8} {seconds / values * 1e9:>10.1f} {values / seconds:>14,.0f}")
+
+#Get the latency at the fraction (0 to 1) of the sorted latencies
+def percentile(latencies, fraction):
+	return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+#Call the function for each request, timing each call, and the CPU time used by this process for all of them
+def bench_requests(name, function, requests, cpu_time=time.process_time):
+	latencies = []
+	errors = 0
+	cpu_start = cpu_time()
+	start = time.perf_counter()
+	for _ in range(requests):
+		request_start = time.perf_counter()
+		try:
+			result = function()
+			ok = result is not None and result is not False
+		except Exception:
+			ok = False
+		latencies.append(time.perf_counter() - request_start)
+		errors += not ok
+	seconds = time.perf_counter() - start
+	cpu = cpu_time() - cpu_start
+	latencies.sort()
+	return {"name": name, "requests": requests, "errors": errors, "seconds": seconds, "cpu": cpu / requests, "p50": percentile(latencies, 0.5), "p99": percentile(latencies, 0.99)}
+
+#Time the single value functions and the batch functions against a device
+def bench_client(client, requests, device_id=1):
+	data_types = {(size, datatype): get_data_type(ModbusTcpClient, size, datatype) for size, datatype in [(16, "INT"), (32, "FLOAT"), (64, "UINT")]}
+	#100 tags read in a few requests, and 100 registers written in one
+	read_tags = compile_plan([parse_tag(f"{address}:32:FLOAT") for address in range(0, 200, 2)])
+	write_tags = [parse_write_tag(f"{address}:16:INT={address}") for address in range(100)]
+	benchmarks = [
+		["get_coil", lambda: get_coil(client, 0, device_id)],
+		["set_coil", lambda: set_coil(client, 0, True, device_id)],
+		["get_coils 2000", lambda: get_coils(client, 0, 2000, device_id)],
+		["set_coils 100", lambda: set_coils(client, 0, 2 ** 100 - 1, 100, device_id)],
+		["get_input_register", lambda: get_input_register(client, 0, 32, data_types[(32, "FLOAT")], device_id)],
+		["get_16bit_register", lambda: get_16bit_register(client, 0, data_types[(16, "INT")], device_id)],
+		["set_16bit_register", lambda: set_16bit_register(client, 0, 1, data_types[(16, "INT")], device_id)],
+		["get_32bit_register", lambda: get_32bit_register(client, 0, data_types[(32, "FLOAT")], device_id)],
+		["set_32bit_register", lambda: set_32bit_register(client, 0, 1.5, data_types[(32, "FLOAT")], device_id)],
+		["get_64bit_register", lambda: get_64bit_register(client, 0, data_types[(64, "UINT")], device_id)],
+		["set_64bit_register", lambda: set_64bit_register(client, 0, 2 ** 40, data_types[(64, "UINT")], device_id)],
+		["read_plan 100 tags", lambda: all(value is not None for tag, value in read_plan(client, read_tags, device_id))],
+		["write_batch 100 tags", lambda: all(error is None for tag, error in write_batch(client, write_tags, device_id))],
+	]
+	return [bench_requests(name, function, requests) for name, function in benchmarks]
+
+#Time scans of many devices at the same time with modbus_async.py
+def bench_async(ip, port, devices, scans, device_id=1):
+	plan = compile_plan([parse_tag(f"{address}:32:FLOAT") for address in range(0, 200, 2)])
+	inventory = [{"ip": ip, "port": port, "device_id": device_id, "tags": plan["tags"], "blocks": plan["blocks"]} for _ in range(devices)]
+	loop = asyncio.new_event_loop()
+	in_flight = asyncio.Semaphore(64)
+	scan_ok = []
+
+	def on_device(device, results):
+		scan_ok.append(all(value is not None for tag, value in results))
+
+	async def connect_all():
+		await asyncio.gather(*(connect_device(device, 1) for device in inventory))
+
+	async def scan_all():
+		await asyncio.gather(*(scan_device(device, in_flight, on_device) for device in inventory))
+
+	#Each scan is run to the end on the same event loop, so every scan is timed on its own
+	def scan():
+		scan_ok.clear()
+		loop.run_until_complete(scan_all())
+		return all(scan_ok)
+
+	loop.run_until_complete(connect_all())
+	try:
+		return bench_requests(f"async scan {devices} devices", scan, scans)
+	finally:
+		for device in inventory:
+			while not device["clients"].empty():
+				device["clients"].get_nowait().close()
+		loop.close()
+
+#CPU seconds used by the child processes that have exited
+def children_cpu_time():
+	times = os.times()
+	return times.children_user + times.children_system
+
+#Time how long modbus_cli.py takes to start, do one request and exit, as a new process each time
+def bench_startup(ip, port, runs, device_id=1):
+	directory = os.path.dirname(os.path.abspath(__file__))
+	script = os.path.join(directory, "modbus_cli.py")
+	device = ["--ip", ip, "--port", str(port), "-i", str(device_id)]
+	#Commands run in modbus_daemon.py are timed against a daemon started for the benchmark
+	socket_path = os.path.join(tempfile.mkdtemp(), "modbus_cli.sock")
+	env = {name: value for name, value in os.environ.items() if name != "MODBUS_CLI_SOCKET"}
+	daemon_env = dict(env, MODBUS_CLI_SOCKET=socket_path)
+	commands = [
+		["startup --help", [sys.executable, script, "--help"], env],
+		["startup import", [sys.executable, "-c", "import modbus_cli"], env],
+		["startup read coil", [sys.executable, script, "-r", "-c", "-a", "0"] + device, env],
+		["startup -m read coil", [sys.executable, "-m", "modbus_cli", "-r", "-c", "-a", "0"] + device, env],
+		["startup write register", [sys.executable, script, "-w", "--register", "-s", "16", "-d", "INT", "-a", "0", "-v", "1"] + device, env],
+		["startup read tags", [sys.executable, script, "-r", "-t", "0:16:INT", "0:COIL"] + device, env],
+		["startup daemon read", [sys.executable, script, "-r", "-c", "-a", "0"] + device, daemon_env],
+	]
+
+	daemon = subprocess.Popen([sys.executable, os.path.join(directory, "modbus_daemon.py"), "--socket", socket_path], cwd=directory, env=env)
+	try:
+		deadline = time.monotonic() + 10
+		while not os.path.exists(socket_path) and daemon.poll() is None and time.monotonic() < deadline:
+			time.sleep(0.05)
+		results = []
+		for name, command, command_env in commands:
+			run = lambda: subprocess.run(command, cwd=directory, env=command_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+			#The first run compiles the modules and warms the file cache, it is not timed
+			run()
+			results.append(bench_requests(name, run, runs, children_cpu_time))
+		return results
+	finally:
+		daemon.terminate()
+		daemon.wait()
+
+#Print the request benchmark results as a table
+def print_request_results(results):
+	print(f"{'benchmark':<24} {'requests':>8} {'errors':>6} {'req/sec':>10} {'p50 ms':>8} {'p99 ms':>8} {'cpu us/req':>10}")
+	for result in results:
+		print(f"{result['name']:<24} {result['requests']:>8} {result['errors']:>6} {result['requests'] / result['seconds']:>10,.0f} {result['p50'] * 1e3:>8.3f} {result['p99'] * 1e3:>8.3f} {result['cpu'] * 1e6:>10.1f}")
+
+#Compare the results against a saved baseline
+def find_regressions(results, baseline, tolerance):
+	messages = []
+	for result in results:
+		if result["name"] not in baseline:
+			continue
+		old = baseline[result["name"]]
+		rate = result["requests"] / result["seconds"]
+		old_rate = old["requests"] / old["seconds"]
+		if rate < old_rate * (1 - tolerance):
+			messages.append(f"{result['name']}: {rate:,.0f} req/sec, was {old_rate:,.0f}")
+		if result["p99"] > old["p99"] * (1 + tolerance):
+			messages.append(f"{result['name']}: p99 {result['p99'] * 1e3:.3f} ms, was {old['p99'] * 1e3:.3f}")
+	return messages
+
+def client():
+	parser = argparse.ArgumentParser(description="Benchmarks for the Modbus CLI")
+	parser.add_argument("suite", nargs="?", choices=["codec", "client", "async", "startup", "all"], default="codec", help="codec needs no device, client, async and startup run against the simulator (or --ip) (Default: codec)")
+	parser.add_argument("--registers", type=int, default=12000, help="Number of registers to decode/encode for each datatype (Default: 12000)")
+	parser.add_argument("--repeat", type=int, default=5, help="Number of times to run each benchmark, the fastest run is reported (Default: 5)")
+	parser.add_argument("--numpy", action="store_true", help="Also benchmark the NumPy backend (requires NumPy)")
+	parser.add_argument("--requests", type=int, default=1000, help="Number of requests for each client benchmark, and scans for the async benchmark (Default: 1000)")
+	parser.add_argument("--runs", type=int, default=20, help="Number of times each command is run by the startup benchmark (Default: 20)")
+	parser.add_argument("--devices", type=int, default=16, help="Number of devices scanned at the same time by the async benchmark (Default: 16)")
+	parser.add_argument("--ip", help="Benchmark the device at this IP instead of starting the simulator. Registers 0-999 and coils 0-99 are written")
+	parser.add_argument("--port", type=int, default=502, help="Port of the device with --ip (Default: 502)")
+	parser.add_argument("-i", "--device-id", type=int, default=1, help="Device ID of the device with --ip (Default: 1)")
+	parser.add_argument("--latency", type=float, default=0, metavar="MS", help="Milliseconds the simulator adds to every request (Default: 0)")
+	parser.add_argument("--jitter", type=float, default=0, metavar="MS", help="Up to this many more milliseconds the simulator adds to every request (Default: 0)")
+	parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests (0 to 1) the simulator answers with an exception (Default: 0)")
+	parser.add_argument("--metrics", action="store_true", help="Record the metrics of every request, to measure their overhead")
+	parser.add_argument("--save", metavar="FILE", help="Save the client, async and startup results to FILE, to use as a --baseline later")
+	parser.add_argument("--baseline", metavar="FILE", help="Exit with status 1 if any result is slower than the results saved in FILE")
+	parser.add_argument("--tolerance", type=float, default=0.2, help="Fraction the req/sec can drop, or p99 rise, before it is a regression (Default: 0.2)")
+	args = parser.parse_args()
+
+	if args.registers < 4 or args.repeat < 1:
+		parser.error("--registers should be at least 4 and --repeat at least 1")
+	if args.requests < 1 or args.devices < 1 or args.runs < 1:
+		parser.error("--requests, --devices and --runs should be at least 1")
+
+	if args.suite in ["codec", "all"]:
+		print_results(bench_codec(args.registers, args.repeat, args.numpy))
+	if args.suite == "codec":
+		return
+
+	#Start the simulator on a free port unless a device was given
+	simulator = None
+	ip, port = args.ip, args.port
+	if ip is None:
+		ip, port = "127.0.0.1", free_port()
+		simulator = start_simulator(port, ip, ["--latency", str(args.latency), "--jitter", str(args.jitter), "--error-rate", str(args.error_rate), "--seed", "1"])
+
+	results = []
+	try:
+		if args.suite in ["client", "all"]:
+			modbus_client = ModbusTcpClient(ip, port=port)
+			if args.metrics:
+				instrument_client(modbus_client, make_metrics(), f"{ip}:{port}")
+			modbus_client.connect()
+			try:
+				results += bench_client(modbus_client, args.requests, args.device_id)
+			finally:
+				modbus_client.close()
+		if args.suite in ["async", "all"]:
+			results.append(bench_async(ip, port, args.devices, args.requests, args.device_id))
+		if args.suite in ["startup", "all"]:
+			results += bench_startup(ip, port, args.runs, args.device_id)
+	finally:
+		if simulator is not None:
+			stop_simulator(simulator)
+
+	print_request_results(results)
+
+	if args.save:
+		with open(args.save, "w") as save_file:
+			json.dump({result["name"]: result for result in results}, save_file, indent=1)
+	if args.baseline:
+		with open(args.baseline) as baseline_file:
+			regressions = find_regressions(results, json.load(baseline_file), args.tolerance)
+		for message in regressions:
+			print(f"Regression: {message}", file=sys.stderr)
+		if regressions:
+			sys.exit(1)
+
+if __name__ == "__main__":
+	client()
@@ -1,55 +1,118 @@
-import argparse
-from pymodbus.client import ModbusTcpClient
+import atexit
+import bisect
+import collections
+import csv
+import enum
+import hashlib
+import io
+import json
+import math
+import os
+import select
+import socket
 import struct
+import sys
+import threading
+import time
+
+#pymodbus is most of the start up time, so when modbus_cli.py is run as a command it is only imported by import_pymodbus once a connection is opened
+#Until then no pymodbus exception can be raised, so the exceptions are one that is never raised
+class PymodbusNotImported(Exception):
+	pass
+
+ModbusTcpClient = None
+ExcCodes = None
+DecodePDU = None
+ModbusException = ModbusIOException = ConnectionException = PymodbusNotImported
 
 """
  ------------- HELPER FUNCTIONS -------------
 
- - number_to_two_16bit(number, data_type, client)
+ - number_to_two_16bit(number, data_type, client, order)
 	-> number -- number to convert to 16bit format
 	-> data_type -- datatype constant from pymodbus the number value should be (https://pymodbus.readthedocs.io/en/latest/source/simulator/datamodel.html#pymodbus.constants.DataType)
 	-> client -- pymodbus client object (only needed to access data_type constants)
-	RETURN: [high_bits, low_bits]; list with highest 16bits first, and lowest 16bits last
+	-> order -- byte/word order of the register values, ABCD (Default), CDAB, BADC or DCBA
+	RETURN: [high_bits, low_bits]; list with highest 16bits first, and lowest 16bits last (for ABCD)
 
- - number_to_four_16bit(number, data_type, client)
+ - number_to_four_16bit(number, data_type, client, order)
 	-> number -- number to conver to 16bit format
 	-> data_type -- datatype constant from pymodbus the number value should be (https://pymodbus.readthedocs.io/en/latest/source/simulator/datamodel.html#pymodbus.constants.DataType)
 	-> client -- pymodbus client object (only needed to access data_type constants)
-	RETURN: [part1, part2, part3, part4]; list with highest 16bits first, and lowest 16bits last
+	-> order -- byte/word order of the register values, ABCD (Default), CDAB, BADC or DCBA
+	RETURN: [part1, part2, part3, part4]; list with highest 16bits first, and lowest 16bits last (for ABCD)
+
+ - registers_to_number(registers, data_type, order)
+	-> registers -- list of 16bit register values making up one number
+	-> data_type -- datatype constant from pymodbus the registers hold
+	-> order -- byte/word order of the register values, ABCD (Default), CDAB, BADC or DCBA
+	RETURN: the decoded number
+
+ - bits_to_int(bits)
+	-> bits -- list of coil values, first coil first
+	RETURN: bitset int, bit 0 is the first coil
+
+ - int_to_bits(value, count)
+	-> value -- bitset int, bit 0 is the first coil
+	-> count -- number of coils
+	RETURN: list of count coil values, first coil first
+
+ - get_data_type(client, size, datatype)
+	-> client -- pymodbus client object (only needed to access data_type constants)
+	-> size -- register size in bits, 16, 32 or 64
+	-> datatype -- FLOAT, INT or UINT
+	RETURN: datatype constant from pymodbus, None for a size and datatype that is not supported (16bit FLOAT)
 """
 
 #Convert a 32bit number into two 16bit numbers
 #To send to the individual registers making up a 32bit number
-def number_to_two_16bit(number, data_type, client):
+def number_to_two_16bit(number, data_type, client, order="ABCD"):
+	buffer_order, value_order = struct_orders(*parse_order(order))
 	#Check the datatype being saved to pack it correctly
 	if data_type == client.DATATYPE.FLOAT32:
 		#conver the int to a float value
-		packed_value = struct.pack('>f', float(number))
+		packed_value = struct.pack(value_order + 'f', float(number))
 	elif data_type == client.DATATYPE.UINT32:
-		packed_value = struct.pack('>I', number)
+		packed_value = struct.pack(value_order + 'I', number)
 	elif data_type == client.DATATYPE.INT32:
-		packed_value = struct.pack('>i', number)
+		packed_value = struct.pack(value_order + 'i', number)
 
 	#get the high, and low values and return to calling function
-	high_bits, low_bits = struct.unpack('>HH', packed_value)
+	high_bits, low_bits = struct.unpack(buffer_order + 'HH', packed_value)
 	return [high_bits, low_bits]
 
 #Convert a 64bit number into four 16bit numbers
 #To send to the individual registers making up a 64 bit number
-def number_to_four_16bit(number, data_type, client):
+def number_to_four_16bit(number, data_type, client, order="ABCD"):
+	buffer_order, value_order = struct_orders(*parse_order(order))
 	if data_type == client.DATATYPE.FLOAT64:
 		#Convert the int to a 64-bit float
-		packed_value = struct.pack('>d', float(number))
+		packed_value = struct.pack(value_order + 'd', float(number))
 	elif data_type == client.DATATYPE.UINT64:
-		packed_value = struct.pack('>Q', number)
+		packed_value = struct.pack(value_order + 'Q', number)
 	elif data_type == client.DATATYPE.INT64:
-		packed_value = struct.pack('>q', number)
+		packed_value = struct.pack(value_order + 'q', number)
 
 	#get all the values and return to the calling function
-	part1, part2, part3, part4 = struct.unpack('>HHHH', packed_value)
+	part1, part2, part3, part4 = struct.unpack(buffer_order + 'HHHH', packed_value)
 
 	return [part1, part2, part3, part4]
 
+#Convert the registers making up one number back to the number, in a single unpack for any order
+def registers_to_number(registers, data_type, order="ABCD"):
+	buffer_order, value_order = struct_orders(*parse_order(order))
+	#The pymodbus datatype constant holds the struct format character of the number
+	packed_value = struct.pack(f"{buffer_order}{len(registers)}H", *registers)
+	return struct.unpack(value_order + data_type.value[0], packed_value)[0]
+
+#Pack a list of coil values into a bitset, so thousands of coils are a single int
+def bits_to_int(bits):
+	return int("".join(map("01".__getitem__, reversed(bits))) or "0", 2)
+
+#Unpack a bitset into a list of coil values
+def int_to_bits(value, count):
+	return [bool(value >> bit & 1) for bit in range(count)]
+
 """
   ------------- CLIENT FUNCTIONS  -------------
  - get_coil(client, coil_address)
@@ -64,6 +127,28 @@ def number_to_four_16bit(number, data_type, client):
 	-> device_id -- set the modbus slave_id of the client
 	RETURN: recieved value from coil
 
+ - get_coils(client, coil_address, count, device_id)
+	-> client -- pymodbus client object
+	-> coil_address -- physical address of the first coil
+	-> count -- number of coils to read in one request (1 to 2000)
+	-> device_id -- set the modbus slave_id of the client
+	RETURN: bitset int of the coils (bit 0 is coil_address), None if the read failed
+
+ - get_discrete_coils(client, coil_address, count, device_id)
+	-> client -- pymodbus client object
+	-> coil_address -- physical address of the first discrete coil
+	-> count -- number of discrete coils to read in one request (1 to 2000)
+	-> device_id -- set the modbus slave_id of the client
+	RETURN: bitset int of the discrete coils (bit 0 is coil_address), None if the read failed
+
+ - set_coils(client, coil_address, new_value, count, device_id)
+	-> client -- pymodbus client object
+	-> coil_address -- physical address of the first coil
+	-> new_value -- bitset int of the new coil values (bit 0 is coil_address)
+	-> count -- number of coils to write in one request (1 to 1968)
+	-> device_id -- set the modbus slave_id of the client
+	RETURN: boolean 1 if successful write, 0 if failed write
+
  - set_coil(client, coil_address, new_value)
 	-> client -- pymodbus client object
 	-> coil_address -- physical address of the coil
@@ -71,69 +156,101 @@ def number_to_four_16bit(number, data_type, client):
 	-> device_id -- set the modbus slave_id of the client
 	RETURN: boolean 1 if successful write, 0 if failed write
 
- - get_64bit_register(client, starting_address, data_type)
+ - get_64bit_register(client, starting_address, data_type, device_id, order)
 	-> client -- pymodbus client object
 	-> starting_address -- physical address of the first register in the set of 4 required
 	-> data_type -- The pymodbus constant for the register datatype (https://pymodbus.readthedocs.io/en/latest/source/simulator/datamodel.html#pymodbus.constants.DataType)
 	-> device_id -- set the modbus slave_id of the client
+	-> order -- byte/word order of the register, ABCD (Default), CDAB, BADC or DCBA
 	RETURN: recieved value from register
 
- - set_64bit_register(client, starting_address, new_value, data_type)
+ - set_64bit_register(client, starting_address, new_value, data_type, device_id, order)
 	-> client -- pymodbus client object
 	-> starting_address -- physical address of the first register in the set of 4 required
 	-> new_value -- new integer or float value to be saved in the 64bit Register
 	-> data_type -- The pymodbus constant for the register datatype (https://pymodbus.readthedocs.io/en/latest/source/simulator/datamodel.html#pymodbus.constants.DataType)
 	-> device_id -- set the modbus slave_id of the client
+	-> order -- byte/word order of the register, ABCD (Default), CDAB, BADC or DCBA
 	RETURN: boolean 1 if successful write, 0 if failed write
 
- - get_32bit_register(client, starting_address, data_type)
+ - get_32bit_register(client, starting_address, data_type, device_id, order)
 	-> client -- pymodbus client object
 	-> starting_address -- physical address of the first register in the set of 4 required
 	-> data_type -- The pymodbus constant for the register datatype (https://pymodbus.readthedocs.io/en/latest/source/simulator/datamodel.html#pymodbus.constants.DataType)
 	-> device_id -- set the modbus slave_id of the client
+	-> order -- byte/word order of the register, ABCD (Default), CDAB, BADC or DCBA
 	RETURN: recieved value from register
 
-- set_32bit_register(client, starting_address, new_value, data_type)
+- set_32bit_register(client, starting_address, new_value, data_type, device_id, order)
 	-> client -- pymodbus client object
 	-> starting_address -- physical address of the first register in the set of 4 required
 	-> new_value -- new integer or float value to be saved in the 32bit Register
 	-> data_type -- The pymodbus constant for the register datatype (https://pymodbus.readthedocs.io/en/latest/source/simulator/datamodel.html#pymodbus.constants.DataType)
 	-> device_id -- set the modbus slave_id of the client
+	-> order -- byte/word order of the register, ABCD (Default), CDAB, BADC or DCBA
 	RETURN: boolean 1 if successful write, 0 if failed write
 
- - get_16bit_register(client, starting_address, data_type)
+ - get_16bit_register(client, starting_address, data_type, device_id, order)
 	-> client -- pymodbus client object
 	-> starting_address -- physical address of the first register in the set of 4 required
 	-> data_type -- The pymodbus constant for the register datatype (https://pymodbus.readthedocs.io/en/latest/source/simulator/datamodel.html#pymodbus.constants.DataType)
 	-> device_id -- set the modbus slave_id of the client
+	-> order -- byte/word order of the register, ABCD (Default), CDAB, BADC or DCBA
 	RETURN: recieved value from register
 
-- set_16bit_register(client, starting_address, new_value, data_type)
+- set_16bit_register(client, starting_address, new_value, data_type, device_id, order)
 	-> client -- pymodbus client object
 	-> starting_address -- physical address of the first register in the set of 4 required
 	-> new_value -- new integer or float value to be saved in the 16bit Register
 	-> data_type -- The pymodbus constant for the register datatype (https://pymodbus.readthedocs.io/en/latest/source/simulator/datamodel.html#pymodbus.constants.DataType)
 	-> device_id -- set the modbus slave_id of the client
+	-> order -- byte/word order of the register, ABCD (Default), CDAB, BADC or DCBA
 	RETURN: boolean 1 if successful write, 0 if failed write
 
+ - get_input_register(client, starting_address, size, data_type, device_id, order)
+	-> client -- pymodbus client object
+	-> starting_address -- physical address of the first input register
+	-> size -- register size, 16, 32 or 64
+	-> data_type -- The pymodbus constant for the register datatype (https://pymodbus.readthedocs.io/en/latest/source/simulator/datamodel.html#pymodbus.constants.DataType)
+	-> device_id -- set the modbus slave_id of the client
+	-> order -- byte/word order of the register, ABCD (Default), CDAB, BADC or DCBA
+	RETURN: recieved value from the input register (function code 4), None if the read failed
+
 """
 
 #Get the coil value at the specified address | Given location %QX0.0-0.4 coil_address should be %QX0.coil_address
 def get_coil(client, coil_address, device_id):
-	return client.read_coils(coil_address, device_id=device_id).bits[0]
+	result = client.read_coils(coil_address, device_id=device_id)
+	return None if result.isError() else result.bits[0]
 
 #Get the discrete coil value at the specified address | Given location %IX0.0-0.4 coil_address should be %IX0.coil_address
 def get_discrete_coil(client, coil_address, device_id):
-	return client.read_discrete_coils(coil_address, device_id=device_id).bits[0]
+	result = client.read_discrete_inputs(coil_address, device_id=device_id)
+	return None if result.isError() else result.bits[0]
 
 #Set the coil value at the given address
 #new_value should be either (True or False)
 def set_coil(client, coil_address, new_value, device_id):
 	return not client.write_coil(coil_address, new_value, device_id=device_id).isError()
 
+#Get count coils from the address in a single request, as a bitset
+def get_coils(client, coil_address, count, device_id):
+	result = client.read_coils(coil_address, count=count, device_id=device_id)
+	#The response is padded to a whole byte, so only the coils asked for are kept
+	return None if result.isError() else bits_to_int(result.bits[:count])
+
+#Get count discrete coils from the address in a single request, as a bitset
+def get_discrete_coils(client, coil_address, count, device_id):
+	result = client.read_discrete_inputs(coil_address, count=count, device_id=device_id)
+	return None if result.isError() else bits_to_int(result.bits[:count])
+
+#Set count coils from the address to the bits of new_value in a single request
+def set_coils(client, coil_address, new_value, count, device_id):
+	return not client.write_coils(coil_address, int_to_bits(new_value, count), device_id=device_id).isError()
+
 
 #Get the unsigned int value in a register - 64bit
-def get_64bit_register(client, starting_address, data_type, device_id):
+def get_64bit_register(client, starting_address, data_type, device_id, order="ABCD"):
 
 	#Uses the given address and reads 4 registers to get the 16bit numbers
 	result = client.read_holding_registers(address=starting_address, count=4, device_id=device_id)
@@ -141,12 +258,8 @@ def get_64bit_register(client, starting_address, data_type, device_id):
 	#if there is no error then continue
 	if not result.isError():
 
-		#decode the two 16bit numbers to a big endian 64bit number
-		register_value = client.convert_from_registers(
-			result.registers,
-			data_type=data_type,
-			word_order="big"
-		)
+		#decode the 16bit numbers to a 64bit number with the given byte/word order
+		register_value = registers_to_number(result.registers, data_type, order)
 
 		#return the value
 		return register_value
@@ -154,28 +267,19 @@ def get_64bit_register(client, starting_address, data_type, device_id):
 		return None
 
 #Set the value of the given 64bit register
-def set_64bit_register(client, starting_address, new_value, data_type, device_id):
+def set_64bit_register(client, starting_address, new_value, data_type, device_id, order="ABCD"):
 	#Convert the new_value to four 16bit numbers
-	new_values = number_to_four_16bit(new_value, data_type, client)
-
-	#Get the result of the changing the first register
-	result = client.write_register(address=starting_address, value=new_values[0], device_id=device_id)
-
-	#Get the result of changing the second register
-	result_two = client.write_register(address=starting_address+1, value=new_values[1], device_id=device_id)
+	new_values = number_to_four_16bit(new_value, data_type, client, order)
 
-	#Get the result of changing the third register
-	result_three = client.write_register(address=starting_address+2, value=new_values[2], device_id=device_id)
+	#Write all four registers in a single request so the value is never seen half written
+	result = client.write_registers(address=starting_address, values=new_values, device_id=device_id)
 
-	#Get the result of changing the fourth register
-	result_four = client.write_register(address=starting_address+3, value=new_values[3], device_id=device_id)
-
-	#Check that all were successful
-	return not(result.isError() and result_two.isError() and result_three.isError() and result_four.isError())
+	#Check that the write was successful
+	return not result.isError()
 
 
 #Get the value in a register - 32bit
-def get_32bit_register(client, starting_address, data_type, device_id):
+def get_32bit_register(client, starting_address, data_type, device_id, order="ABCD"):
 
 	#Uses the given address and reads 2 registers to get the 16bit numbers
 	result = client.read_holding_registers(address=starting_address, count=2, device_id=device_id)
@@ -183,12 +287,8 @@ def get_32bit_register(client, starting_address, data_type, device_id):
 	#if there is no error then continue
 	if not result.isError():
 
-		#decode the two 16bit numbers to a big endian 32bit number
-		register_value = client.convert_from_registers(
-			result.registers,
-			data_type=data_type,
-			word_order="big"
-		)
+		#decode the 16bit numbers to a 32bit number with the given byte/word order
+		register_value = registers_to_number(result.registers, data_type, order)
 
 		#return the value
 		return register_value
@@ -196,39 +296,43 @@ def get_32bit_register(client, starting_address, data_type, device_id):
 		return None
 
 #Set the float value at the given register address
-def set_32bit_register(client, starting_address, new_value, data_type, device_id):
+def set_32bit_register(client, starting_address, new_value, data_type, device_id, order="ABCD"):
 	#Convert the new_int_value to two 16bit numbers
-	new_values = number_to_two_16bit(new_value, data_type, client)
+	new_values = number_to_two_16bit(new_value, data_type, client, order)
 
-	#Get the result of the changing the first register
-	result = client.write_register(address=starting_address, value=new_values[0], device_id=device_id)
-
-	#Get the result of the chaning the second register
-	result_two = client.write_register(address=starting_address+1, value=new_values[1], device_id=device_id)
-	return not (result.isError() and result_two.isError())
+	#Write both registers in a single request so the value is never seen half written
+	result = client.write_registers(address=starting_address, values=new_values, device_id=device_id)
+	return not result.isError()
 
 #Get the value of a 16bit register from the address
-def get_16bit_register(client, address, data_type, device_id):
+def get_16bit_register(client, address, data_type, device_id, order="ABCD"):
 	#Request the encoded register value
 	result = client.read_holding_registers(address=address, count=1, device_id=device_id)
 
 	if not result.isError():
 		#Decode the register value if there is no error
-		int_value = client.convert_from_registers(
-			result.registers,
-			data_type=data_type,
-			word_order="big"
-		)
+		int_value = registers_to_number(result.registers, data_type, order)
 		return int_value
 	else:
 		return None
 
 #Set the value of a 16bit register from the address
-def set_16bit_register(client, address, new_value, data_type, device_id):
+def set_16bit_register(client, address, new_value, data_type, device_id, order="ABCD"):
+	#Pack the value with the byte order, so signed and byte swapped values are written correctly
+	buffer_order, value_order = struct_orders(*parse_order(order))
+	register_value = struct.unpack(buffer_order + 'H', struct.pack(value_order + data_type.value[0], new_value))[0]
+
 	#Set the value and return if the result is an error
-	result = client.write_register(address=address, value=new_value, device_id=device_id)
+	result = client.write_register(address=address, value=register_value, device_id=device_id)
 	return not result.isError()
 
+#Get the value of an input register (function code 4), read only registers such as measurements
+def get_input_register(client, starting_address, size, data_type, device_id, order="ABCD"):
+	result = client.read_input_registers(starting_address, count=size // 16, device_id=device_id)
+	if result.isError():
+		return None
+	return registers_to_number(result.registers, data_type, order)
+
 def return_bool_val(value):
 	if value == 0:
 		return False
@@ -237,9 +341,2056 @@ def return_bool_val(value):
 	else:
 		return None
 
-def client():
-	#arg parser
-	parser = argparse.ArgumentParser(description="Modbus Interaction from the CLI to Read/Write to Coils and Registers")
+#Get the pymodbus datatype constant for a register size and datatype name (FLOAT, INT, UINT)
+#Returns None if the combination is not supported (16bit FLOAT)
+def get_data_type(client, size, datatype):
+	data_types = {
+		(16, "INT"): client.DATATYPE.INT16,
+		(16, "UINT"): client.DATATYPE.UINT16,
+		(32, "FLOAT"): client.DATATYPE.FLOAT32,
+		(32, "INT"): client.DATATYPE.INT32,
+		(32, "UINT"): client.DATATYPE.UINT32,
+		(64, "FLOAT"): client.DATATYPE.FLOAT64,
+		(64, "INT"): client.DATATYPE.INT64,
+		(64, "UINT"): client.DATATYPE.UINT64,
+	}
+	return data_types.get((size, datatype))
+
+"""
+  ------------- BULK CODEC FUNCTIONS  -------------
+ - parse_order(order)
+	-> order -- ABCD (big endian), CDAB (words swapped), BADC (bytes swapped) or DCBA (little endian)
+	RETURN: (word_order, byte_order) for the order; raises ValueError on a bad order
+
+ - decode_registers(registers, size, datatype, word_order, byte_order, use_numpy)
+	-> registers -- list (or NumPy array) of 16bit register values, a whole number of values long
+	-> size -- register size of each value (16, 32, 64)
+	-> datatype -- FLOAT, INT or UINT
+	-> word_order -- big (highest 16bits first) or little (lowest 16bits first)
+	-> byte_order -- big (highest byte of each register first) or little (bytes in each register swapped)
+	-> use_numpy -- return a NumPy array instead of a list (requires NumPy)
+	RETURN: list of every value in the registers; raises ValueError on a bad size, datatype or number of registers
+
+ - encode_registers(values, size, datatype, word_order, byte_order, use_numpy)
+	-> values -- list (or NumPy array) of values to convert
+	-> size, datatype, word_order, byte_order -- see decode_registers
+	-> use_numpy -- return a NumPy array instead of a list (requires NumPy)
+	RETURN: list of 16bit register values for all the values, in order; raises ValueError on a bad size, datatype or a value that does not fit
+"""
+
+#struct format character for each register size and datatype
+STRUCT_FORMATS = {
+	(16, "INT"): "h",
+	(16, "UINT"): "H",
+	(32, "FLOAT"): "f",
+	(32, "INT"): "i",
+	(32, "UINT"): "I",
+	(64, "FLOAT"): "d",
+	(64, "INT"): "q",
+	(64, "UINT"): "Q",
+}
+
+#Word order and byte order for each register order name
+#A is the highest byte of the value, so ABCD is big endian and DCBA is little endian
+ORDERS = {
+	"ABCD": ("big", "big"),
+	"CDAB": ("little", "big"),
+	"BADC": ("big", "little"),
+	"DCBA": ("little", "little"),
+}
+
+#Get the (word_order, byte_order) for an order name (ABCD, CDAB, BADC, DCBA)
+def parse_order(order):
+	if str(order).upper() not in ORDERS:
+		raise ValueError(f"order {order} must be ABCD, CDAB, BADC or DCBA")
+	return ORDERS[str(order).upper()]
+
+#Get the struct byte order to pack the registers with, and the byte order to unpack the values with
+#Packing the registers little endian swaps the bytes in each register, and unpacking the values little endian reverses the words
+#so every word/byte order is decoded in a single unpack with no extra pass over the values
+def struct_orders(word_order="big", byte_order="big"):
+	if word_order not in ["big", "little"] or byte_order not in ["big", "little"]:
+		raise ValueError("word and byte order must be big or little")
+	buffer_order = ">" if word_order == byte_order else "<"
+	value_order = ">" if word_order == "big" else "<"
+	return buffer_order, value_order
+
+#Import NumPy only when the NumPy backend is used
+def import_numpy():
+	try:
+		import numpy
+	except ImportError:
+		raise ValueError("the NumPy backend requires NumPy (pip3 install numpy)")
+	return numpy
+
+#Decode a whole array of registers into values of one datatype in a single pass
+def decode_registers(registers, size, datatype, word_order="big", byte_order="big", use_numpy=False):
+	if (size, datatype) not in STRUCT_FORMATS:
+		raise ValueError(f"{size}bit {datatype} is not supported")
+	count = size // 16
+	if len(registers) % count:
+		raise ValueError(f"{len(registers)} registers is not a whole number of {size}bit values")
+	buffer_order, value_order = struct_orders(word_order, byte_order)
+	value_format = STRUCT_FORMATS[(size, datatype)]
+
+	if use_numpy:
+		numpy = import_numpy()
+		buffer = numpy.asarray(registers, dtype=f"{buffer_order}u2").tobytes()
+		return numpy.frombuffer(buffer, dtype=f"{value_order}{value_format}")
+
+	buffer = struct.pack(f"{buffer_order}{len(registers)}H", *registers)
+	return list(struct.unpack(f"{value_order}{len(registers) // count}{value_format}", buffer))
+
+#Encode a whole array of values of one datatype into registers in a single pass
+def encode_registers(values, size, datatype, word_order="big", byte_order="big", use_numpy=False):
+	if (size, datatype) not in STRUCT_FORMATS:
+		raise ValueError(f"{size}bit {datatype} is not supported")
+	buffer_order, value_order = struct_orders(word_order, byte_order)
+	value_format = STRUCT_FORMATS[(size, datatype)]
+
+	if use_numpy:
+		numpy = import_numpy()
+		try:
+			buffer = numpy.asarray(values, dtype=f"{value_order}{value_format}").tobytes()
+		except OverflowError as e:
+			raise ValueError(f"value does not fit in {size}bit {datatype}: {e}")
+		return numpy.frombuffer(buffer, dtype=f"{buffer_order}u2")
+
+	try:
+		buffer = struct.pack(f"{value_order}{len(values)}{value_format}", *values)
+	except struct.error as e:
+		raise ValueError(f"value does not fit in {size}bit {datatype}: {e}")
+	return list(struct.unpack(f"{buffer_order}{len(buffer) // 2}H", buffer))
+
+"""
+  ------------- BATCH FUNCTIONS  -------------
+ - make_tag(tag_type, address, size, datatype, word_order, byte_order, scale, name, deadband, ttl)
+	-> tag_type -- register (holding), input (register), coil or discrete
+	-> address -- physical address of the register/coil
+	-> size -- register size (16, 32, 64), or for coils the number of coils read together as one bitset (Default: 1)
+	-> datatype -- FLOAT, INT or UINT, not used for coils
+	-> word_order -- big (highest 16bits first) or little (lowest 16bits first)
+	-> byte_order -- big (highest byte of each register first) or little (bytes in each register swapped)
+	-> scale -- number the read value is multiplied by, None to leave the value as read
+	-> name -- name of the tag for the output, None to use the address
+	-> deadband -- [amount, percent] from parse_deadband for change only output, None to use the default deadband
+	-> ttl -- seconds a cached read of the tag can be used for (see make_cache), None to use the ttl of the cache
+	RETURN: tag dictionary {"name", "type", "address", "size", "datatype", "count", "word_order", "byte_order", "scale", "format", "label", "deadband", "ttl"}; raises ValueError on a bad tag
+
+ - parse_tag(tag, order)
+	-> tag -- tag string, ADDRESS:SIZE:DATATYPE[:ORDER][:INPUT] for registers (1024:16:INT, 2048:32:FLOAT:CDAB, 30000:16:UINT:INPUT for an input register) or ADDRESS:COIL[:COUNT] / ADDRESS:DISCRETE[:COUNT] for coils (0:COIL, 0:COIL:2000 for a bitset of 2000 coils)
+	-> order -- byte/word order for registers that do not give one, ABCD (Default), CDAB, BADC or DCBA
+	RETURN: tag dictionary from make_tag; raises ValueError on a bad tag
+
+ - plan_reads(tags, max_gap)
+	-> tags -- list of tag dictionaries from make_tag
+	-> max_gap -- largest number of unused registers/coils allowed between two tags before starting a new request
+	RETURN: list of read blocks {"type", "start", "count", "tags", "fields", "ttl"}, each one fits in a single modbus request; fields is [tag, offset] with the byte (register) or bit (coil) offset of each tag, ttl is the shortest ttl of its tags
+
+ - compile_plan(tags, max_gap)
+	-> tags -- list of tag dictionaries from make_tag
+	-> max_gap -- see plan_reads
+	RETURN: read plan {"tags", "blocks", "max_gap"} that can be read many times with read_plan
+
+ - read_plan(client, plan, device_id)
+	-> client -- pymodbus client object
+	-> plan -- read plan from compile_plan or load_tag_map
+	-> device_id -- set the modbus slave_id of the client
+	RETURN: list of [tag, value] in the order of the plan tags; value is None if the read failed
+
+ - read_plan_blocks(client, plan, device_id)
+	-> client -- pymodbus client object
+	-> plan -- read plan from compile_plan or load_tag_map
+	-> device_id -- set the modbus slave_id of the client
+	RETURN: list of pymodbus responses in the order of the plan blocks, None for a block that could not be read
+
+ - decode_plan(plan, results)
+	-> plan -- read plan from compile_plan or load_tag_map
+	-> results -- list of responses from read_plan_blocks (anything with isError() and registers or bits)
+	RETURN: list of [tag, value] the same as read_plan
+
+ - read_batch(client, tags, device_id, max_gap)
+	-> client -- pymodbus client object
+	-> tags -- list of tag dictionaries from parse_tag
+	-> device_id -- set the modbus slave_id of the client
+	-> max_gap -- see plan_reads
+	RETURN: list of [tag, value] in the order the tags were given; value is None if the read failed
+
+ - read_block(client, block, device_id)
+	-> client -- pymodbus client object
+	-> block -- read block from plan_reads
+	-> device_id -- set the modbus slave_id of the client
+	RETURN: pymodbus response for the whole block
+
+ - decode_block(block, result, values)
+	-> block -- read block from plan_reads
+	-> result -- pymodbus response from read_block
+	-> values -- dictionary the decoded value of each tag is saved in, keyed by id(tag); None if the read failed
+
+ - parse_write_tag(tag, order)
+	-> tag -- tag string with a value, ADDRESS:SIZE:DATATYPE[:ORDER]=VALUE (1024:16:INT=5), or ADDRESS:COIL[:COUNT]=BITS (0:COIL=1, 0:COIL:8=0b10100101, bit 0 is the first coil)
+	-> order -- see parse_tag
+	RETURN: tag dictionary from parse_tag with the "value" and the encoded "registers" (or coil "bits") added; raises ValueError on a bad tag
+
+ - plan_writes(tags)
+	-> tags -- list of tag dictionaries from parse_write_tag
+	RETURN: list of write blocks {"type", "start", "count", "tags", "registers"} (or "bits" for coils), each one is contiguous and fits in a single modbus request
+
+ - write_batch(client, tags, device_id)
+	-> client -- pymodbus client object
+	-> tags -- list of tag dictionaries from parse_write_tag
+	-> device_id -- set the modbus slave_id of the client
+	RETURN: list of [tag, error] in the order the tags were given; error is None if the request holding the tag was successful. Once the connection is lost the tags of the requests not yet sent get "not attempted" as their error
+"""
+
+#Largest number of registers/coils that fit into a single read request PDU
+MAX_READ_REGISTERS = 125
+MAX_READ_COILS = 2000
+
+#Largest number of registers/coils that fit into a single write_registers/write_coils request PDU
+MAX_WRITE_REGISTERS = 123
+MAX_WRITE_COILS = 1968
+
+#Read request of each tag type: holding registers, input registers, coils and discrete inputs
+READ_FUNCTIONS = {"register": "read_holding_registers", "input": "read_input_registers", "coil": "read_coils", "discrete": "read_discrete_inputs"}
+
+#Default number of unused addresses read between two tags instead of sending a new request
+DEFAULT_MAX_GAP = 8
+
+#Build a tag dictionary, checking every field is valid
+#The struct format and output label are worked out here once, so reading the tag is only a lookup
+def make_tag(tag_type, address, size=None, datatype=None, word_order="big", byte_order="big", scale=None, name=None, deadband=None, ttl=None):
+	if address < 0 or address > 65535:
+		raise ValueError("address must be between 0 and 65535")
+	if ttl is not None and ttl < 0:
+		raise ValueError("ttl must not be negative")
+	if tag_type not in READ_FUNCTIONS:
+		raise ValueError("type must be register, input, coil or discrete")
+
+	if tag_type in ["register", "input"]:
+		if size not in [16, 32, 64]:
+			raise ValueError("size must be 16, 32 or 64")
+		if datatype not in ["FLOAT", "INT", "UINT"]:
+			raise ValueError("datatype must be FLOAT, INT or UINT")
+		if size == 16 and datatype == "FLOAT":
+			raise ValueError("16bit Register Size does not support type FLOAT")
+		count = size // 16
+		#The tag format starts with the byte order of the packed registers, and then the struct format for the value
+		buffer_order, value_order = struct_orders(word_order, byte_order)
+		tag_format = buffer_order + value_order + STRUCT_FORMATS[(size, datatype)]
+		label = f"Register {address}-{address+count-1}" if count > 1 else f"Register {address}"
+	else:
+		#Many coils can be read as one tag, the value is then a bitset
+		if size is None:
+			size = 1
+		if size < 1 or size > MAX_READ_COILS:
+			raise ValueError(f"coil count must be between 1 and {MAX_READ_COILS}")
+		datatype, count, tag_format = None, size, None
+		label = f"{tag_type.capitalize()} {address}-{address+count-1}" if count > 1 else f"{tag_type.capitalize()} {address}"
+	if address + count > 65536:
+		raise ValueError("tag runs past address 65535")
+	if tag_type == "input":
+		label = "Input " + label
+
+	#Named tags (from a tag map) show the name first
+	if name is None:
+		name = label
+	else:
+		label = f"{name} ({label})"
+
+	return {"name": name, "type": tag_type, "address": address, "size": size, "datatype": datatype, "count": count,
+		"word_order": word_order, "byte_order": byte_order, "scale": scale, "format": tag_format, "label": label, "deadband": deadband, "ttl": ttl}
+
+#Parse a tag given on the command line into a tag dictionary
+def parse_tag(tag, order="ABCD"):
+	parts = tag.split(":")
+	try:
+		address = int(parts[0])
+	except ValueError:
+		raise ValueError(f"tag {tag} does not start with a valid address")
+
+	try:
+		#Coils and discrete coils only need the address, and the number of coils for a bitset
+		if len(parts) in [2, 3] and parts[1].upper() in ["COIL", "DISCRETE"]:
+			try:
+				count = int(parts[2]) if len(parts) == 3 else 1
+			except ValueError:
+				raise ValueError("has an invalid coil count")
+			return make_tag(parts[1].lower(), address, count)
+
+		#Input registers end with INPUT
+		tag_type = "register"
+		if len(parts) in [4, 5] and parts[-1].upper() == "INPUT":
+			tag_type = "input"
+			parts = parts[:-1]
+
+		if len(parts) not in [3, 4]:
+			raise ValueError("should be ADDRESS:SIZE:DATATYPE[:ORDER][:INPUT] or ADDRESS:COIL[:COUNT]")
+
+		try:
+			size = int(parts[1])
+		except ValueError:
+			raise ValueError("has an invalid size")
+		word_order, byte_order = parse_order(parts[3] if len(parts) == 4 else order)
+		return make_tag(tag_type, address, size, parts[2].upper(), word_order, byte_order)
+	except ValueError as e:
+		raise ValueError(f"tag {tag} {e}")
+
+#Group the tags into the fewest read requests
+#Tags of the same type are sorted by address and merged while the gap between them is small and the block still fits in one PDU
+#Each block lists the byte offset (registers) or bit offset (coils) of every tag in the response, so decoding needs no searching
+def plan_reads(tags, max_gap=DEFAULT_MAX_GAP):
+	blocks = []
+	for tag_type in READ_FUNCTIONS:
+		max_count = MAX_READ_REGISTERS if tag_type in ["register", "input"] else MAX_READ_COILS
+		block = None
+		for tag in sorted((t for t in tags if t["type"] == tag_type), key=lambda t: t["address"]):
+			tag_end = tag["address"] + tag["count"]
+			if block is not None:
+				block_end = block["start"] + block["count"]
+				#Extend the current block if the tag is close enough and the block does not get too large
+				if tag["address"] - block_end <= max_gap and max(tag_end, block_end) - block["start"] <= max_count:
+					block["count"] = max(tag_end, block_end) - block["start"]
+					block["tags"].append(tag)
+					continue
+				blocks.append(block)
+			block = {"type": tag_type, "start": tag["address"], "count": tag["count"], "tags": [tag]}
+		if block is not None:
+			blocks.append(block)
+
+	for block in blocks:
+		width = 2 if block["type"] in ["register", "input"] else 1
+		block["fields"] = [[tag, (tag["address"] - block["start"]) * width] for tag in block["tags"]]
+		block["ttl"] = block_ttl(block["tags"])
+	return blocks
+
+#Get the shortest ttl of the tags in a block, None if none of them have their own ttl
+def block_ttl(tags):
+	ttls = [tag["ttl"] for tag in tags if tag.get("ttl") is not None]
+	return min(ttls) if ttls else None
+
+#Plan the reads for a list of tags once, so the same plan can be read again and again
+def compile_plan(tags, max_gap=DEFAULT_MAX_GAP):
+	return {"tags": tags, "blocks": plan_reads(tags, max_gap), "max_gap": max_gap}
+
+#Send the read request for a block from plan_reads
+#A block with its own ttl is answered from the cache (see cache_client) only while its values are that fresh
+def read_block(client, block, device_id):
+	if block.get("ttl") is None:
+		return send_block_read(client, block, device_id)
+	client.read_ttl = block["ttl"]
+	try:
+		return send_block_read(client, block, device_id)
+	finally:
+		client.read_ttl = None
+
+def send_block_read(client, block, device_id):
+	return getattr(client, READ_FUNCTIONS[block["type"]])(block["start"], count=block["count"], device_id=device_id)
+
+#Check if a register block is one run of tags with the same size, datatype and order and no gaps, such as a tag map of consecutive FLOATs
+#Those blocks are decoded with decode_registers in one pass, the check is only done the first time the block is decoded
+def block_array(block):
+	if "array" not in block:
+		first = block["fields"][0][0]
+		run = len(block["fields"]) > 1 and all(tag["format"] == first["format"] and offset == number * first["count"] * 2 for number, (tag, offset) in enumerate(block["fields"]))
+		block["array"] = [first["size"], first["datatype"], first["word_order"], first["byte_order"]] if run else None
+	return block["array"]
+
+#Decode each tag of a block out of the read result, and save the value in values (keyed by id of the tag)
+def decode_block(block, result, values):
+	#If the block failed (or got no response) then every tag in it failed
+	if result is None or result.isError():
+		for tag in block["tags"]:
+			values[id(tag)] = None
+		return
+
+	if block["type"] in ["register", "input"]:
+		registers = result.registers
+		array = block_array(block)
+		if array is not None:
+			decoded = decode_registers(registers[:len(block["fields"]) * array[0] // 16], *array)
+			for (tag, offset), value in zip(block["fields"], decoded):
+				values[id(tag)] = value if tag["scale"] is None else value * tag["scale"]
+			return
+
+		#Mixed blocks pack the registers to bytes once, then unpack each tag straight from its offset
+		buffers = {}
+		for tag, offset in block["fields"]:
+			order = tag["format"][0]
+			if order not in buffers:
+				buffers[order] = struct.pack(f"{order}{len(registers)}H", *registers)
+			value = struct.unpack_from(tag["format"][1:], buffers[order], offset)[0]
+			values[id(tag)] = value if tag["scale"] is None else value * tag["scale"]
+	else:
+		bits = result.bits
+		bitset = None
+		for tag, offset in block["fields"]:
+			if tag["count"] == 1:
+				values[id(tag)] = bits[offset]
+				continue
+			#Tags of many coils are cut out of a bitset of the whole block, packed once
+			if bitset is None:
+				bitset = bits_to_int(bits[:block["count"]])
+			values[id(tag)] = bitset >> offset & ((1 << tag["count"]) - 1)
+
+#Send the requests for every block of a plan from compile_plan, without decoding them
+#A block that times out or cannot be read has no response, and the rest of the blocks are still read
+def read_plan_blocks(client, plan, device_id):
+	#With enable_pipeline the block requests are sent without waiting for each response
+	if getattr(client, "pipeline", None) is not None and len(plan["blocks"]) > 1:
+		try:
+			return read_blocks_pipelined(client, plan["blocks"], device_id)
+		except ModbusException:
+			return [None] * len(plan["blocks"])
+	results = []
+	for block in plan["blocks"]:
+		try:
+			results.append(read_block(client, block, device_id))
+		except ModbusException:
+			results.append(None)
+	return results
+
+#Read every tag of a plan from compile_plan
+#A block that times out or cannot be read fails its tags, and the rest of the blocks are still read
+def read_plan(client, plan, device_id):
+	return decode_plan(plan, read_plan_blocks(client, plan, device_id))
+
+#Decode every tag of a plan out of the responses to its blocks
+def decode_plan(plan, results):
+	values = {}
+	for block, result in zip(plan["blocks"], results):
+		decode_block(block, result, values)
+
+	#Return the values in the order the tags were given
+	return [[tag, values[id(tag)]] for tag in plan["tags"]]
+
+#Read every tag using the requests from plan_reads, and decode each tag out of the returned block
+def read_batch(client, tags, device_id, max_gap=DEFAULT_MAX_GAP):
+	return read_plan(client, compile_plan(tags, max_gap), device_id)
+
+#Get the name of a tag for the output, as Register 1024, Register 2048-2049 or Coil 0
+def tag_label(tag):
+	return tag["label"]
+
+#Parse a tag with a value given on the command line into a tag dictionary
+def parse_write_tag(tag, order="ABCD"):
+	if "=" not in tag:
+		raise ValueError(f"tag {tag} should be ADDRESS:SIZE:DATATYPE[:ORDER]=VALUE")
+	name, value = tag.split("=", 1)
+	parsed = parse_tag(name, order)
+	if parsed["type"] in ["input", "discrete"]:
+		raise ValueError(f"tag {tag} is read only")
+
+	#Coils are written from the bits of the value, 1 or 0 for a single coil
+	if parsed["type"] == "coil":
+		try:
+			parsed["value"] = int(value, 0)
+		except ValueError:
+			raise ValueError(f"tag {tag} value is not a valid number")
+		if parsed["value"] < 0 or parsed["value"] >= 1 << parsed["count"]:
+			raise ValueError(f"tag {tag} value does not fit in {parsed['count']} coil(s)")
+		if parsed["count"] > MAX_WRITE_COILS:
+			raise ValueError(f"tag {tag} writes more than {MAX_WRITE_COILS} coils")
+		parsed["bits"] = int_to_bits(parsed["value"], parsed["count"])
+		return parsed
+
+	#Check the value matches the datatype of the tag
+	try:
+		if parsed["datatype"] == "FLOAT":
+			parsed["value"] = float(value)
+		else:
+			parsed["value"] = int(value)
+			if parsed["datatype"] == "UINT" and parsed["value"] < 0:
+				raise ValueError
+	except ValueError:
+		raise ValueError(f"tag {tag} value is not a valid {parsed['datatype']}")
+
+	#Encode the value now, so a value that does not fit is found before anything is written
+	try:
+		parsed["registers"] = encode_registers([parsed["value"]], parsed["size"], parsed["datatype"], parsed["word_order"], parsed["byte_order"])
+	except ValueError:
+		raise ValueError(f"tag {tag} value does not fit in {parsed['size']}bit {parsed['datatype']}")
+	return parsed
+
+#Group the tags into the fewest write requests
+#Only tags that are directly next to each other can share a request, as every register (or coil) in the request is written
+def plan_writes(tags):
+	blocks = []
+	for tag_type in ["register", "coil"]:
+		max_count = MAX_WRITE_REGISTERS if tag_type == "register" else MAX_WRITE_COILS
+		values = "registers" if tag_type == "register" else "bits"
+		block = None
+		for tag in sorted((t for t in tags if t["type"] == tag_type), key=lambda t: t["address"]):
+			if block is not None:
+				block_end = block["start"] + block["count"]
+				if tag["address"] < block_end:
+					raise ValueError(f"{tag['name']} overlaps {block['tags'][-1]['name']}")
+				#Extend the current block if the tag starts right where it ends and still fits in one PDU
+				if tag["address"] == block_end and block["count"] + tag["count"] <= max_count:
+					block["count"] += tag["count"]
+					block["tags"].append(tag)
+					block[values] += tag[values]
+					continue
+				blocks.append(block)
+			block = {"type": tag_type, "start": tag["address"], "count": tag["count"], "tags": [tag], values: list(tag[values])}
+		if block is not None:
+			blocks.append(block)
+	return blocks
+
+#Write every tag using the requests from plan_writes
+#Each request is reported on its own, so a failed request does not hide the ones that were successful
+def write_batch(client, tags, device_id):
+	errors = {}
+	blocks = plan_writes(tags)
+	for number, block in enumerate(blocks):
+		try:
+			if block["type"] == "coil":
+				result = client.write_coils(block["start"], block["bits"], device_id=device_id)
+			else:
+				result = client.write_registers(address=block["start"], values=block["registers"], device_id=device_id)
+			error = str(result) if result.isError() else None
+		except ConnectionException as e:
+			error = f"not sent: {e}"
+		except (ModbusException, OSError) as e:
+			#A request without a response may still have been written by the device
+			error = f"no response, the value may have been written: {e}"
+		for tag in block["tags"]:
+			errors[id(tag)] = error
+
+		#Once the connection is lost the rest of the requests are not sent
+		if error is not None and not client.connected:
+			for skipped in blocks[number + 1:]:
+				for tag in skipped["tags"]:
+					errors[id(tag)] = "not attempted, the connection was lost"
+			break
+
+	#Return the errors in the order the tags were given
+	return [[tag, errors[id(tag)]] for tag in tags]
+
+"""
+  ------------- PIPELINE FUNCTIONS  -------------
+ - enable_pipeline(client, window)
+	-> client -- pymodbus ModbusTcpClient object
+	-> window -- largest number of requests sent on the connection before waiting for a response, 1 to send one at a time
+	RETURN: None; read_plan then keeps up to window block requests in flight, matching the responses by transaction ID
+
+ - read_blocks_pipelined(client, blocks, device_id)
+	-> client -- connected pymodbus client object from enable_pipeline
+	-> blocks -- list of read blocks from plan_reads
+	-> device_id -- set the modbus slave_id of the client
+	RETURN: list of pymodbus responses in the order of blocks; raises ModbusIOException if a request gets no response
+	A device that drops, mixes up or answers the wrong pipelined request is read one request at a time from then on
+"""
+
+#Turn on (or off with a window of 1) pipelined reads for a client
+def enable_pipeline(client, window):
+	client.pipeline = {"window": window, "next_tid": 0, "buffer": b"", "decoder": None} if window > 1 else None
+
+#Request class for each type of block, filled in by import_pymodbus
+BLOCK_REQUESTS = {}
+
+#Build the request PDU for a block
+def block_request(block, device_id):
+	return BLOCK_REQUESTS[block["type"]](address=block["start"], count=block["count"], dev_id=device_id)
+
+#Wait for the next Modbus TCP frame on the connection, returns (transaction id, pdu bytes) or None if there was no response in time
+def receive_frame(client, pipeline, timeout):
+	deadline = time.monotonic() + timeout
+	while True:
+		buffer = pipeline["buffer"]
+		#The MBAP header is transaction id, protocol id, length (of the unit id and pdu) and unit id
+		if len(buffer) >= 7:
+			tid, protocol, length = struct.unpack_from(">HHH", buffer)
+			if len(buffer) >= 6 + length:
+				pipeline["buffer"] = buffer[6 + length:]
+				return tid, buffer[7:6 + length]
+		remaining = deadline - time.monotonic()
+		if remaining <= 0 or not select.select([client.socket], [], [], remaining)[0]:
+			return None
+		data = client.socket.recv(65536)
+		if not data:
+			return None
+		pipeline["buffer"] += data
+
+#Go back to one request at a time, on a new connection so late responses are not read as the answer to the next request
+def stop_pipelining(client, pipeline, reason):
+	if pipeline["window"] > 1:
+		print(f"Warning: {client.comm_params.host}:{client.comm_params.port} {reason}, sending one request at a time", file=sys.stderr)
+	pipeline["window"] = 1
+	pipeline["buffer"] = b""
+	client.close()
+	if not client.connect():
+		raise ConnectionException(f"Failed to connect[{client}]")
+
+#Send the requests for every block, keeping up to the window of requests waiting on a response
+def read_blocks_pipelined(client, blocks, device_id):
+	pipeline = client.pipeline
+	if pipeline["decoder"] is None:
+		pipeline["decoder"] = DecodePDU(is_server=False)
+	#The device policy is used for the timeout, and a device that is being skipped is not read
+	policy = getattr(client, "policy", None)
+	if policy is not None:
+		check_circuit(policy, f"{client.comm_params.host}:{client.comm_params.port}")
+		client.comm_params.timeout_connect = policy_timeout(policy)
+	if not client.connected and not client.connect():
+		if policy is not None:
+			record_failure(policy)
+		raise ConnectionException(f"Failed to connect[{client}]")
+	timeout = client.comm_params.timeout_connect
+	request_metrics = getattr(client, "request_metrics", None)
+
+	requests = [block_request(block, device_id) for block in blocks]
+	results = [None] * len(requests)
+	waiting = list(range(len(requests)))
+	#Blocks read recently enough are answered from the cache, the rest are sent
+	device = f"{client.comm_params.host}:{client.comm_params.port}"
+	read_cache = getattr(client, "cache", None)
+	if read_cache is not None:
+		writes = read_cache["writes"]
+		for index, block in enumerate(blocks):
+			results[index] = cached_read(client, device, requests[index], block.get("ttl"))
+		waiting = [index for index in waiting if results[index] is None]
+	#Transaction id -> [index of the request, time it was sent]
+	in_flight = {}
+	while waiting or in_flight:
+		#Fill the window, in one send
+		frames = []
+		while waiting and len(in_flight) < pipeline["window"]:
+			index = waiting.pop(0)
+			request = requests[index]
+			tid = pipeline["next_tid"] = (pipeline["next_tid"] + 1) % 65536
+			pdu = bytes([request.function_code]) + request.encode()
+			frames.append(struct.pack(">HHHB", tid, 0, len(pdu) + 1, device_id) + pdu)
+			in_flight[tid] = [index, time.perf_counter()]
+		if frames:
+			client.socket.settimeout(timeout)
+			client.socket.sendall(b"".join(frames))
+
+		frame = receive_frame(client, pipeline, timeout)
+		response = None
+		if frame is not None and frame[0] in in_flight:
+			index, sent = in_flight[frame[0]]
+			response = pipeline["decoder"].decode(frame[1])
+			#The response has to be for the function that was asked for (or its exception response)
+			if response is not None and response.function_code & 0x7F != requests[index].function_code:
+				response = None
+		elif frame is not None and pipeline["window"] == 1:
+			#A late response to a request that already timed out
+			continue
+
+		if response is None:
+			#Send the requests again one at a time, this device cannot be pipelined
+			if pipeline["window"] > 1:
+				reason = "did not respond to pipelined requests" if frame is None else "mixed up the responses to pipelined requests"
+				stop_pipelining(client, pipeline, reason)
+				waiting = sorted(index for index, sent in in_flight.values()) + waiting
+				in_flight.clear()
+				continue
+			#Already one request at a time, and still no response
+			if policy is not None:
+				record_failure(policy)
+			stop_pipelining(client, pipeline, "did not respond")
+			raise ModbusIOException("No response received to a pipelined request")
+
+		del in_flight[frame[0]]
+		results[index] = response
+		if read_cache is not None:
+			cache_response(read_cache, device, requests[index], response, writes)
+		if policy is not None:
+			record_rtt(policy, time.perf_counter() - sent)
+		if request_metrics is not None:
+			metrics, metrics_device = request_metrics
+			series = metric_series(metrics, metrics_device, requests[index].function_code)
+			record_request(metrics, series, time.perf_counter() - sent, response, None)
+	return results
+
+"""
+  ------------- TAG MAP FUNCTIONS  -------------
+ - parse_tag_map(path, order)
+	-> path -- CSV (.csv) or YAML (.yaml, .yml) tag map with the fields name, address, type, size, datatype, order (or word_order and byte_order), scale, deadband, ttl
+	-> order -- byte/word order for tags that do not give one, ABCD (Default), CDAB, BADC or DCBA
+	RETURN: list of tag dictionaries from make_tag; raises ValueError on a bad tag
+
+ - load_tag_map(path, max_gap, use_cache, order)
+	-> path -- tag map file, see parse_tag_map
+	-> max_gap -- see plan_reads
+	-> use_cache -- save the compiled plan in the plan cache directory (see plan_cache_path), and load it while the tag map is unchanged
+	-> order -- see parse_tag_map
+	RETURN: read plan from compile_plan; raises ValueError on a bad tag map
+
+ - plan_cache_path(path)
+	-> path -- tag map file
+	RETURN: path of the compiled plan for the tag map, in $XDG_CACHE_HOME/modbus_cli (Default: ~/.cache/modbus_cli)
+
+ - plan_to_json(plan)
+	-> plan -- read plan from compile_plan or load_tag_map
+	RETURN: the plan as a dictionary that can be saved as JSON
+
+ - plan_from_json(data)
+	-> data -- dictionary from plan_to_json
+	RETURN: read plan, the same as compile_plan
+"""
+
+#Increase when the plan cache layout changes, so old caches are rebuilt
+PLAN_CACHE_VERSION = 6
+
+#Build a tag from one row of a tag map; empty fields use the defaults
+def tag_map_row_to_tag(row, order="ABCD"):
+	tag_type = str(row.get("type") or "register").lower()
+	#Holding is accepted as another name for a register
+	if tag_type == "holding":
+		tag_type = "register"
+	elif tag_type == "input_register":
+		tag_type = "input"
+	try:
+		address = int(row["address"])
+		size = int(row["size"]) if row.get("size") not in [None, ""] else None
+		scale = float(row["scale"]) if row.get("scale") not in [None, ""] else None
+		ttl = float(row["ttl"]) if row.get("ttl") not in [None, ""] else None
+	except (KeyError, TypeError, ValueError):
+		raise ValueError("needs a valid address, and size, scale and ttl must be numbers")
+	datatype = str(row["datatype"]).upper() if row.get("datatype") not in [None, ""] else None
+	#The order field (ABCD, CDAB, BADC, DCBA) sets both orders, or word_order and byte_order can be given on their own
+	word_order, byte_order = parse_order(row.get("order") or order)
+	word_order = str(row.get("word_order") or word_order).lower()
+	byte_order = str(row.get("byte_order") or byte_order).lower()
+	name = str(row["name"]) if row.get("name") not in [None, ""] else None
+	deadband = parse_deadband(str(row["deadband"])) if row.get("deadband") not in [None, ""] else None
+	return make_tag(tag_type, address, size, datatype, word_order, byte_order, scale, name, deadband, ttl)
+
+#Read a CSV or YAML tag map into a list of tags
+def parse_tag_map(path, order="ABCD"):
+	if path.endswith((".yaml", ".yml")):
+		#PyYAML is only needed when using a YAML tag map
+		try:
+			import yaml
+		except ImportError:
+			raise ValueError("YAML tag maps require PyYAML (pip3 install pyyaml)")
+		with open(path) as map_file:
+			rows = yaml.safe_load(map_file) or []
+		if isinstance(rows, dict):
+			rows = rows.get("tags", [])
+		first_row = 1
+	else:
+		with open(path, newline="") as map_file:
+			rows = [row for row in csv.DictReader(map_file) if any(row.values())]
+		#Line 1 is the CSV header
+		first_row = 2
+
+	tags = []
+	for number, row in enumerate(rows, first_row):
+		if not isinstance(row, dict):
+			raise ValueError(f"{path} tag {number} is not a mapping")
+		try:
+			tags.append(tag_map_row_to_tag(row, order))
+		except ValueError as e:
+			raise ValueError(f"{path} tag {number} {e}")
+	if not tags:
+		raise ValueError(f"{path} has no tags")
+	return tags
+
+#Convert a compiled plan to a JSON dictionary. Blocks refer to tags by their index in the plan
+def plan_to_json(plan):
+	index = {id(tag): number for number, tag in enumerate(plan["tags"])}
+	return {
+		"max_gap": plan["max_gap"],
+		"tags": plan["tags"],
+		"blocks": [{"type": block["type"], "start": block["start"], "count": block["count"],
+			"fields": [[index[id(tag)], offset] for tag, offset in block["fields"]]} for block in plan["blocks"]],
+	}
+
+#Convert a JSON dictionary from plan_to_json back to a compiled plan
+def plan_from_json(data):
+	tags = data["tags"]
+	blocks = []
+	for block in data["blocks"]:
+		fields = [[tags[number], offset] for number, offset in block["fields"]]
+		block_tags = [tag for tag, offset in fields]
+		blocks.append({"type": block["type"], "start": block["start"], "count": block["count"],
+			"tags": block_tags, "fields": fields, "ttl": block_ttl(block_tags)})
+	return {"tags": tags, "blocks": blocks, "max_gap": data["max_gap"]}
+
+#Save a compiled plan as JSON
+def save_plan_cache(cache_path, plan, source):
+	cache = dict(plan_to_json(plan), version=PLAN_CACHE_VERSION, source=source)
+	with open(cache_path, "w") as cache_file:
+		json.dump(cache, cache_file)
+
+#Load a compiled plan saved by save_plan_cache, None if it is missing or out of date
+def load_plan_cache(cache_path, source, max_gap):
+	try:
+		with open(cache_path) as cache_file:
+			cache = json.load(cache_file)
+	except (OSError, ValueError):
+		return None
+	if cache.get("version") != PLAN_CACHE_VERSION or cache.get("source") != source or cache.get("max_gap") != max_gap:
+		return None
+	return plan_from_json(cache)
+
+#Get where the compiled plan of a tag map is cached
+#The plans are kept in the user's cache directory, so nothing is written next to the tag map, and each tag map gets its own file from its full path
+def plan_cache_path(path):
+	cache_dir = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "modbus_cli")
+	key = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+	return os.path.join(cache_dir, f"{os.path.basename(path)}-{key}.plan.json")
+
+#Load a tag map and compile it into a read plan
+#The compiled plan is cached, so later runs skip parsing and checking every tag
+def load_tag_map(path, max_gap=DEFAULT_MAX_GAP, use_cache=True, order="ABCD"):
+	cache_path = plan_cache_path(path)
+	stat = os.stat(path)
+	#The default order changes the compiled tags, so it is part of what the cache was built from
+	source = [stat.st_mtime_ns, stat.st_size, str(order).upper()]
+
+	if use_cache:
+		plan = load_plan_cache(cache_path, source, max_gap)
+		if plan is not None:
+			return plan
+
+	plan = compile_plan(parse_tag_map(path, order), max_gap)
+	if use_cache:
+		#The cache is only a speed up, so a cache directory that cannot be written is not an error
+		try:
+			os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+			save_plan_cache(cache_path, plan, source)
+		except OSError:
+			pass
+	return plan
+
+"""
+  ------------- CHANGE FILTER FUNCTIONS  -------------
+ - parse_deadband(deadband)
+	-> deadband -- amount a value must change by to be output, as a number (0.5) or a percent of the last output value (2%)
+	RETURN: [amount, percent]; raises ValueError on a bad deadband
+
+ - make_change_filter(deadband, heartbeat)
+	-> deadband -- [amount, percent] from parse_deadband used for tags without their own deadband, None to output any change
+	-> heartbeat -- seconds after which a tag is output even if it has not changed, None for no heartbeat
+	RETURN: change filter dictionary holding the last output value of each tag
+
+ - filter_changes(change_filter, results, now)
+	-> change_filter -- change filter dictionary from make_change_filter
+	-> results -- list of [tag, value] from read_plan
+	-> now -- current time.monotonic()
+	RETURN: the [tag, value] results that changed (or are due a heartbeat) since they were last output
+"""
+
+#Parse a deadband given as an amount (0.5) or a percent (2%)
+def parse_deadband(deadband):
+	text = str(deadband).strip()
+	percent = text.endswith("%")
+	try:
+		amount = float(text.rstrip("%"))
+	except ValueError:
+		raise ValueError(f"deadband {deadband} should be a number or a percent (0.5 or 2%)")
+	if amount < 0:
+		raise ValueError(f"deadband {deadband} should not be negative")
+	return [amount, percent]
+
+#Build an empty change filter
+def make_change_filter(deadband=None, heartbeat=None):
+	return {"deadband": deadband, "heartbeat": heartbeat, "last": {}}
+
+#Check if a value has moved outside the deadband of the last output value
+def outside_deadband(value, last_value, deadband):
+	#Read errors, coils and values without a deadband are output on any change
+	if deadband is None or isinstance(value, bool) or not isinstance(value, (int, float)) or not isinstance(last_value, (int, float)):
+		return value != last_value
+	amount, percent = deadband
+	if percent:
+		amount = abs(last_value) * amount / 100
+	return abs(value - last_value) > amount
+
+#Keep only the results that should be output: new tags, changes outside the deadband, and heartbeats
+def filter_changes(change_filter, results, now):
+	changed = []
+	last = change_filter["last"]
+	for tag, value in results:
+		key = id(tag)
+		#Bitsets of many coils are output on any change, the same as single coils
+		deadband = (tag.get("deadband") or change_filter["deadband"]) if tag["datatype"] is not None else None
+		if key in last:
+			last_value, last_time = last[key]
+			heartbeat_due = change_filter["heartbeat"] is not None and now - last_time >= change_filter["heartbeat"]
+			if not heartbeat_due and not outside_deadband(value, last_value, deadband):
+				continue
+		#The deadband is measured from the last value output, so slow drifts are still output
+		last[key] = (value, now)
+		changed.append([tag, value])
+	return changed
+
+"""
+  ------------- OUTPUT FUNCTIONS  -------------
+ - make_writer(output_format, flush_interval, stream)
+	-> output_format -- text (Success: ... lines), ndjson, csv or binary
+	-> flush_interval -- seconds between writes to the stream, 0 to write after every call to write_results
+	-> stream -- text stream to write to (Default: sys.stdout), binary is written to its buffer
+	RETURN: writer dictionary used by write_results and flush_writer
+
+ - write_results(writer, device, results, timestamp)
+	-> writer -- writer dictionary from make_writer
+	-> device -- device the results were read from, as ip:port
+	-> results -- list of [tag, value] from read_plan
+	-> timestamp -- time.time() the results were read
+	RETURN: None; the records are written when the flush interval has passed
+
+ - flush_writer(writer)
+	-> writer -- writer dictionary from make_writer
+	RETURN: None; writes every record that is waiting
+
+ - decode_binary_records(data)
+	-> data -- bytes written by a binary writer
+	RETURN: list of records {"timestamp", "device", "tag", "value", "status"}
+"""
+
+OUTPUT_FORMATS = ["text", "ndjson", "csv", "binary"]
+
+#Binary value types: no value (read error), bool, signed 64bit, unsigned 64bit, float 64bit, bitset of more than 64 coils
+BINARY_NONE, BINARY_BOOL, BINARY_INT, BINARY_UINT, BINARY_FLOAT, BINARY_BITS = range(6)
+
+#Build a buffered writer for the output format
+def make_writer(output_format="text", flush_interval=0, stream=None):
+	if output_format not in OUTPUT_FORMATS:
+		raise ValueError(f"format must be one of {', '.join(OUTPUT_FORMATS)}")
+	stream = stream or sys.stdout
+	writer = {"format": output_format, "flush_interval": flush_interval, "last_flush": time.monotonic(), "pending": []}
+	if output_format == "binary":
+		writer["stream"] = stream.buffer
+	else:
+		writer["stream"] = stream
+	#The CSV header is written once, before the first record
+	if output_format == "csv":
+		writer["pending"].append("timestamp,device,tag,value,status\r\n")
+		writer["csv"] = io.StringIO()
+		writer["csv_writer"] = csv.writer(writer["csv"])
+	return writer
+
+#Pack a string as a 16bit length and utf-8 bytes
+def pack_binary_string(text):
+	return pack_binary_string_bytes(text.encode()[:65535])
+
+def pack_binary_string_bytes(data):
+	return struct.pack("<H", len(data)) + data
+
+#Pack one record for the binary format, starting with its 32bit length
+#Record: timestamp (float64), status (0 ok, 1 error), value type, value (none, 1 byte, 8 bytes, or a 16bit length and the bytes of a bitset), device, tag
+def pack_binary_record(timestamp, device, tag, value):
+	if value is None:
+		packed_value = struct.pack("<dBB", timestamp, 1, BINARY_NONE)
+	elif isinstance(value, bool):
+		packed_value = struct.pack("<dBB?", timestamp, 0, BINARY_BOOL, value)
+	elif isinstance(value, int):
+		if value >= 2 ** 64:
+			data = value.to_bytes((value.bit_length() + 7) // 8, "little")
+			packed_value = struct.pack("<dBB", timestamp, 0, BINARY_BITS) + pack_binary_string_bytes(data)
+		elif value >= 2 ** 63:
+			packed_value = struct.pack("<dBBQ", timestamp, 0, BINARY_UINT, value)
+		else:
+			packed_value = struct.pack("<dBBq", timestamp, 0, BINARY_INT, value)
+	else:
+		packed_value = struct.pack("<dBBd", timestamp, 0, BINARY_FLOAT, value)
+	record = packed_value + pack_binary_string(device) + pack_binary_string(tag)
+	return struct.pack("<I", len(record)) + record
+
+#JSON has no NaN or Infinity, so float registers holding them are written as the strings "NaN", "Infinity" and "-Infinity"
+def json_value(value):
+	if isinstance(value, float) and not math.isfinite(value):
+		if math.isnan(value):
+			return "NaN"
+		return "Infinity" if value > 0 else "-Infinity"
+	return value
+
+#Queue the results as records, and write them once the flush interval has passed
+def write_results(writer, device, results, timestamp):
+	output_format = writer["format"]
+	pending = writer["pending"]
+	if output_format == "text":
+		for tag, value in results:
+			if value is None:
+				pending.append(f"Error: Reading {device} {tag['label']}\n")
+			elif tag["datatype"] is None and tag["count"] > 1:
+				#Bitsets of many coils are shown in hex, bit 0 is the first coil
+				pending.append(f"Success: {device} {tag['label']} = {value:#x}\n")
+			else:
+				pending.append(f"Success: {device} {tag['label']} = {value}\n")
+	elif output_format == "ndjson":
+		for tag, value in results:
+			pending.append(json.dumps({"timestamp": timestamp, "device": device, "tag": tag["name"], "value": json_value(value), "status": "ok" if value is not None else "error"}, separators=(",", ":"), allow_nan=False) + "\n")
+	elif output_format == "csv":
+		writer["csv_writer"].writerows([timestamp, device, tag["name"], "" if value is None else value, "ok" if value is not None else "error"] for tag, value in results)
+		pending.append(writer["csv"].getvalue())
+		writer["csv"].seek(0)
+		writer["csv"].truncate()
+	else:
+		for tag, value in results:
+			pending.append(pack_binary_record(timestamp, device, tag["name"], value))
+
+	if time.monotonic() - writer["last_flush"] >= writer["flush_interval"]:
+		flush_writer(writer)
+
+#Write every waiting record in a single write
+def flush_writer(writer):
+	if writer["pending"]:
+		if writer["format"] == "binary":
+			writer["stream"].write(b"".join(writer["pending"]))
+		else:
+			writer["stream"].write("".join(writer["pending"]))
+		writer["pending"].clear()
+	writer["stream"].flush()
+	writer["last_flush"] = time.monotonic()
+
+#Read the records back out of the binary format
+def decode_binary_records(data):
+	records = []
+	position = 0
+	while position + 4 <= len(data):
+		length, = struct.unpack_from("<I", data, position)
+		record = data[position + 4:position + 4 + length]
+		position += 4 + length
+		timestamp, status, value_type = struct.unpack_from("<dBB", record)
+		offset = 10
+		value = None
+		if value_type == BINARY_BOOL:
+			value, = struct.unpack_from("<?", record, offset)
+			offset += 1
+		elif value_type in [BINARY_INT, BINARY_UINT, BINARY_FLOAT]:
+			value, = struct.unpack_from({BINARY_INT: "<q", BINARY_UINT: "<Q", BINARY_FLOAT: "<d"}[value_type], record, offset)
+			offset += 8
+		elif value_type == BINARY_BITS:
+			size, = struct.unpack_from("<H", record, offset)
+			value = int.from_bytes(record[offset + 2:offset + 2 + size], "little")
+			offset += 2 + size
+		strings = []
+		for _ in range(2):
+			size, = struct.unpack_from("<H", record, offset)
+			strings.append(record[offset + 2:offset + 2 + size].decode())
+			offset += 2 + size
+		records.append({"timestamp": timestamp, "device": strings[0], "tag": strings[1], "value": value, "status": "ok" if status == 0 else "error"})
+	return records
+
+"""
+  ------------- POLLING FUNCTIONS  -------------
+ - poll(client, plan, device_id, interval, on_sample, count, read)
+	-> client -- pymodbus client object, the connection is kept open for every sample
+	-> plan -- read plan from compile_plan or load_tag_map
+	-> device_id -- set the modbus slave_id of the client
+	-> interval -- seconds between the start of each sample
+	-> on_sample -- function called as on_sample(sample_number, results) with the results from read
+	-> count -- number of samples to take, None to poll until interrupted
+	-> read -- function called as read(client, plan, device_id) to take each sample (Default: read_plan, read_plan_blocks for the responses)
+	RETURN: dictionary {"samples", "overruns", "skipped"}; overruns is the number of samples that took longer than the interval, skipped is the number of sample times that were missed because of them
+"""
+
+#Read the tags on a fixed rate schedule using a single connection
+#Sample times are based on the start time, not the end of the last sample, so the schedule does not drift
+def poll(client, plan, device_id, interval, on_sample, count=None, read=read_plan):
+	stats = {"samples": 0, "overruns": 0, "skipped": 0}
+	start = time.monotonic()
+	slot = 0
+	while count is None or stats["samples"] < count:
+		on_sample(stats["samples"], read(client, plan, device_id))
+		stats["samples"] += 1
+		slot += 1
+
+		#Wait for the next sample time. If the sample ran past it then skip the missed times instead of bursting to catch up
+		now = time.monotonic()
+		next_time = start + slot * interval
+		if now > next_time:
+			stats["overruns"] += 1
+			missed = int((now - next_time) / interval) + 1
+			stats["skipped"] += missed
+			slot += missed
+			next_time = start + slot * interval
+			print(f"Overrun: sample {stats['samples']} took longer than {interval}s, skipped {missed} sample(s)", file=sys.stderr)
+		if count is None or stats["samples"] < count:
+			time.sleep(next_time - now)
+	return stats
+
+#Read the tags once and output them in the chosen format
+def run_read(client, args, plan, device_id):
+	writer = make_writer(args.format, args.flush_interval)
+	results = read_plan(client, plan, device_id)
+	write_results(writer, f"{args.ip}:{args.port}", results, time.time())
+	flush_writer(writer)
+
+#Poll the tags until count samples are taken or the user interrupts, then report the overruns
+def run_poll(client, args, plan, device_id):
+	stats = None
+	writer = make_writer(args.format, args.flush_interval)
+	#With --on-change only the tags that changed are output
+	change_filter = make_change_filter(args.deadband, args.heartbeat) if args.on_change else None
+	def on_sample(sample, results):
+		timestamp = time.time()
+		if change_filter is not None:
+			results = filter_changes(change_filter, results, time.monotonic())
+		if results:
+			write_results(writer, f"{args.ip}:{args.port}", results, timestamp)
+	try:
+		stats = poll(client, plan, device_id, args.poll, on_sample, args.count)
+	except KeyboardInterrupt:
+		pass
+	flush_writer(writer)
+	disconnect(client)
+	if stats is not None and stats["overruns"]:
+		print(f"Polling finished with {stats['overruns']} overrun(s) and {stats['skipped']} skipped sample(s)", file=sys.stderr)
+
+"""
+  ------------- SWEEP FUNCTIONS  -------------
+ - sweep(client, table, device_id, start, end, max_step)
+	-> client -- pymodbus client object
+	-> table -- holding (registers), input (registers), coil or discrete (inputs)
+	-> device_id -- set the modbus slave_id of the client
+	-> start -- first address to sweep (Default: 0)
+	-> end -- address after the last one to sweep (Default: 65536)
+	-> max_step -- largest number of addresses skipped at once while looking for the end of a gap, a range in a gap that does not hold a multiple of the step can be missed; 1 checks every address in the gaps (Default: None, the step keeps doubling)
+	RETURN: dictionary {"ranges", "requests"}; ranges is a list of [first, last] addresses the device answers, None if it does not support the table. Raises ModbusException on any other error
+
+ - next_round_address(address, step)
+	-> address -- last address checked
+	-> step -- current step of the gap walk
+	RETURN: the next address after address that is a multiple of step or of the largest power of ten up to step
+
+ - format_ranges(ranges)
+	-> ranges -- list of [first, last] from sweep
+	RETURN: the ranges as text, 0-99, 1000-1999
+"""
+
+#Read function and largest read of each table
+SWEEP_TABLES = {
+	"holding": ["Holding registers", "read_holding_registers", MAX_READ_REGISTERS],
+	"input": ["Input registers", "read_input_registers", MAX_READ_REGISTERS],
+	"coil": ["Coils", "read_coils", MAX_READ_COILS],
+	"discrete": ["Discrete inputs", "read_discrete_inputs", MAX_READ_COILS],
+}
+
+#Raised by sweep when the device answers ILLEGAL FUNCTION, it does not have the table
+class TableNotSupported(Exception):
+	pass
+
+#Next address after address that is a multiple of step, or of the largest power of ten up to step, whichever comes first
+#Device maps usually start on round addresses in binary (4096) or decimal (5000)
+def next_round_address(address, step):
+	decimal = 10 ** (len(str(step)) - 1)
+	return min((address // step + 1) * step, (address // decimal + 1) * decimal)
+
+#Find the address ranges a device answers in a table
+#Valid ranges are read in the largest blocks, and a block that fails is cut down with a binary search on its length to where the valid range ends
+#Gaps are skipped with steps that keep doubling, landing on round addresses, so an empty tail of the table costs a few dozen requests,
+#and then a binary search finds where the next valid range starts
+def sweep(client, table, device_id, start=0, end=65536, max_step=None):
+	name, function, max_count = SWEEP_TABLES[table]
+	read = getattr(client, function)
+	stats = {"ranges": [], "requests": 0}
+
+	#True if every address from address to address+count-1 can be read
+	def readable(address, count):
+		stats["requests"] += 1
+		result = read(address, count=count, device_id=device_id)
+		if not result.isError():
+			return True
+		code = getattr(result, "exception_code", None)
+		if code == ExcCodes.ILLEGAL_FUNCTION:
+			raise TableNotSupported(name)
+		#Some devices answer a read that runs past their registers with ILLEGAL VALUE instead of ILLEGAL ADDRESS
+		if code in [ExcCodes.ILLEGAL_ADDRESS, ExcCodes.ILLEGAL_VALUE]:
+			return False
+		raise ModbusException(f"{name} {address}-{address+count-1} failed with exception code {code}")
+
+	def add_range(first, count):
+		ranges = stats["ranges"]
+		if ranges and ranges[-1][1] == first - 1:
+			ranges[-1][1] = first + count - 1
+		else:
+			ranges.append([first, first + count - 1])
+
+	try:
+		address = start
+		while address < end:
+			count = min(max_count, end - address)
+			if readable(address, count):
+				add_range(address, count)
+				address += count
+				continue
+
+			#The longest readable length from address, a longer read that fails means every longer read fails
+			good, bad = 0, count
+			while bad - good > 1:
+				middle = (good + bad) // 2
+				if readable(address, middle):
+					good = middle
+				else:
+					bad = middle
+			if good:
+				add_range(address, good)
+				address += good + 1
+				continue
+
+			#address is not readable, step forward until an address is and then search back for the first readable one
+			step = 1
+			last_bad = address
+			address = end
+			while True:
+				probe = next_round_address(last_bad, step)
+				if probe >= end:
+					break
+				if readable(probe, 1):
+					bad, good = last_bad, probe
+					while good - bad > 1:
+						middle = (good + bad) // 2
+						if readable(middle, 1):
+							good = middle
+						else:
+							bad = middle
+					address = good
+					break
+				last_bad = probe
+				#The step only grows once a whole step has been skipped, the decimal addresses in between are checked on the way
+				if probe % step == 0:
+					step = step * 2 if max_step is None else min(step * 2, max_step)
+	except TableNotSupported:
+		#The device does not have this table at all
+		stats["ranges"] = None
+	return stats
+
+#Format a list of ranges from sweep
+def format_ranges(ranges):
+	return ", ".join(f"{first}-{last}" if last > first else f"{first}" for first, last in ranges) or "none"
+
+#Sweep the tables asked for and output the ranges of each one
+def run_sweep(client, args, device_id):
+	start = time.monotonic()
+	requests = 0
+	for table in args.sweep or list(SWEEP_TABLES):
+		stats = sweep(client, table, device_id, max_step=args.sweep_step)
+		requests += stats["requests"]
+		ranges = "not supported" if stats["ranges"] is None else format_ranges(stats["ranges"])
+		print(f"{args.ip}:{args.port} {SWEEP_TABLES[table][0]}: {ranges}")
+	print(f"Swept in {time.monotonic() - start:.2f}s with {requests} requests", file=sys.stderr)
+	disconnect(client)
+
+"""
+  ------------- METRICS FUNCTIONS  -------------
+ - make_metrics()
+	RETURN: metrics dictionary used by the other metrics functions
+
+ - instrument_client(client, metrics, device)
+	-> client -- pymodbus client object, sync or async
+	-> metrics -- metrics dictionary from make_metrics
+	-> device -- name of the device in the metrics, as ip:port
+	RETURN: None; every request the client sends is recorded: latency, bytes sent and received, exception codes, timeouts, connection errors and retries, for each function code
+
+ - snapshot_metrics(metrics, reset)
+	-> metrics -- metrics dictionary from make_metrics
+	-> reset -- clear the counters after copying them, so the next snapshot only holds the requests since this one (Default: False)
+	RETURN: copy of the counters of every (device, function code), which can be sent to another process
+
+ - add_metrics(metrics, series)
+	-> metrics -- metrics dictionary from make_metrics
+	-> series -- counters from snapshot_metrics(other_metrics, reset=True)
+	RETURN: None; the counters are added to the metrics
+
+ - format_metrics(metrics)
+	-> metrics -- metrics dictionary from make_metrics
+	RETURN: the metrics in the Prometheus text format
+
+ - serve_metrics(metrics, port, host)
+	-> metrics -- metrics dictionary from make_metrics
+	-> port -- port for the HTTP server, the metrics are at /metrics
+	-> host -- address to listen on (Default: 127.0.0.1)
+	RETURN: the HTTP server, running in a background thread
+"""
+
+#Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+FUNCTION_NAMES = {
+	1: "read_coils",
+	2: "read_discrete_inputs",
+	3: "read_holding_registers",
+	4: "read_input_registers",
+	5: "write_coil",
+	6: "write_register",
+	15: "write_coils",
+	16: "write_registers",
+}
+
+#Set with --metrics-port or --metrics-file (or by modbus_daemon.py) so connect instruments every connection
+metrics = None
+
+#Build an empty metrics dictionary
+def make_metrics():
+	return {"lock": threading.Lock(), "series": {}}
+
+#Get the counters for a device and function code
+def metric_series(metrics, device, function_code):
+	key = (device, function_code)
+	series = metrics["series"].get(key)
+	if series is None:
+		with metrics["lock"]:
+			series = metrics["series"].setdefault(key, {
+				"count": 0, "sum": 0.0, "buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+				"exceptions": {}, "timeouts": 0, "connection_errors": 0, "retries": 0,
+				"bytes_sent": 0, "bytes_received": 0,
+			})
+	return series
+
+#Add one request to the counters
+#Only the bucket the latency falls in is counted, format_metrics adds them up
+def record_request(metrics, series, seconds, response, error):
+	with metrics["lock"]:
+		#A request that could not be sent has no latency
+		if isinstance(error, ConnectionException):
+			series["connection_errors"] += 1
+			return
+		series["count"] += 1
+		series["sum"] += seconds
+		series["buckets"][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+		if error is not None:
+			series["timeouts"] += 1
+		elif response is not None:
+			series["retries"] += getattr(response, "retries", 0) or 0
+			if response.isError():
+				code = getattr(response, "exception_code", 0)
+				series["exceptions"][code] = series["exceptions"].get(code, 0) + 1
+
+#Time an async request
+async def record_async_request(metrics, series, start, response):
+	try:
+		response = await response
+	except ModbusException as e:
+		record_request(metrics, series, time.perf_counter() - start, None, e)
+		raise
+	record_request(metrics, series, time.perf_counter() - start, response, None)
+	return response
+
+#Wrap the execute method of the client, which every request goes through, to record the requests
+def instrument_client(client, metrics, device):
+	execute = client.execute
+	#The series of the request being sent, for counting the bytes
+	current = [None]
+
+	def timed_execute(no_response_expected, request):
+		series = metric_series(metrics, device, request.function_code)
+		current[0] = series
+		start = time.perf_counter()
+		try:
+			response = execute(no_response_expected, request)
+		except ModbusException as e:
+			record_request(metrics, series, time.perf_counter() - start, None, e)
+			raise
+		#The async client returns a coroutine, which is timed when it is awaited
+		if hasattr(response, "__await__"):
+			return record_async_request(metrics, series, start, response)
+		record_request(metrics, series, time.perf_counter() - start, response, None)
+		return response
+
+	client.execute = timed_execute
+	#Pipelined reads do not go through execute, so they record their requests themselves
+	client.request_metrics = (metrics, device)
+
+	#Count the bytes of every frame sent and received
+	transaction = client_transaction(client)
+	if transaction is None:
+		return
+	trace_packet = transaction.trace_packet
+
+	def counted_trace_packet(sending, data):
+		series = current[0]
+		if series is not None:
+			with metrics["lock"]:
+				series["bytes_sent" if sending else "bytes_received"] += len(data)
+		return trace_packet(sending, data)
+
+	transaction.trace_packet = counted_trace_packet
+
+#Get the transaction manager of a client, the sync client keeps it in .transaction and the async client in .ctx
+def client_transaction(client):
+	return getattr(client, "transaction", None) or getattr(client, "ctx", None)
+
+#Copy the counters, so they can be formatted or sent on while requests are still being recorded
+def snapshot_metrics(metrics, reset=False):
+	with metrics["lock"]:
+		series = {key: dict(value, buckets=list(value["buckets"]), exceptions=dict(value["exceptions"])) for key, value in metrics["series"].items()}
+		if reset:
+			metrics["series"].clear()
+	return series
+
+#Add the counters of another metrics dictionary, more than one process can read from the same device
+def add_metrics(metrics, series):
+	for (device, function_code), values in series.items():
+		totals = metric_series(metrics, device, function_code)
+		with metrics["lock"]:
+			for field in ["count", "sum", "timeouts", "connection_errors", "retries", "bytes_sent", "bytes_received"]:
+				totals[field] += values[field]
+			totals["buckets"] = [total + count for total, count in zip(totals["buckets"], values["buckets"])]
+			for code, count in values["exceptions"].items():
+				totals["exceptions"][code] = totals["exceptions"].get(code, 0) + count
+
+#Output the metrics in the Prometheus text format
+def format_metrics(metrics):
+	series = sorted(snapshot_metrics(metrics).items())
+
+	lines = [
+		"# HELP modbus_request_duration_seconds Time from sending a Modbus request to receiving its response",
+		"# TYPE modbus_request_duration_seconds histogram",
+	]
+	for (device, function_code), values in series:
+		labels = f'device="{device}",function="{FUNCTION_NAMES.get(function_code, function_code)}"'
+		total = 0
+		for bound, count in zip(LATENCY_BUCKETS + ["+Inf"], values["buckets"]):
+			total += count
+			lines.append(f'modbus_request_duration_seconds_bucket{{{labels},le="{bound}"}} {total}')
+		lines.append(f"modbus_request_duration_seconds_sum{{{labels}}} {values['sum']}")
+		lines.append(f"modbus_request_duration_seconds_count{{{labels}}} {values['count']}")
+
+	counters = [
+		["modbus_request_bytes_sent_total", "bytes_sent", "Bytes of Modbus frames sent"],
+		["modbus_request_bytes_received_total", "bytes_received", "Bytes of Modbus frames received"],
+		["modbus_request_timeouts_total", "timeouts", "Request attempts that got no response, each retry that times out is counted"],
+		["modbus_request_connection_errors_total", "connection_errors", "Request attempts that could not be sent because the device could not be connected to, each retry is counted"],
+		["modbus_request_retries_total", "retries", "Requests sent again after a timeout, connection error or DEVICE_BUSY"],
+	]
+	for name, field, description in counters:
+		lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+		for (device, function_code), values in series:
+			lines.append(f'{name}{{device="{device}",function="{FUNCTION_NAMES.get(function_code, function_code)}"}} {values[field]}')
+
+	lines += ["# HELP modbus_request_exceptions_total Exception responses from the device, by exception code", "# TYPE modbus_request_exceptions_total counter"]
+	for (device, function_code), values in series:
+		for code, count in sorted(values["exceptions"].items()):
+			lines.append(f'modbus_request_exceptions_total{{device="{device}",function="{FUNCTION_NAMES.get(function_code, function_code)}",code="{code}"}} {count}')
+	return "\n".join(lines) + "\n"
+
+#Write the metrics to a file, used to dump them on exit
+def write_metrics_file(metrics, path):
+	with open(path, "w") as metrics_file:
+		metrics_file.write(format_metrics(metrics))
+
+#Serve the metrics over HTTP at /metrics in a background thread
+def serve_metrics(metrics, port, host="127.0.0.1"):
+	import http.server
+
+	class MetricsHandler(http.server.BaseHTTPRequestHandler):
+		def do_GET(self):
+			if self.path != "/metrics":
+				self.send_error(404)
+				return
+			body = format_metrics(metrics).encode()
+			self.send_response(200)
+			self.send_header("Content-Type", "text/plain; version=0.0.4")
+			self.send_header("Content-Length", str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		#Do not print a line for every scrape
+		def log_message(self, format, *args):
+			pass
+
+	server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+	server.daemon_threads = True
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server
+
+"""
+  ------------- DEVICE POLICY FUNCTIONS  -------------
+ - make_device_policy(timeout, retries, cooldown, min_timeout, backoff, breaker_failures, state)
+	-> timeout -- longest time to wait for a response, used until the round trip time has been measured (Default: 3)
+	-> retries -- number of times a request that timed out, could not connect or got DEVICE_BUSY is sent again (Default: 1)
+	-> cooldown -- seconds a device is skipped for after breaker_failures requests in a row have failed (Default: 30)
+	-> min_timeout -- shortest timeout, however fast the device answers (Default: 0.1)
+	-> backoff -- seconds to wait before the first retry, doubled for each retry after it (Default: 0.1)
+	-> breaker_failures -- requests in a row that have to fail before the device is skipped (Default: 3)
+	-> state -- what has been learned about the device (round trip time, failed requests, skipped until) from another policy of the same device, so policies with different options share it (Default: None, a new device)
+	RETURN: policy dictionary used by apply_policy
+
+ - device_policy(device, options)
+	-> device -- device as ip:port
+	-> options -- dictionary of make_device_policy options for this command only (Default: the make_device_policy defaults)
+	RETURN: policy dictionary with the options, sharing the state learned about the device by every command run in the process
+
+ - apply_policy(client, policy)
+	-> client -- pymodbus client object, sync or async
+	-> policy -- policy dictionary from make_device_policy, the same policy should be used for every client of a device
+	RETURN: None; every request the client sends then uses a timeout from the measured round trip time, is retried with backoff, and raises ConnectionException straight away while the device is being skipped
+
+ - policy_timeout(policy)
+	-> policy -- policy dictionary from make_device_policy
+	RETURN: the timeout for the next request; the smoothed round trip time plus 4 times its variation, between min_timeout and timeout
+
+ - check_circuit(policy, device, error)
+	-> policy -- policy dictionary from make_device_policy
+	-> device -- device as ip:port, for the error message
+	-> error -- exception class raised while the device is being skipped (Default: ConnectionException)
+	RETURN: None; raises error if the device is being skipped
+"""
+
+#State learned about each device (ip:port), kept for every command run in modbus_daemon.py so a dead device stays skipped
+#Only the state is shared, the options of each command stay in that command's own policy
+device_policies = {}
+
+#Build the timeout, retry and circuit breaker policy of a device
+def make_device_policy(timeout=3, retries=1, cooldown=30, min_timeout=0.1, backoff=0.1, breaker_failures=3, state=None):
+	if state is None:
+		#Smoothed round trip time and its variation, failed requests in a row, and the time the device is skipped until
+		state = {"srtt": None, "rttvar": 0.0, "failures": 0, "open_until": 0.0}
+	return {
+		"timeout": timeout, "retries": retries, "cooldown": cooldown, "min_timeout": min(min_timeout, timeout), "backoff": backoff, "breaker_failures": breaker_failures,
+		"state": state,
+	}
+
+#Get a policy for a device with the options of one command, sharing the state learned by earlier commands
+def device_policy(device, options=None):
+	#setdefault keeps a single state if two commands reach a new device at the same time
+	state = device_policies.setdefault(device, make_device_policy()["state"])
+	return make_device_policy(**(options or {}), state=state)
+
+#Timeout for the next request, the same as the TCP retransmission timeout
+def policy_timeout(policy):
+	state = policy["state"]
+	if state["srtt"] is None:
+		return policy["timeout"]
+	return min(policy["timeout"], max(policy["min_timeout"], state["srtt"] + 4 * state["rttvar"]))
+
+#Add a round trip time to the smoothed round trip time of the device
+def record_rtt(policy, rtt):
+	state = policy["state"]
+	if state["srtt"] is None:
+		state["srtt"] = rtt
+		state["rttvar"] = rtt / 2
+	else:
+		state["rttvar"] = 0.75 * state["rttvar"] + 0.25 * abs(state["srtt"] - rtt)
+		state["srtt"] = 0.875 * state["srtt"] + 0.125 * rtt
+	state["failures"] = 0
+	state["open_until"] = 0.0
+
+#Count a request that failed after every retry, and skip the device once too many have failed in a row
+#After the cooldown the next request is let through, and one more failure skips the device again
+def record_failure(policy):
+	state = policy["state"]
+	state["failures"] += 1
+	if state["failures"] >= policy["breaker_failures"]:
+		state["open_until"] = time.monotonic() + policy["cooldown"]
+
+#Raise ConnectionException (or error) if the device is being skipped
+def check_circuit(policy, device, error=None):
+	remaining = policy["state"]["open_until"] - time.monotonic()
+	if remaining > 0:
+		raise (error or ConnectionException)(f"{device} skipped for {remaining:.1f}s after {policy['state']['failures']} failed requests")
+
+#True if a request should be sent again
+def should_retry(response, error):
+	if error is not None:
+		return True
+	return response is not None and response.isError() and getattr(response, "exception_code", None) == ExcCodes.DEVICE_BUSY
+
+#Count a retry in the metrics of the client
+def count_retry(client, request):
+	request_metrics = getattr(client, "request_metrics", None)
+	if request_metrics is not None:
+		metrics, device = request_metrics
+		series = metric_series(metrics, device, request.function_code)
+		with metrics["lock"]:
+			series["retries"] += 1
+
+#Wrap the execute method of the client to use the policy for every request
+def apply_policy(client, policy):
+	already_applied = hasattr(client, "policy")
+	client.policy = policy
+	if already_applied:
+		return
+
+	transaction = client_transaction(client)
+	execute = client.execute
+	#The policy does the retries, with backoff
+	transaction.retries = 0
+	device = f"{transaction.comm_params.host}:{transaction.comm_params.port}"
+
+	def policy_execute(no_response_expected, request):
+		policy = client.policy
+		check_circuit(policy, device)
+		timeout = policy_timeout(policy)
+		for attempt in range(policy["retries"] + 1):
+			if attempt:
+				count_retry(client, request)
+				time.sleep(policy["backoff"] * 2 ** (attempt - 1))
+				#Each retry waits longer, in case the device has slowed down
+				timeout = min(policy["timeout"], timeout * 2)
+			#The sync client waits for the response with its own copy of the connection parameters
+			transaction.comm_params.timeout_connect = timeout
+			client.comm_params.timeout_connect = timeout
+			response = error = None
+			start = time.perf_counter()
+			try:
+				response = execute(no_response_expected, request)
+			except (ModbusIOException, ConnectionException) as e:
+				error = e
+				#Close the connection so a late response is not read as the answer to the next request
+				client.close()
+			except OSError as e:
+				#The connection was reset or closed by the device
+				error = ConnectionException(f"{device}: {e}")
+				client.close()
+			if not should_retry(response, error):
+				record_rtt(policy, time.perf_counter() - start)
+				return response
+		record_failure(policy)
+		if error is not None:
+			raise error
+		return response
+
+	async def policy_execute_async(no_response_expected, request):
+		#asyncio is only imported once an async client is used, it is not needed to start the command
+		import asyncio
+		policy = client.policy
+		check_circuit(policy, device)
+		timeout = policy_timeout(policy)
+		for attempt in range(policy["retries"] + 1):
+			if attempt:
+				count_retry(client, request)
+				await asyncio.sleep(policy["backoff"] * 2 ** (attempt - 1))
+				timeout = min(policy["timeout"], timeout * 2)
+			transaction.comm_params.timeout_connect = timeout
+			response = error = None
+			start = time.perf_counter()
+			try:
+				#The async client does not connect again by itself, so a connection closed after a timeout is opened again here
+				if not client.connected and not await client.connect():
+					raise ConnectionException(f"Failed to connect[{device}]")
+				response = await execute(no_response_expected, request)
+			except (ModbusIOException, ConnectionException) as e:
+				error = e
+				client.close()
+			except OSError as e:
+				error = ConnectionException(f"{device}: {e}")
+				client.close()
+			if not should_retry(response, error):
+				record_rtt(policy, time.perf_counter() - start)
+				return response
+		record_failure(policy)
+		if error is not None:
+			raise error
+		return response
+
+	client.execute = policy_execute if isinstance(client, ModbusTcpClient) else policy_execute_async
+
+"""
+  ------------- CACHE FUNCTIONS  -------------
+ - make_cache(ttl, max_entries)
+	-> ttl -- seconds a read is answered from the cache for, tags can give their own ttl (Default: 1)
+	-> max_entries -- largest number of reads kept, the least recently used are dropped first (Default: 1024)
+	RETURN: cache dictionary used by cache_client
+
+ - cache_client(client, cache, device)
+	-> client -- pymodbus client object, sync or async
+	-> cache -- cache dictionary from make_cache, every client given the same cache shares the reads
+	-> device -- name of the device in the cache, as ip:port
+	RETURN: None; a read of coils, discrete inputs, holding or input registers that is inside a range read within the ttl is answered from the cache, and a write drops the cached ranges it changes
+"""
+
+#Response built for a read answered from the cache, by function code
+CACHED_READS = {}
+
+#Function code of the reads each write changes; any other function drops every read of the device
+CACHE_WRITES = {5: 1, 15: 1, 6: 3, 16: 3}
+
+#Set with --cache-ttl (or by modbus_daemon.py) so connect caches the reads of every connection
+cache = None
+
+#Build an empty cache
+def make_cache(ttl=1, max_entries=1024):
+	#entries is (device, device id, function code, start, count) -> [time read, values], oldest used first
+	#ranges is (device, device id, function code) -> set of (start, count), so a read only checks the ranges of its device
+	return {"ttl": ttl, "max_entries": max_entries, "entries": collections.OrderedDict(), "ranges": {},
+		"lock": threading.Lock(), "writes": 0, "hits": 0, "misses": 0}
+
+#Get the values of a read from a cached range holding all of it, None if there is none within the ttl
+def cache_lookup(cache, key, address, count, ttl):
+	now = time.monotonic()
+	with cache["lock"]:
+		for start, length in cache["ranges"].get(key, ()):
+			if start <= address and address + count <= start + length:
+				entry_key = key + (start, length)
+				read_time, values = cache["entries"][entry_key]
+				if now - read_time <= ttl:
+					cache["entries"].move_to_end(entry_key)
+					cache["hits"] += 1
+					return values[address - start:address - start + count]
+		cache["misses"] += 1
+	return None
+
+#Remove a cached range, the lock must be held
+def cache_remove(cache, entry_key):
+	del cache["entries"][entry_key]
+	ranges = cache["ranges"][entry_key[:3]]
+	ranges.discard(entry_key[3:])
+	if not ranges:
+		del cache["ranges"][entry_key[:3]]
+
+#Save the values of a read, replacing the cached ranges it holds and dropping the least recently used ranges over max_entries
+def cache_store(cache, key, address, values, writes):
+	with cache["lock"]:
+		#A write sent while the read was waiting may have changed the values
+		if cache["writes"] != writes:
+			return
+		for start, length in list(cache["ranges"].get(key, ())):
+			if address <= start and start + length <= address + len(values):
+				cache_remove(cache, key + (start, length))
+		cache["entries"][key + (address, len(values))] = [time.monotonic(), values]
+		cache["ranges"].setdefault(key, set()).add((address, len(values)))
+		while len(cache["entries"]) > cache["max_entries"]:
+			cache_remove(cache, next(iter(cache["entries"])))
+
+#Drop the cached ranges a write changes
+def cache_invalidate(cache, device, request):
+	with cache["lock"]:
+		cache["writes"] += 1
+		read_code = CACHE_WRITES.get(request.function_code)
+		if read_code is None:
+			#Not a plain write, so any read of the device may have changed
+			for entry_key in [entry_key for entry_key in cache["entries"] if entry_key[0] == device]:
+				cache_remove(cache, entry_key)
+			return
+		key = (device, request.dev_id, read_code)
+		address = request.address
+		count = max(request.count, len(request.bits), len(request.registers), 1)
+		for start, length in list(cache["ranges"].get(key, ())):
+			if start < address + count and address < start + length:
+				cache_remove(cache, key + (start, length))
+
+#Answer a read request from the cache, None if it has to be sent
+def cached_read(client, device, request, ttl=None):
+	if ttl is None:
+		ttl = client.cache_ttl if client.cache_ttl is not None else client.cache["ttl"]
+	values = cache_lookup(client.cache, (device, request.dev_id, request.function_code), request.address, request.count, ttl)
+	if values is None:
+		return None
+	if request.function_code in [1, 2]:
+		return CACHED_READS[request.function_code](dev_id=request.dev_id, count=request.count, bits=values)
+	return CACHED_READS[request.function_code](dev_id=request.dev_id, count=request.count, registers=values)
+
+#Save the values of a read response in the cache
+def cache_response(cache, device, request, response, writes):
+	if response is None or response.isError():
+		return
+	key = (device, request.dev_id, request.function_code)
+	#Coil responses are padded to a whole byte
+	values = list(response.bits[:request.count]) if request.function_code in [1, 2] else list(response.registers)
+	cache_store(cache, key, request.address, values, writes)
+
+#Wait for an async read and cache its response
+async def cache_async_read(cache, device, request, response, writes):
+	response = await response
+	cache_response(cache, device, request, response, writes)
+	return response
+
+#Wait for an async write and drop the ranges it changed, even if it failed
+async def cache_async_write(cache, device, request, response):
+	try:
+		return await response
+	finally:
+		cache_invalidate(cache, device, request)
+
+#Give the async client an answer from the cache to await
+async def cache_async_answer(response):
+	return response
+
+#Wrap the execute method of the client, which every request goes through, to answer reads from the cache
+def cache_client(client, cache, device):
+	already_cached = hasattr(client, "cache")
+	client.cache = cache
+	if already_cached:
+		return
+	client.cache_ttl = None
+	client.read_ttl = None
+	execute = client.execute
+	is_async = not isinstance(client, ModbusTcpClient)
+
+	def cached_execute(no_response_expected, request):
+		cache = client.cache
+		if request.function_code in CACHED_READS:
+			response = cached_read(client, device, request, client.read_ttl)
+			if response is not None:
+				return cache_async_answer(response) if is_async else response
+			writes = cache["writes"]
+			response = execute(no_response_expected, request)
+			if is_async:
+				return cache_async_read(cache, device, request, response, writes)
+			cache_response(cache, device, request, response, writes)
+			return response
+
+		if is_async:
+			return cache_async_write(cache, device, request, execute(no_response_expected, request))
+		try:
+			return execute(no_response_expected, request)
+		finally:
+			cache_invalidate(cache, device, request)
+
+	client.execute = cached_execute
+
+"""
+  ------------- CONNECTION FUNCTIONS  -------------
+ - import_pymodbus()
+	RETURN: None; imports pymodbus into the module the first time it is called. Done on import when modbus_cli is used as a library, and by connect when it is run as a command
+
+ - connect(ip, port, policy_options, cache_ttl)
+	-> ip -- IP address of the modbus device
+	-> port -- port of the modbus service
+	-> policy_options -- dictionary of make_device_policy options for this connection (Default: the make_device_policy defaults)
+	-> cache_ttl -- seconds a cached read can be used for by this connection, None to use the ttl of the cache
+	RETURN: connected pymodbus client object; a pooled connection when running in modbus_daemon.py
+
+ - disconnect(client)
+	-> client -- pymodbus client object from connect
+	RETURN: None; the connection is closed, or given back to the pool when running in modbus_daemon.py
+
+ - forward_to_daemon(socket_path, argv)
+	-> socket_path -- path of the modbus_daemon.py unix socket
+	-> argv -- command line arguments to run in the daemon
+	RETURN: exit status of the command, or None if the daemon could not be reached (the command should be run locally). The working directory is sent with the command, so relative file paths are found by the daemon
+
+ - must_run_locally(argv)
+	-> argv -- command line arguments for modbus_cli.py
+	RETURN: True if the command has to run in its own process and not in modbus_daemon.py; --poll, binary output and the metrics options
+"""
+
+#Import pymodbus into the module the first time it is needed
+def import_pymodbus():
+	global ModbusTcpClient, ExcCodes, DecodePDU, ModbusException, ModbusIOException, ConnectionException
+	if ModbusTcpClient is not None:
+		return
+	from pymodbus.client import ModbusTcpClient
+	from pymodbus.constants import ExcCodes
+	from pymodbus.exceptions import ModbusException, ModbusIOException, ConnectionException
+	from pymodbus.pdu import DecodePDU
+	from pymodbus.pdu.bit_message import ReadCoilsRequest, ReadDiscreteInputsRequest, ReadCoilsResponse, ReadDiscreteInputsResponse
+	from pymodbus.pdu.register_message import ReadHoldingRegistersRequest, ReadInputRegistersRequest, ReadHoldingRegistersResponse, ReadInputRegistersResponse
+	BLOCK_REQUESTS.update({"register": ReadHoldingRegistersRequest, "input": ReadInputRegistersRequest, "coil": ReadCoilsRequest, "discrete": ReadDiscreteInputsRequest})
+	CACHED_READS.update({1: ReadCoilsResponse, 2: ReadDiscreteInputsResponse, 3: ReadHoldingRegistersResponse, 4: ReadInputRegistersResponse})
+
+#Set by modbus_daemon.py to {"connect": function(ip, port), "release": function(client)} so the CLI uses pooled connections
+connection_hooks = None
+
+#Open a connection to the modbus device
+#The options are kept on the client, so commands running at the same time in modbus_daemon.py each use their own
+def connect(ip, port, policy_options=None, cache_ttl=None):
+	import_pymodbus()
+	policy = device_policy(f"{ip}:{port}", policy_options)
+	if connection_hooks is not None:
+		client = connection_hooks["connect"](ip, int(port))
+		apply_policy(client, policy)
+		use_cache(client, f"{ip}:{port}", cache_ttl)
+		return client
+	client = ModbusTcpClient(f"{ip}", port=int(port), timeout=policy_timeout(policy))
+	if metrics is not None:
+		instrument_client(client, metrics, f"{ip}:{port}")
+	apply_policy(client, policy)
+	use_cache(client, f"{ip}:{port}", cache_ttl)
+	client.connect()
+	return client
+
+#Answer the reads of a connection from the cache, if there is one, with the ttl of the current command
+#The cache is applied last, so a read answered from it is not sent, retried or recorded in the metrics
+def use_cache(client, device, cache_ttl=None):
+	if cache is not None:
+		cache_client(client, cache, device)
+		client.cache_ttl = cache_ttl
+
+#Close a connection from connect
+def disconnect(client):
+	if connection_hooks is not None:
+		connection_hooks["release"](client)
+	else:
+		client.close()
+
+#Polling runs until interrupted, binary output cannot be sent back as text and the metrics options are for this process, so they are always run locally
+#The parser does not take abbreviated options, so the options are found without parsing the command line
+def must_run_locally(argv):
+	return any(arg == "--poll" or arg.startswith("--poll=") or arg.endswith("binary") or arg.startswith("--metrics") for arg in argv)
+
+#Send the command line to modbus_daemon.py and print the output it returns
+def forward_to_daemon(socket_path, argv):
+	try:
+		daemon = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		daemon.connect(socket_path)
+	except OSError:
+		return None
+
+	with daemon:
+		daemon.sendall(json.dumps({"argv": argv, "cwd": os.getcwd()}).encode() + b"\n")
+		response = b""
+		while not response.endswith(b"\n"):
+			data = daemon.recv(65536)
+			if not data:
+				return None
+			response += data
+
+	reply = json.loads(response)
+	sys.stdout.write(reply["stdout"])
+	sys.stderr.write(reply["stderr"])
+	return reply["status"]
+
+"""
+  ------------- LITE CLIENT FUNCTIONS  -------------
+ - LiteTcpClient(host, port, policy_options)
+	-> host -- IP address of the modbus device
+	-> port -- port of the modbus service
+	-> policy_options -- dictionary of make_device_policy options for this connection, the timeout, retries and circuit breaker are the same as the pymodbus client (Default: the make_device_policy defaults)
+	RETURN: client object with the read_*/write_* methods and DATATYPE constants the get_*/set_* functions use, over a plain socket so pymodbus is not imported. connect and requests raise OSError if the device cannot be reached, does not respond, answers for another unit or function, or is being skipped
+
+ - use_lite_client()
+	RETURN: True if a single read or write can use LiteTcpClient; False when running in modbus_daemon.py, or with metrics or a cache, which need the pymodbus client
+"""
+
+#Datatype constants with the same values as the pymodbus client.DATATYPE, the struct format character and number of registers
+class LiteDataType(enum.Enum):
+	INT16 = ("h", 1)
+	UINT16 = ("H", 1)
+	INT32 = ("i", 2)
+	UINT32 = ("I", 2)
+	INT64 = ("q", 4)
+	UINT64 = ("Q", 4)
+	FLOAT32 = ("f", 2)
+	FLOAT64 = ("d", 4)
+
+#Response of a LiteTcpClient request, with the bits or registers read, or the exception code the device answered with
+class LiteResponse:
+	def __init__(self, function_code, bits=None, registers=None, exception_code=None):
+		self.function_code = function_code
+		self.bits = bits
+		self.registers = registers
+		self.exception_code = exception_code
+
+	def isError(self):
+		return self.exception_code is not None
+
+#Modbus TCP client for a single read or write. It only sends the requests the get_*/set_* functions make
+class LiteTcpClient:
+	DATATYPE = LiteDataType
+
+	def __init__(self, host, port=502, policy_options=None):
+		self.host = host
+		self.port = int(port)
+		self.device = f"{self.host}:{self.port}"
+		self.policy = device_policy(self.device, policy_options)
+		self.socket = None
+		self.tid = 0
+
+	@property
+	def connected(self):
+		return self.socket is not None
+
+	def connect(self):
+		check_circuit(self.policy, self.device, OSError)
+		try:
+			self.socket = socket.create_connection((self.host, self.port), timeout=policy_timeout(self.policy))
+		except OSError as e:
+			raise OSError(f"Failed to connect to {self.device}: {e}")
+		return True
+
+	def close(self):
+		if self.socket is not None:
+			self.socket.close()
+			self.socket = None
+
+	#Read exactly size bytes from the socket
+	def receive(self, size):
+		data = b""
+		while len(data) < size:
+			chunk = self.socket.recv(size - len(data))
+			if not chunk:
+				raise ConnectionResetError(f"{self.host}:{self.port} closed the connection")
+			data += chunk
+		return data
+
+	#Send a request PDU and return its response, with the same timeout, retries and circuit breaker as apply_policy
+	def execute(self, device_id, function_code, data):
+		policy = self.policy
+		check_circuit(policy, self.device, OSError)
+		timeout = policy_timeout(policy)
+		for attempt in range(policy["retries"] + 1):
+			if attempt:
+				time.sleep(policy["backoff"] * 2 ** (attempt - 1))
+				#Each retry waits longer, in case the device has slowed down
+				timeout = min(policy["timeout"], timeout * 2)
+			response = error = None
+			start = time.perf_counter()
+			try:
+				if self.socket is None:
+					self.connect()
+				self.socket.settimeout(timeout)
+				self.tid = (self.tid + 1) % 65536
+				self.socket.sendall(struct.pack(">HHHBB", self.tid, 0, len(data) + 2, device_id, function_code) + data)
+				#Skip any late response to an earlier request
+				while True:
+					tid, protocol, length = struct.unpack(">HHH", self.receive(6))
+					pdu = self.receive(length)
+					if tid == self.tid:
+						break
+				#The response has to be from the unit and for the function asked, the exception bit (0x80) is set on an exception response
+				if len(pdu) < 3 or pdu[0] != device_id or pdu[1] not in [function_code, function_code | 0x80]:
+					raise OSError(f"response for unit {pdu[0] if pdu else None} function {pdu[1] if len(pdu) > 1 else None}, expected unit {device_id} function {function_code}")
+			except OSError as e:
+				#A request that got no valid response is sent again on a new connection
+				self.close()
+				error = OSError(f"{self.device}: no valid response received: {e}")
+				continue
+			if pdu[1] & 0x80:
+				response = LiteResponse(function_code, exception_code=pdu[2])
+				#DEVICE_BUSY is sent again, any other exception is the response
+				if pdu[2] == 6:
+					continue
+			elif function_code in [5, 6, 15, 16]:
+				response = LiteResponse(function_code, bits=[], registers=[])
+			else:
+				response = self.decode(function_code, pdu[2:])
+			record_rtt(policy, time.perf_counter() - start)
+			return response
+		record_failure(policy)
+		if error is not None:
+			raise error
+		return response
+
+	#Decode the data of a read response, the byte count and the bits (padded to a whole byte) or registers
+	def decode(self, function_code, data):
+		if function_code in [1, 2]:
+			return LiteResponse(function_code, bits=[bool(data[1 + bit // 8] >> bit % 8 & 1) for bit in range(data[0] * 8)])
+		return LiteResponse(function_code, registers=list(struct.unpack(f">{data[0] // 2}H", data[1:1 + data[0]])))
+
+	def read_coils(self, address, count=1, device_id=1):
+		return self.execute(device_id, 1, struct.pack(">HH", address, count))
+
+	def read_discrete_inputs(self, address, count=1, device_id=1):
+		return self.execute(device_id, 2, struct.pack(">HH", address, count))
+
+	def read_holding_registers(self, address, count=1, device_id=1):
+		return self.execute(device_id, 3, struct.pack(">HH", address, count))
+
+	def read_input_registers(self, address, count=1, device_id=1):
+		return self.execute(device_id, 4, struct.pack(">HH", address, count))
+
+	def write_coil(self, address, value, device_id=1):
+		return self.execute(device_id, 5, struct.pack(">HH", address, 0xFF00 if value else 0))
+
+	def write_coils(self, address, values, device_id=1):
+		packed = bits_to_int(values).to_bytes((len(values) + 7) // 8, "little")
+		return self.execute(device_id, 15, struct.pack(">HHB", address, len(values), len(packed)) + packed)
+
+	def write_register(self, address, value, device_id=1):
+		return self.execute(device_id, 6, struct.pack(">HH", address, value))
+
+	def write_registers(self, address, values, device_id=1):
+		return self.execute(device_id, 16, struct.pack(f">HHB{len(values)}H", address, len(values), len(values) * 2, *values))
+
+#A single read or write only needs LiteTcpClient, unless the pooled connections, metrics or cache of the pymodbus client are in use
+def use_lite_client():
+	return connection_hooks is None and metrics is None and cache is None
+
+def client(argv=None, cwd=None):
+	#arg parser, only imported here so commands sent to modbus_daemon.py do not import it
+	#Single reads and writes use the same parser as every other command, a parser with only their options would save about 0.6ms of the start up
+	import argparse
+	#Abbreviated options are not taken, so must_run_locally can find --poll without parsing the command line
+	parser = argparse.ArgumentParser(prog="modbus_cli.py", description="Modbus Interaction from the CLI to Read/Write to Coils and Registers", allow_abbrev=False)
 
 	#Add the read and write options, and allow user to only choose one.
 	group = parser.add_mutually_exclusive_group(required=True)
@@ -257,7 +2408,7 @@ def client():
 	parser.add_argument("-a", "--address", action="store", help="Target address on the ModBus Device")
 
 	#Add the argument for register vs Coil
-	reg_vs_coil = parser.add_mutually_exclusive_group(required=True)
+	reg_vs_coil = parser.add_mutually_exclusive_group()
 	reg_vs_coil.add_argument("--register", action="store_true", help="Select a Register as the Target")
 	reg_vs_coil.add_argument("-c", "--coil", action="store_true", help="Select a Coil as the Target")
 
@@ -267,17 +2418,68 @@ def client():
 	#Add the Data Type Request (FLOAT, INT, UINT)
 	parser.add_argument("-d", "--datatype", choices=["FLOAT", "INT", "UINT"], help="Choose a Data Type to get")
 
+	#Add the byte/word order of the registers, for devices that do not use big endian
+	parser.add_argument("-o", "--order", type=str.upper, choices=list(ORDERS), default="ABCD", help="Byte/word order of the registers: ABCD big endian, CDAB words swapped, BADC bytes swapped, DCBA little endian (Default: ABCD)")
+
 	#Add the value option, this is only necessary if doing a write operation.
 	parser.add_argument("-v", "--value", action="store", help="The new value to store at the given address")
 
+	#Add the option to read the value before a write and again after it, two more requests
+	parser.add_argument("--read-back", action="store_true", help="With -w read the value before the write and again after it, and show both (Default: only write)")
+
 	#Add the option to read discrete coils
-	parser.add_argument("--discrete", action="store_true", help="Reads from Discrete Input Coils")
+	parser.add_argument("--discrete", action="store_true", help="Reads from Discrete Input Coils, or Input Registers with --register")
+
+	#Add the option to read or write many coils in one request
+	parser.add_argument("--bits", type=int, metavar="COUNT", help="With -c read or write COUNT coils from the address in one request, as a bitset where bit 0 is the first coil (-v 0b1011 or 0xB)")
+
+	#Add the batch options, to read many tags with as few requests as possible
+	parser.add_argument("-t", "--tags", nargs="+", metavar="TAG", help="Read or write many tags at once. Registers as ADDRESS:SIZE:DATATYPE (1024:16:INT), coils as ADDRESS:COIL or ADDRESS:DISCRETE. Writes add the value as ADDRESS:SIZE:DATATYPE=VALUE")
+	parser.add_argument("--tag-map", metavar="FILE", help="Read the tags in a CSV or YAML tag map file")
+	parser.add_argument("--max-gap", type=int, default=DEFAULT_MAX_GAP, help=f"Largest number of unused addresses read between two tags to save a request (Default: {DEFAULT_MAX_GAP})")
+	parser.add_argument("--no-plan-cache", action="store_true", help="Compile the --tag-map every run, without loading or saving the compiled plan in $XDG_CACHE_HOME/modbus_cli")
+	parser.add_argument("--pipeline", type=int, default=1, metavar="WINDOW", help="Send up to WINDOW read requests before waiting for the responses, for high latency links. Devices that do not handle it are read one request at a time (Default: 1)")
+
+	#Add the polling options, to keep reading on a fixed schedule with a single connection
+	parser.add_argument("--poll", type=float, metavar="INTERVAL", help="Keep reading every INTERVAL seconds until interrupted")
+	parser.add_argument("--count", type=int, help="Number of samples to take with --poll (Default: until interrupted)")
+
+	#Add the output options, for collectors that parse the output
+	parser.add_argument("-f", "--format", choices=OUTPUT_FORMATS, default="text", help="Output format for reads: text, ndjson, csv or binary (length prefixed records) (Default: text)")
+	parser.add_argument("--flush-interval", type=float, default=0, metavar="SECONDS", help="Write the output at most every SECONDS, 0 to write after every sample (Default: 0)")
+
+	#Add the change only options, to output a tag only when its value changes while polling
+	parser.add_argument("--on-change", action="store_true", help="With --poll only output a tag when its value changes")
+	parser.add_argument("--deadband", type=parse_deadband, help="With --on-change only output numbers that change by more than this amount (0.5) or percent (2%%) (Default: any change)")
+	parser.add_argument("--heartbeat", type=float, metavar="SECONDS", help="With --on-change also output a tag that has not changed for SECONDS")
+
+	#Add the timeout, retry and circuit breaker options of the device
+	parser.add_argument("--timeout", type=float, default=3, metavar="SECONDS", help="Longest time to wait for a response. Once the device has answered the timeout follows its round trip time (Default: 3)")
+	parser.add_argument("--retries", type=int, default=1, help="Number of times a request that timed out or got DEVICE_BUSY is sent again, with backoff (Default: 1)")
+	parser.add_argument("--cooldown", type=float, default=30, metavar="SECONDS", help="With --poll, seconds a device is skipped for after 3 requests in a row have failed (Default: 30)")
+
+	#Add the cache option, to answer repeated reads without asking the device again
+	parser.add_argument("--cache-ttl", type=float, metavar="SECONDS", help="Answer reads from values read in the last SECONDS instead of asking the device again. In modbus_daemon.py started with --cache-ttl the cache is shared by every command")
+
+	#Add the sweep options, to find the addresses the device has
+	parser.add_argument("--sweep", nargs="*", choices=list(SWEEP_TABLES), metavar="TABLE", help="Find the address ranges the device answers in each TABLE: holding, input, coil, discrete (Default: all of them)")
+	parser.add_argument("--sweep-step", type=int, metavar="N", help="Largest number of addresses skipped at once in a gap, a range that does not hold a multiple of the step can be missed. 1 checks every address (Default: no limit, the step keeps doubling)")
+
+	#Add the metrics options, to time every request
+	parser.add_argument("--metrics-port", type=int, metavar="PORT", help="Serve the request metrics in the Prometheus format at http://127.0.0.1:PORT/metrics while the command runs")
+	parser.add_argument("--metrics-file", metavar="FILE", help="Write the request metrics in the Prometheus format to FILE on exit")
 
 	#Get the args
-	args = parser.parse_args()
+	args = parser.parse_args(argv)
+
+	#Commands run by modbus_daemon.py give file paths relative to the directory they were run in, not the daemon's
+	if cwd is not None:
+		for path_option in ["tag_map", "metrics_file"]:
+			if getattr(args, path_option) is not None:
+				setattr(args, path_option, os.path.join(cwd, getattr(args, path_option)))
 
 	#Check if the value arg is set when trying to write
-	if args.write and args.value is None:
+	if args.write and args.value is None and args.tags is None:
 		parser.error("-w requires -v arguement")
 
 	device_id = None
@@ -289,10 +2491,145 @@ def client():
 	#Check that the value argument is not set when trying to read
 	if args.read and args.value is not None:
 		parser.error("-r does not accept the -v argument")
+	if args.read_back and (not args.write or args.tags is not None):
+		parser.error("--read-back can only be used with -w and -a")
+
+	#Polling is only for reads, and needs a positive interval
+	if args.poll is not None:
+		if args.write:
+			parser.error("--poll can only be used with -r")
+		if args.poll <= 0:
+			parser.error("--poll INTERVAL should be greater than 0")
+	if args.count is not None:
+		if args.poll is None:
+			parser.error("--count requires --poll")
+		if args.count < 1:
+			parser.error("--count should be at least 1")
+	if args.on_change and args.poll is None:
+		parser.error("--on-change requires --poll")
+	if args.write and args.format != "text":
+		parser.error("--format can only be used with -r")
+	if args.flush_interval < 0:
+		parser.error("--flush-interval should not be negative")
+	if args.pipeline < 1:
+		parser.error("--pipeline should be at least 1")
+	if args.timeout <= 0 or args.cooldown <= 0:
+		parser.error("--timeout and --cooldown should be greater than 0")
+	if args.retries < 0:
+		parser.error("--retries should not be negative")
+	if args.cache_ttl is not None and args.cache_ttl < 0:
+		parser.error("--cache-ttl should not be negative")
+
+	#Every connection uses the timeout, retry and circuit breaker options
+	policy_options = {"timeout": args.timeout, "retries": args.retries, "cooldown": args.cooldown}
+
+	#The cache of modbus_daemon.py is only used with its own ttl or the ttl of the command, a command does not start one in the daemon
+	global cache
+	if args.cache_ttl is not None and cache is None and connection_hooks is None:
+		cache = make_cache(args.cache_ttl)
+	if (args.deadband is not None or args.heartbeat is not None) and not args.on_change:
+		parser.error("--deadband and --heartbeat require --on-change")
+	if args.heartbeat is not None and args.heartbeat <= 0:
+		parser.error("--heartbeat should be greater than 0")
+
+	#Record every request when the metrics are asked for
+	global metrics
+	if (args.metrics_port is not None or args.metrics_file is not None) and metrics is None:
+		metrics = make_metrics()
+		if args.metrics_port is not None:
+			try:
+				serve_metrics(metrics, args.metrics_port)
+			except OSError as e:
+				parser.error(f"unable to serve metrics on port {args.metrics_port}: {e}")
+		if args.metrics_file is not None:
+			atexit.register(write_metrics_file, metrics, args.metrics_file)
+
+	#A sweep only needs the device
+	if args.sweep is not None:
+		if not args.read:
+			parser.error("--sweep can only be used with -r")
+		if args.tags is not None or args.tag_map is not None or args.address is not None or args.poll is not None or args.format != "text":
+			parser.error("--sweep does not use --tags, --tag-map, -a, --poll or --format")
+		if args.sweep_step is not None and args.sweep_step < 1:
+			parser.error("--sweep-step should be at least 1")
+		run_sweep(connect(args.ip, args.port, policy_options, args.cache_ttl), args, device_id)
+		return
+
+	#Batch mode takes the address, type, size and datatype from each tag
+	if args.tags is not None or args.tag_map is not None:
+		if args.tags is not None and args.tag_map is not None:
+			parser.error("--tags and --tag-map cannot be used together")
+		if args.tag_map is not None and args.write:
+			parser.error("--tag-map can only be used with -r")
+		if args.address is not None or args.register or args.coil or args.size is not None or args.datatype is not None or args.discrete or args.value is not None:
+			parser.error("--tags and --tag-map do not use -a, --register, -c, -s, -d, -v or --discrete")
+		if args.max_gap < 0:
+			parser.error("--max-gap should not be negative")
+
+		tags = []
+		for tag in args.tags or []:
+			try:
+				tags.append(parse_write_tag(tag, args.order) if args.write else parse_tag(tag, args.order))
+			except ValueError as e:
+				parser.error(str(e))
+
+		#Plan the reads once, from the tags or the (cached) tag map
+		if args.read:
+			try:
+				plan = load_tag_map(args.tag_map, args.max_gap, not args.no_plan_cache, args.order) if args.tag_map is not None else compile_plan(tags, args.max_gap)
+			except (OSError, ValueError) as e:
+				parser.error(f"unable to load tag map: {e}")
+
+		#Check the write tags do not overlap before connecting
+		if args.write:
+			try:
+				plan_writes(tags)
+			except ValueError as e:
+				parser.error(str(e))
+
+		#Connect to Modbus TCP Server on PLC
+		client = connect(args.ip, args.port, policy_options, args.cache_ttl)
+		enable_pipeline(client, args.pipeline)
+
+		#Write all the tags and report each of them
+		if args.write:
+			for tag, error in write_batch(client, tags, device_id):
+				if error is None:
+					print(f"Success: {args.ip}:{args.port} {tag_label(tag)} set to {tag['value']}")
+				else:
+					print(f"Error: Writing {args.ip}:{args.port} {tag_label(tag)}: {error}")
+
+		#Keep reading the tags until interrupted
+		if args.poll is not None:
+			run_poll(client, args, plan, device_id)
+			return
+
+		#Read all the tags and output each of them
+		if args.read:
+			run_read(client, args, plan, device_id)
+
+		disconnect(client)
+		return
+
+	#Without batch mode a register or coil must be selected
+	if not (args.register or args.coil):
+		parser.error("one of the arguments --register -c/--coil is required")
 
 	#Check that the value is only 0, or 1 when writing to a coil.
 	#This check is being done with the value still as a string to mitigate a ValueError if I int the value and its not valid.
-	if args.write and args.coil and args.value not in ["0", "1"]:
+	if args.bits is not None:
+		if not args.coil:
+			parser.error("--bits can only be used with -c")
+		if not 1 <= args.bits <= (MAX_WRITE_COILS if args.write else MAX_READ_COILS):
+			parser.error(f"--bits should be between 1 and {MAX_WRITE_COILS if args.write else MAX_READ_COILS}")
+		if args.write:
+			try:
+				bits_value = int(args.value, 0)
+			except ValueError:
+				parser.error("-v value is not a valid number")
+			if not 0 <= bits_value < 1 << args.bits:
+				parser.error(f"-v value does not fit in {args.bits} coils")
+	elif args.write and args.coil and args.value not in ["0", "1"]:
 		parser.error("-c requires -v is only 1 (true) or 0 (false)")
 
 	#If writing and the target is a float, then confirm that the given value can be converted to a float
@@ -317,12 +2654,8 @@ def client():
 		except ValueError:
 			parser.error("-v value is not a valid unsigned integer")
 
-	#Discrete is only supported for coils (at this time, dont feel like implementing rn)
-	if args.register and args.discrete:
-		parser.error("--register does not support --discrete at this time")
-
-	#Discrete is a read only function, as you cannot write to them
-	if args.coil and args.discrete and args.write:
+	#Discrete coils and input registers are read only, as you cannot write to them
+	if args.discrete and args.write:
 		parser.error("--discrete cannot be done with --write")
 
 	#If selecting a register make sure the size is selected; If selecting a coil then size is not necessary
@@ -339,9 +2672,34 @@ def client():
 	if args.coil and not (args.datatype is None):
 		parser.error("--coil does not utilize --datatype argument")
 
+	#Polling, reading in a machine readable format, input registers and bitsets of many coils use the same path as a batch with one tag
+	if args.poll is not None or (args.read and (args.format != "text" or (args.register and args.discrete) or args.bits is not None)):
+		if args.address is None:
+			parser.error("-a argument is required")
+		try:
+			if args.coil:
+				tag = parse_tag(f"{args.address}:{'DISCRETE' if args.discrete else 'COIL'}:{args.bits or 1}")
+			else:
+				tag = parse_tag(f"{args.address}:{args.size}:{args.datatype}{':INPUT' if args.discrete else ''}", args.order)
+		except ValueError as e:
+			parser.error(str(e))
+
+		#Connect to Modbus TCP Server on PLC
+		client = connect(args.ip, args.port, policy_options, args.cache_ttl)
+		if args.poll is not None:
+			run_poll(client, args, compile_plan([tag], args.max_gap), device_id)
+		else:
+			run_read(client, args, compile_plan([tag], args.max_gap), device_id)
+			disconnect(client)
+		return
+
 	#Connect to Modbus TCP Server on PLC
-	client = ModbusTcpClient(f"{args.ip}",port=int(args.port))
-	client.connect()
+	#A single read or write uses the lite client, so pymodbus is not imported
+	if use_lite_client():
+		client = LiteTcpClient(args.ip, args.port, policy_options)
+		client.connect()
+	else:
+		client = connect(args.ip, args.port, policy_options, args.cache_ttl)
 
 	#Logic for is -c is selected
 	if args.coil:
@@ -364,33 +2722,44 @@ def client():
 				else:
 					print(f"Error: Unable to Read Value from discrete coil {args.address}")
 
+		#Write many coils in one request
+		if args.write and args.bits is not None:
+			#With --read-back get the original value before doing the set
+			old_val = get_coils(client, int(args.address), args.bits, device_id) if args.read_back else None
+			operation = set_coils(client, int(args.address), bits_value, args.bits, device_id)
+			if operation and args.read_back:
+				#Read the coils to ensure user sees the values they actually hold
+				read_new_val = get_coils(client, int(args.address), args.bits, device_id)
+				print(f"Success: {args.ip}:{args.port} Coil {args.address}-{int(args.address)+args.bits-1} changed from {old_val if old_val is None else hex(old_val)} to {read_new_val if read_new_val is None else hex(read_new_val)}")
+			elif operation:
+				print(f"Success: {args.ip}:{args.port} Coil {args.address}-{int(args.address)+args.bits-1} set to {bits_value:#x}")
+			else:
+				print(f"Error: Unable to set value")
+
 		#Check if writing
-		if args.write:
-			#Get the original value before doing the set
-			old_val = get_coil(client, int(args.address), device_id)
+		elif args.write:
+			#With --read-back get the original value before doing the set
+			old_val = get_coil(client, int(args.address), device_id) if args.read_back else None
 			#Complete the write operation
 			operation = set_coil(client, int(args.address), int(args.value), device_id)
 			#Check if the operating was successful if not alert the user to the error.
-			if operation:
-				print(f"Success: {args.ip}:{args.port} Coil {args.address} changed from {old_val} to {return_bool_val(int(args.value))}")
+			if operation and args.read_back:
+				#Read the coil to ensure user sees value the coil actually holds
+				print(f"Success: {args.ip}:{args.port} Coil {args.address} changed from {old_val} to {get_coil(client, int(args.address), device_id)}")
+			elif operation:
+				print(f"Success: {args.ip}:{args.port} Coil {args.address} set to {return_bool_val(int(args.value))}")
 			else:
 				print(f"Error: Unable to set value")
 
 	#Logic for it --size is 64
 	if args.size == 64:
-		data_type = None
 		#Get Data Type to Pass
-		if args.datatype == 'FLOAT':
-			data_type = client.DATATYPE.FLOAT64
-		elif args.datatype == 'INT':
-			data_type = client.DATATYPE.INT64
-		elif args.datatype == 'UINT':
-			data_type = client.DATATYPE.UINT64
+		data_type = get_data_type(client, 64, args.datatype)
 
 		#Check if reading
 		if args.read:
 			#Do the read operation
-			operation = get_64bit_register(client, int(args.address), data_type, device_id)
+			operation = get_64bit_register(client, int(args.address), data_type, device_id, args.order)
 			#Confirm the read was successful, and output the results. If the read failed then alert the user
 			if operation != None:
 				print(f"Success: {args.ip}:{args.port} Register {args.address}-{int(args.address)+3} = {operation}")
@@ -398,8 +2767,8 @@ def client():
 				print(f"Error: Reading {args.ip}:{args.port} Register {args.address}")
 
 		if args.write:
-			#Get the origianl value before doing the write
-			old_val = get_64bit_register(client, int(args.address), data_type, device_id)
+			#With --read-back get the original value before doing the write
+			old_val = get_64bit_register(client, int(args.address), data_type, device_id, args.order) if args.read_back else None
 			#Conver given value to correct datatype
 			new_val = ""
 			if args.datatype == "FLOAT":
@@ -407,28 +2776,26 @@ def client():
 			elif args.datatype in ["UINT", "INT"]:
 				new_val = int(args.value)
 			#Complete the write operation
-			operation = set_64bit_register(client, int(args.address), new_val, data_type, device_id)
+			operation = set_64bit_register(client, int(args.address), new_val, data_type, device_id, args.order)
 			#If successful let the user know of the change, if unsuccessful then alert them
-			#Read the register to ensure user sees value register actually holds
-			read_new_val = get_64bit_register(client, int(args.address), data_type, device_id)
-			if operation:
+			if operation and args.read_back:
+				#Read the register to ensure user sees value register actually holds
+				read_new_val = get_64bit_register(client, int(args.address), data_type, device_id, args.order)
 				print(f"Success: {args.ip}:{args.port} Register {args.address}-{int(args.address)+3} change from {old_val} to {read_new_val}")
+			elif operation:
+				print(f"Success: {args.ip}:{args.port} Register {args.address}-{int(args.address)+3} set to {new_val}")
+			else:
+				print(f"Error: Unable to set value")
 
 	#Logic for if --size is 32
 	if args.size == 32:
-		data_type = None
 		#Get Data Type to Pass
-		if args.datatype == 'FLOAT':
-			data_type = client.DATATYPE.FLOAT32
-		elif args.datatype == 'INT':
-			data_type = client.DATATYPE.INT32
-		elif args.datatype == 'UINT':
-			data_type = client.DATATYPE.UINT32
+		data_type = get_data_type(client, 32, args.datatype)
 
 		#Check if reading
 		if args.read:
 			#Do the read operation
-			operation = get_32bit_register(client, int(args.address), data_type, device_id)
+			operation = get_32bit_register(client, int(args.address), data_type, device_id, args.order)
 			#Confirm the read was successful, and output the results. If the read failed then alert the user
 			if operation != None:
 				print(f"Success: {args.ip}:{args.port} Register {args.address}-{int(args.address)+1} = {operation}")
@@ -437,8 +2804,8 @@ def client():
 
 		#Check if writing
 		if args.write:
-			#Get the original value before doing the write
-			old_val = get_32bit_register(client, int(args.address), data_type, device_id)
+			#With --read-back get the original value before doing the write
+			old_val = get_32bit_register(client, int(args.address), data_type, device_id, args.order) if args.read_back else None
 			#Convert given value to correct datatype
 			new_val = ""
 			if args.datatype == "FLOAT":
@@ -446,31 +2813,29 @@ def client():
 			elif args.datatype in ["UINT", "INT"]:
 				new_val = int(args.value)
 			#Complete the write operation
-			operation = set_32bit_register(client, int(args.address), new_val, data_type, device_id)
+			operation = set_32bit_register(client, int(args.address), new_val, data_type, device_id, args.order)
 			#If successful let the user know of the change, if unsuccessful then alert them
-			#Read the register to ensure user sees value register actually holds
-			read_new_val = get_32bit_register(client, int(args.address), data_type, device_id)
-			if operation:
-				print(f"Success: {args.ip}:{args.port} Register {args.address}-{int(args.address)+1} changed from {old_val} to {args.value}")
+			if operation and args.read_back:
+				#Read the register to ensure user sees value register actually holds
+				read_new_val = get_32bit_register(client, int(args.address), data_type, device_id, args.order)
+				print(f"Success: {args.ip}:{args.port} Register {args.address}-{int(args.address)+1} changed from {old_val} to {read_new_val}")
+			elif operation:
+				print(f"Success: {args.ip}:{args.port} Register {args.address}-{int(args.address)+1} set to {new_val}")
 			else:
 				print(f"Error: Unable to set value")
 
 
 	#Logic for if --size is 16
 	if args.size == 16:
-		data_type = None
 		#Get Data Type to Pass
-		if args.datatype == "FLOAT":
+		data_type = get_data_type(client, 16, args.datatype)
+		if data_type is None:
 			parser.error("16bit Register Size does not support type FLOAT")
-		elif args.datatype == "INT":
-			data_type = client.DATATYPE.INT16
-		elif args.datatype == "UINT":
-			data_type = client.DATATYPE.UINT16
 
 		#Check if reading
 		if args.read:
 			#Do the read operation
-			operation = get_16bit_register(client, int(args.address), data_type, device_id)
+			operation = get_16bit_register(client, int(args.address), data_type, device_id, args.order)
 			#If the read was successful then let the user know, otherwise throw an error
 			if operation != None:
 				print(f"{args.ip}:{args.port} Register {args.address} = {operation}")
@@ -479,8 +2844,8 @@ def client():
 
 		#Check if writing
 		if args.write:
-			#Get the original value before doing the write
-			old_val = get_16bit_register(client, int(args.address), data_type, device_id)
+			#With --read-back get the original value before doing the write
+			old_val = get_16bit_register(client, int(args.address), data_type, device_id, args.order) if args.read_back else None
 
 			#Convert given value to correct datatype
 			new_val = ""
@@ -490,14 +2855,34 @@ def client():
 				new_val = int(args.value)
 
 			#Complete the write operation
-			operation = set_16bit_register(client, int(args.address), int(args.value), data_type, device_id)
+			operation = set_16bit_register(client, int(args.address), int(args.value), data_type, device_id, args.order)
 			#If successful let the user know of the change, fi unsuccessful then alert them.
-			#Read the register to ensure user sees value register actually holds
-			read_new_val = get_16bit_register(client, int(args.address), data_type, device_id)
-			if operation:
-				print(f"Success: {args.ip}:{args.port} Register {args.address} changed from {old_val} to {args.value}")
+			if operation and args.read_back:
+				#Read the register to ensure user sees value register actually holds
+				read_new_val = get_16bit_register(client, int(args.address), data_type, device_id, args.order)
+				print(f"Success: {args.ip}:{args.port} Register {args.address} changed from {old_val} to {read_new_val}")
+			elif operation:
+				print(f"Success: {args.ip}:{args.port} Register {args.address} set to {new_val}")
 			else:
 				print(f"Error: Unable to set value")
 
+	disconnect(client)
+
+#Used as a library every function works straight away, run as a command pymodbus is imported by connect
+if __name__ != "__main__":
+	import_pymodbus()
+
 if __name__ == "__main__":
-	client()
+	#When MODBUS_CLI_SOCKET is set the command is run by modbus_daemon.py using its open connections
+	#Commands that must run locally are always run here, as is every command if the daemon is not running
+	socket_path = os.environ.get("MODBUS_CLI_SOCKET")
+	if socket_path and not must_run_locally(sys.argv[1:]):
+		status = forward_to_daemon(socket_path, sys.argv[1:])
+		if status is not None:
+			sys.exit(status)
+	try:
+		client()
+	except (ModbusException, OSError) as e:
+		#A device that does not respond, or cannot be connected to, is an error and not a crash
+		print(f"Error: {e}", file=sys.stderr)
+		sys.exit(1)
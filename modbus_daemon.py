@@ -0,0 +1,247 @@
+import argparse
+import io
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+import traceback
+from pymodbus.client import ModbusTcpClient
+from pymodbus.exceptions import ModbusException
+import modbus_cli
+
+"""
+  ------------- CONNECTION POOL FUNCTIONS  -------------
+ - make_pool(max_per_device, idle_timeout)
+	-> max_per_device -- largest number of open connections to each (ip, port), for devices that limit their sessions
+	-> idle_timeout -- seconds an unused connection is kept open
+	RETURN: pool dictionary used by the other pool functions
+
+ - pool_connect(pool, ip, port)
+	-> pool -- pool dictionary from make_pool
+	-> ip -- IP address of the modbus device
+	-> port -- port of the modbus service
+	RETURN: connected pymodbus client object, waiting for a free connection if the device is at max_per_device
+
+ - pool_release(pool, client)
+	-> pool -- pool dictionary from make_pool
+	-> client -- pymodbus client object from pool_connect
+	RETURN: None; the connection is kept for the next command, or closed if it is no longer connected
+
+ - pool_check(pool)
+	-> pool -- pool dictionary from make_pool
+	RETURN: None; closes connections that have been idle longer than idle_timeout, or have lost their connection
+"""
+
+#Build an empty connection pool
+def make_pool(max_per_device=1, idle_timeout=60):
+	return {"max_per_device": max_per_device, "idle_timeout": idle_timeout, "devices": {}, "lock": threading.Condition(), "in_use": threading.local()}
+
+#Get a connection to the device, reusing an idle one when there is one
+def pool_connect(pool, ip, port):
+	key = (ip, port)
+	with pool["lock"]:
+		device = pool["devices"].setdefault(key, {"idle": [], "open": 0})
+		#Wait for a connection to be given back if the device has all of its connections in use
+		while not device["idle"] and device["open"] >= pool["max_per_device"]:
+			pool["lock"].wait()
+		if device["idle"]:
+			client, last_used = device["idle"].pop()
+		else:
+			client = None
+			device["open"] += 1
+
+	try:
+		#Health check, an idle connection the device closed is opened again
+		if client is None:
+			client = ModbusTcpClient(ip, port=port)
+			if modbus_cli.metrics is not None:
+				modbus_cli.instrument_client(client, modbus_cli.metrics, f"{ip}:{port}")
+		if not client.connected:
+			client.connect()
+	except Exception:
+		forget_connection(pool, key, client)
+		raise
+
+	client.pool_key = key
+	in_use = pool["in_use"].__dict__.setdefault("clients", [])
+	in_use.append(client)
+	return client
+
+#Close a connection and remove it from the pool count
+def forget_connection(pool, key, client):
+	if client is not None:
+		client.close()
+	with pool["lock"]:
+		pool["devices"][key]["open"] -= 1
+		pool["lock"].notify_all()
+
+#Give a connection back to the pool
+def pool_release(pool, client):
+	in_use = pool["in_use"].__dict__.get("clients", [])
+	if client not in in_use:
+		return
+	in_use.remove(client)
+
+	if not client.connected:
+		forget_connection(pool, client.pool_key, client)
+		return
+	with pool["lock"]:
+		pool["devices"][client.pool_key]["idle"].append((client, time.monotonic()))
+		pool["lock"].notify_all()
+
+#Give back every connection the current thread still has, after a command that did not disconnect (errors, parser exits)
+def pool_release_all(pool):
+	for client in list(pool["in_use"].__dict__.get("clients", [])):
+		pool_release(pool, client)
+
+#Close connections that have been idle too long or are no longer connected
+def pool_check(pool):
+	now = time.monotonic()
+	closing = []
+	with pool["lock"]:
+		for device in pool["devices"].values():
+			keep = []
+			for client, last_used in device["idle"]:
+				if now - last_used > pool["idle_timeout"] or not client.connected:
+					closing.append(client)
+					device["open"] -= 1
+				else:
+					keep.append((client, last_used))
+			device["idle"] = keep
+		pool["lock"].notify_all()
+	for client in closing:
+		client.close()
+
+"""
+  ------------- DAEMON FUNCTIONS  -------------
+ - run_command(argv, cwd)
+	-> argv -- command line arguments for modbus_cli.py
+	-> cwd -- working directory of the modbus_cli.py that sent the command, relative file paths are found from it (Default: None, the daemon's)
+	RETURN: {"stdout", "stderr", "status"} with the output and exit status of the command; commands that must run locally (--poll, binary output, metrics options) are not run and get status 2
+
+ - serve(socket_path, pool, metrics_port, cache)
+	-> socket_path -- path of the unix socket to listen on
+	-> pool -- pool dictionary from make_pool
+	-> metrics_port -- port to serve the request metrics of every command on, at /metrics (Default: None, no metrics)
+	-> cache -- cache dictionary from modbus_cli.make_cache shared by every command, so commands reading the same registers do not each ask the device (Default: None, no cache)
+	RETURN: None, runs until interrupted
+"""
+
+#Print to the output of the command running on the current thread, so commands can run at the same time
+class ThreadOutput(io.TextIOBase):
+	def __init__(self, default):
+		self.default = default
+		self.local = threading.local()
+
+	def write(self, text):
+		return getattr(self.local, "stream", self.default).write(text)
+
+	def flush(self):
+		getattr(self.local, "stream", self.default).flush()
+
+#Run a modbus_cli.py command and capture its output
+def run_command(argv, cwd=None):
+	#A poll would never return and hold its pooled connections, so it is turned down like a bad argument
+	if modbus_cli.must_run_locally(argv):
+		return {"stdout": "", "stderr": "modbus_daemon.py: error: --poll, binary output and the metrics options are only run by modbus_cli.py\n", "status": 2}
+	stdout = io.StringIO()
+	stderr = io.StringIO()
+	sys.stdout.local.stream = stdout
+	sys.stderr.local.stream = stderr
+	status = 0
+	try:
+		modbus_cli.client(argv, cwd)
+	except SystemExit as e:
+		#argparse exits with 2 on a bad argument
+		status = e.code if isinstance(e.code, int) else 1
+	except ModbusException as e:
+		print(f"Error: {e}", file=sys.stderr)
+		status = 1
+	except Exception:
+		traceback.print_exc()
+		status = 1
+	finally:
+		del sys.stdout.local.stream
+		del sys.stderr.local.stream
+	return {"stdout": stdout.getvalue(), "stderr": stderr.getvalue(), "status": status}
+
+#Handle one command from modbus_cli.py
+class CommandHandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		try:
+			request = json.loads(self.rfile.readline())
+			argv = [str(arg) for arg in request["argv"]]
+			cwd = request.get("cwd")
+		except (ValueError, KeyError, TypeError, AttributeError):
+			return
+		try:
+			reply = run_command(argv, cwd if isinstance(cwd, str) else None)
+		finally:
+			pool_release_all(self.server.pool)
+		self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+class CommandServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+#Check the pool in the background every few seconds
+def check_pool_forever(pool, interval):
+	while True:
+		time.sleep(interval)
+		pool_check(pool)
+
+#Listen for commands on the unix socket until interrupted
+def serve(socket_path, pool, metrics_port=None, cache=None):
+	#Remove a socket left behind by a daemon that did not shut down cleanly
+	if os.path.exists(socket_path):
+		os.unlink(socket_path)
+
+	#Send the output of each command back to the modbus_cli.py that sent it
+	sys.stdout = ThreadOutput(sys.stdout)
+	sys.stderr = ThreadOutput(sys.stderr)
+	modbus_cli.connection_hooks = {"connect": lambda ip, port: pool_connect(pool, ip, port), "release": lambda client: pool_release(pool, client)}
+	#The pooled connections record their requests for the whole life of the daemon
+	if metrics_port is not None:
+		modbus_cli.metrics = modbus_cli.make_metrics()
+		modbus_cli.serve_metrics(modbus_cli.metrics, metrics_port)
+	modbus_cli.cache = cache
+
+	server = CommandServer(socket_path, CommandHandler)
+	server.pool = pool
+	os.chmod(socket_path, 0o600)
+	threading.Thread(target=check_pool_forever, args=(pool, min(5, pool["idle_timeout"])), daemon=True).start()
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		os.unlink(socket_path)
+		pool["idle_timeout"] = -1
+		pool_check(pool)
+
+def client():
+	parser = argparse.ArgumentParser(description="Keep Modbus connections open for modbus_cli.py. Run modbus_cli.py with MODBUS_CLI_SOCKET set to the socket path to use it")
+	parser.add_argument("--socket", default=os.environ.get("MODBUS_CLI_SOCKET", "/tmp/modbus_cli.sock"), help="Path of the unix socket to listen on (Default: $MODBUS_CLI_SOCKET or /tmp/modbus_cli.sock)")
+	parser.add_argument("--max-per-device", type=int, default=1, help="Largest number of open connections to each device (Default: 1)")
+	parser.add_argument("--idle-timeout", type=float, default=60, help="Seconds an unused connection is kept open (Default: 60)")
+	parser.add_argument("--metrics-port", type=int, metavar="PORT", help="Serve the request metrics of every command in the Prometheus format at http://127.0.0.1:PORT/metrics")
+	parser.add_argument("--cache-ttl", type=float, metavar="SECONDS", help="Answer the reads of every command from values read in the last SECONDS, commands can ask for a different ttl with their own --cache-ttl (Default: no cache)")
+	parser.add_argument("--cache-size", type=int, default=1024, help="Largest number of reads kept in the cache, the least recently used are dropped first (Default: 1024)")
+	args = parser.parse_args()
+
+	if args.max_per_device < 1:
+		parser.error("--max-per-device should be at least 1")
+	if args.idle_timeout <= 0:
+		parser.error("--idle-timeout should be greater than 0")
+	if args.cache_ttl is not None and args.cache_ttl < 0:
+		parser.error("--cache-ttl should not be negative")
+	if args.cache_size < 1:
+		parser.error("--cache-size should be at least 1")
+
+	cache = modbus_cli.make_cache(args.cache_ttl, args.cache_size) if args.cache_ttl is not None else None
+	serve(args.socket, make_pool(args.max_per_device, args.idle_timeout), args.metrics_port, cache)
+
+if __name__ == "__main__":
+	client()
@@ -0,0 +1,541 @@
+import argparse
+import array
+import asyncio
+import datetime
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from pymodbus.constants import ExcCodes
+from pymodbus.exceptions import ModbusException
+from pymodbus.server import StartAsyncTcpServer
+import modbus_cli
+from modbus_sim import make_sim_device
+
+"""
+  ------------- RECORDING FUNCTIONS  -------------
+ - make_recorder(path, plan, device, interval, chunk_samples)
+	-> path -- file to record to. An existing recording of the same device and tags is appended to
+	-> plan -- read plan from modbus_cli.compile_plan or modbus_cli.load_tag_map
+	-> device -- name of the device, ip:port
+	-> interval -- seconds between samples, saved in the header
+	-> chunk_samples -- number of samples kept in memory and compressed together (Default: 600)
+	RETURN: recorder dictionary used by the other recording functions; raises ValueError if the file is a recording of other tags
+
+ - record_sample(recorder, timestamp, responses)
+	-> recorder -- recorder dictionary from make_recorder
+	-> timestamp -- time of the sample, seconds since the epoch
+	-> responses -- list of responses from modbus_cli.read_plan_blocks, None for a block that could not be read
+	RETURN: None; the chunk is compressed and written once it holds chunk_samples samples
+
+ - close_recorder(recorder)
+	-> recorder -- recorder dictionary from make_recorder
+	RETURN: None; writes the samples that are waiting and closes the file
+"""
+
+#File layout: FILE_MAGIC, the 32bit length of the JSON header, the JSON header, then chunks appended one after the other
+FILE_MAGIC = b"MBREC1\n\x00"
+RECORDING_VERSION = 1
+
+#Chunk: magic, length of the body, number of samples, time of the first and last sample in microseconds
+#The body holds the 32bit compressed length of each section, then the sections:
+#time deltas (int64), status (one byte per block per sample, 1 read, 0 failed), then one section per block
+#Block sections are column major, each address is a run of its values over the chunk, stored as the change from the last sample
+CHUNK_HEADER = struct.Struct("<4sIIqq")
+CHUNK_MAGIC = b"MBCK"
+
+#Register values change mod 65536, coil values are 0 or 1
+BLOCK_ARRAYS = {"register": ("H", 0xFFFF), "input": ("H", 0xFFFF), "coil": ("B", 1), "discrete": ("B", 1)}
+
+#Compress an array of numbers, stored little endian
+def pack_array(typecode, values):
+	packed = array.array(typecode, values)
+	if sys.byteorder == "big":
+		packed.byteswap()
+	return zlib.compress(packed.tobytes())
+
+#Decompress an array from pack_array
+def unpack_array(typecode, data):
+	packed = array.array(typecode)
+	packed.frombytes(zlib.decompress(data))
+	if sys.byteorder == "big":
+		packed.byteswap()
+	return packed
+
+#Build the JSON header of a recording
+def recording_header(plan, device, interval):
+	#Round trip the plan through JSON, so it compares equal to the header of an existing recording
+	return {"version": RECORDING_VERSION, "device": device, "interval": interval, "plan": json.loads(json.dumps(modbus_cli.plan_to_json(plan)))}
+
+#Open a recording to append samples to, writing the header of a new file
+def make_recorder(path, plan, device, interval, chunk_samples=600):
+	header = recording_header(plan, device, interval)
+	if os.path.exists(path) and os.path.getsize(path) > 0:
+		recording = open_recording(path)
+		try:
+			old_header = recording["header"]
+			end = recording["end"]
+		finally:
+			close_recording(recording)
+		if old_header["device"] != device or old_header["plan"] != header["plan"]:
+			raise ValueError(f"{path} is a recording of other tags or another device")
+		#Drop a chunk that was only partly written when the recorder was stopped
+		recording_file = open(path, "r+b")
+		recording_file.truncate(end)
+		recording_file.seek(end)
+	else:
+		recording_file = open(path, "wb")
+		data = json.dumps(header).encode()
+		recording_file.write(FILE_MAGIC + struct.pack("<I", len(data)) + data)
+		recording_file.flush()
+	return {"file": recording_file, "plan": plan, "chunk_samples": chunk_samples, "times": [], "samples": [], "recorded": 0, "last": [None] * len(plan["blocks"])}
+
+#Add a sample to the chunk being recorded
+def record_sample(recorder, timestamp, responses):
+	values = []
+	for block, response in zip(recorder["plan"]["blocks"], responses):
+		if response is None or response.isError():
+			values.append(None)
+		elif block["type"] in ["register", "input"]:
+			values.append(response.registers[:block["count"]])
+		else:
+			values.append(response.bits[:block["count"]])
+	recorder["times"].append(round(timestamp * 1000000))
+	recorder["samples"].append(values)
+	recorder["recorded"] += 1
+	if len(recorder["samples"]) >= recorder["chunk_samples"]:
+		flush_chunk(recorder)
+
+#Compress the samples that are waiting and append them to the file as a chunk
+def flush_chunk(recorder):
+	times = recorder["times"]
+	samples = recorder["samples"]
+	if not samples:
+		return
+	blocks = recorder["plan"]["blocks"]
+
+	#The first time is in the chunk header, every time after it is the change from the one before
+	sections = [pack_array("q", [0] + [times[i] - times[i - 1] for i in range(1, len(times))])]
+	sections.append(pack_array("B", [sample[number] is not None for number in range(len(blocks)) for sample in samples]))
+
+	for number, block in enumerate(blocks):
+		typecode, mask = BLOCK_ARRAYS[block["type"]]
+		#A failed read keeps the values of the sample before it, so it adds no changes
+		rows = []
+		last = recorder["last"][number] or [0] * block["count"]
+		for sample in samples:
+			if sample[number] is not None:
+				last = sample[number]
+			rows.append(last)
+		recorder["last"][number] = last
+
+		deltas = []
+		for column in zip(*rows):
+			previous = 0
+			for value in column:
+				deltas.append((value - previous) & mask)
+				previous = value
+		sections.append(pack_array(typecode, deltas))
+
+	body = struct.pack(f"<{len(sections)}I", *[len(section) for section in sections]) + b"".join(sections)
+	recorder["file"].write(CHUNK_HEADER.pack(CHUNK_MAGIC, len(body), len(samples), times[0], times[-1]) + body)
+	recorder["file"].flush()
+	times.clear()
+	samples.clear()
+
+#Write the samples that are waiting and close the file
+def close_recorder(recorder):
+	try:
+		flush_chunk(recorder)
+	finally:
+		recorder["file"].close()
+
+"""
+  ------------- READING FUNCTIONS  -------------
+ - open_recording(path)
+	-> path -- file written by a recorder
+	RETURN: recording dictionary {"header", "plan", "chunks", "end"}, the file is memory mapped and only the chunk headers are read; raises ValueError if it is not a recording
+
+ - close_recording(recording)
+	-> recording -- recording dictionary from open_recording
+	RETURN: None
+
+ - read_samples(recording, start, end, blocks)
+	-> recording -- recording dictionary from open_recording
+	-> start -- first time to read, seconds since the epoch (Default: None, from the start)
+	-> end -- last time to read, seconds since the epoch (Default: None, to the end)
+	-> blocks -- set of the numbers of the plan blocks to decompress (Default: None, every block)
+	RETURN: generator of (timestamp, values) where values has the registers or bits of each block, None if the block failed or was not asked for. Chunks outside the time range are not decompressed
+
+ - query(recording, start, end, names)
+	-> recording -- recording dictionary from open_recording
+	-> start -- first time to read, seconds since the epoch (Default: None, from the start)
+	-> end -- last time to read, seconds since the epoch (Default: None, to the end)
+	-> names -- list of the tag names to read (Default: None, every tag)
+	RETURN: generator of (timestamp, results) where results is a list of [tag, value] decoded the same as modbus_cli.read_plan; raises ValueError for an unknown tag name
+"""
+
+#Function code of the read response for each type of block
+BLOCK_FUNCTION_CODES = {"coil": 1, "discrete": 2, "register": 3, "input": 4}
+
+#Memory map a recording and find its chunks
+def open_recording(path):
+	with open(path, "rb") as recording_file:
+		try:
+			data = mmap.mmap(recording_file.fileno(), 0, access=mmap.ACCESS_READ)
+		except ValueError:
+			raise ValueError(f"{path} is not a recording")
+	try:
+		if data[:len(FILE_MAGIC)] != FILE_MAGIC or len(data) < len(FILE_MAGIC) + 4:
+			raise ValueError(f"{path} is not a recording")
+		length, = struct.unpack_from("<I", data, len(FILE_MAGIC))
+		position = len(FILE_MAGIC) + 4 + length
+		header = json.loads(data[len(FILE_MAGIC) + 4:position])
+		if header.get("version") != RECORDING_VERSION:
+			raise ValueError(f"{path} was recorded by another version")
+	except ValueError:
+		data.close()
+		raise
+
+	#Read only the chunk headers. A chunk cut short by the recorder stopping ends the recording
+	chunks = []
+	while position + CHUNK_HEADER.size <= len(data):
+		magic, size, samples, first, last = CHUNK_HEADER.unpack_from(data, position)
+		if magic != CHUNK_MAGIC or position + CHUNK_HEADER.size + size > len(data):
+			break
+		chunks.append({"offset": position + CHUNK_HEADER.size, "size": size, "samples": samples, "first": first, "last": last})
+		position += CHUNK_HEADER.size + size
+	return {"data": data, "header": header, "plan": modbus_cli.plan_from_json(header["plan"]), "chunks": chunks, "end": position}
+
+#Close a recording from open_recording
+def close_recording(recording):
+	recording["data"].close()
+
+#Decompress the sections of a chunk that are needed
+def read_chunk(recording, chunk, blocks=None):
+	data = recording["data"]
+	plan_blocks = recording["plan"]["blocks"]
+	samples = chunk["samples"]
+	lengths = struct.unpack_from(f"<{len(plan_blocks) + 2}I", data, chunk["offset"])
+	offsets = [chunk["offset"] + 4 * len(lengths)]
+	for length in lengths:
+		offsets.append(offsets[-1] + length)
+	section = lambda number: data[offsets[number]:offsets[number + 1]]
+
+	times = []
+	timestamp = chunk["first"]
+	for delta in unpack_array("q", section(0)):
+		timestamp += delta
+		times.append(timestamp / 1000000)
+	status = unpack_array("B", section(1))
+
+	columns = [None] * len(plan_blocks)
+	for number, block in enumerate(plan_blocks):
+		if blocks is not None and number not in blocks:
+			continue
+		typecode, mask = BLOCK_ARRAYS[block["type"]]
+		deltas = unpack_array(typecode, section(number + 2))
+		#Add the changes back up, one address at a time, then turn the columns back into samples
+		rows = [[value & mask for value in itertools.accumulate(deltas[column * samples:(column + 1) * samples])] for column in range(block["count"])]
+		values = [list(sample) for sample in zip(*rows)]
+		columns[number] = [values[sample] if status[number * samples + sample] else None for sample in range(samples)]
+	return times, columns
+
+#Read the samples in a time range, one chunk at a time
+def read_samples(recording, start=None, end=None, blocks=None):
+	start_us = None if start is None else start * 1000000
+	end_us = None if end is None else end * 1000000
+	for chunk in recording["chunks"]:
+		if (start_us is not None and chunk["last"] < start_us) or (end_us is not None and chunk["first"] > end_us):
+			continue
+		times, columns = read_chunk(recording, chunk, blocks)
+		for sample, timestamp in enumerate(times):
+			if (start is not None and timestamp < start) or (end is not None and timestamp > end):
+				continue
+			yield timestamp, [None if column is None else column[sample] for column in columns]
+
+#Build a read response from recorded values, so it can be decoded with modbus_cli.decode_block
+def block_response(block, values):
+	if values is None:
+		return None
+	function_code = BLOCK_FUNCTION_CODES[block["type"]]
+	if function_code in [1, 2]:
+		return modbus_cli.CACHED_READS[function_code](count=block["count"], bits=[bool(value) for value in values])
+	return modbus_cli.CACHED_READS[function_code](count=block["count"], registers=values)
+
+#Decode the tags out of the recorded samples in a time range
+def query(recording, start=None, end=None, names=None):
+	plan = recording["plan"]
+	tags = plan["tags"]
+	if names is not None:
+		known = {tag["name"] for tag in tags}
+		for name in names:
+			if name not in known:
+				raise ValueError(f"no tag named {name} in the recording")
+		tags = [tag for tag in tags if tag["name"] in names]
+
+	#Only decompress the blocks that hold the tags asked for
+	wanted = {id(tag) for tag in tags}
+	blocks = {number for number, block in enumerate(plan["blocks"]) if any(id(tag) in wanted for tag in block["tags"])}
+	for timestamp, samples in read_samples(recording, start, end, blocks):
+		values = {}
+		for number in blocks:
+			block = plan["blocks"][number]
+			modbus_cli.decode_block(block, block_response(block, samples[number]), values)
+		yield timestamp, [[tag, values[id(tag)]] for tag in tags]
+
+"""
+  ------------- REPLAY FUNCTIONS  -------------
+ - replay(recording, writer, start, end, names, speed)
+	-> recording -- recording dictionary from open_recording
+	-> writer -- writer dictionary from modbus_cli.make_writer
+	-> start -- first time to replay, seconds since the epoch (Default: None, from the start)
+	-> end -- last time to replay, seconds since the epoch (Default: None, to the end)
+	-> names -- list of the tag names to replay (Default: None, every tag)
+	-> speed -- replay this many times faster than recorded, 0 to output every sample at once (Default: 0)
+	RETURN: number of samples replayed; each sample is output with the time it was recorded
+
+ - make_replay_device(recording, start, end, speed, loop)
+	-> recording -- recording dictionary from open_recording
+	-> start -- first time to replay, seconds since the epoch (Default: None, from the start)
+	-> end -- last time to replay, seconds since the epoch (Default: None, to the end)
+	-> speed -- replay this many times faster than recorded (Default: 1)
+	-> loop -- start again from the first sample after the last one (Default: False, keep the last sample)
+	RETURN: pymodbus SimDevice answering every read with the sample recorded at the replay time. Blocks that failed to read answer with a DEVICE_FAILURE exception. The replay starts once the device is built
+"""
+
+#Output the recorded samples through the decoders and a writer, as they were read
+def replay(recording, writer, start=None, end=None, names=None, speed=0):
+	device = recording["header"]["device"]
+	replayed = 0
+	first = None
+	for timestamp, results in query(recording, start, end, names):
+		#Wait until the sample is due, measured from the first sample
+		if speed:
+			if first is None:
+				first = (timestamp, time.monotonic())
+			delay = first[1] + (timestamp - first[0]) / speed - time.monotonic()
+			if delay > 0:
+				modbus_cli.flush_writer(writer)
+				time.sleep(delay)
+		modbus_cli.write_results(writer, device, results, timestamp)
+		replayed += 1
+	modbus_cli.flush_writer(writer)
+	return replayed
+
+#Function codes of the requests to each table of the simulator, with the block types the table replays
+REPLAY_TABLES = {1: "coil", 5: "coil", 15: "coil", 2: "discrete", 3: "register", 6: "register", 16: "register", 4: "input"}
+
+#Copy the values of the blocks of a table into the simulator's registers
+#Coils are kept 16 to a register, the first coil in the lowest bit
+def apply_sample(blocks, values, start_address, registers):
+	for block, block_values in zip(blocks, values):
+		if block_values is None:
+			continue
+		if block["type"] in ["register", "input"]:
+			offset = block["start"] - start_address
+			registers[offset:offset + block["count"]] = block_values
+			continue
+		for number, value in enumerate(block_values):
+			address = block["start"] + number
+			offset = address // 16 - start_address
+			if value:
+				registers[offset] |= 1 << address % 16
+			else:
+				registers[offset] &= ~(1 << address % 16)
+
+#Build a simulator that answers with the recorded samples
+def make_replay_device(recording, start=None, end=None, speed=1, loop=False):
+	blocks = recording["plan"]["blocks"]
+	tables = {table: [number for number, block in enumerate(blocks) if block["type"] == table] for table in BLOCK_FUNCTION_CODES}
+	state = {"samples": read_samples(recording, start, end), "base": None, "sample": None, "next": None, "number": -1, "applied": {}}
+
+	#Move to the sample recorded at the replay time
+	def advance():
+		now = time.monotonic()
+		while True:
+			if state["next"] is None:
+				state["next"] = next(state["samples"], None)
+				if state["next"] is None:
+					if not loop or state["sample"] is None:
+						return
+					state["samples"] = read_samples(recording, start, end)
+					state["base"] = None
+					continue
+			timestamp, values = state["next"]
+			if state["base"] is None:
+				state["base"] = (timestamp, now)
+			if state["sample"] is not None and state["base"][1] + (timestamp - state["base"][0]) / speed > now:
+				return
+			state["sample"] = state["next"]
+			state["next"] = None
+			state["number"] += 1
+
+	async def action(function_code, start_address, address, count, current_registers, set_values):
+		table = REPLAY_TABLES.get(function_code)
+		if table is None:
+			return None
+		advance()
+		if state["sample"] is None:
+			return ExcCodes.DEVICE_FAILURE
+		values = state["sample"][1]
+		#Only copy the sample in once, so writes are kept until the next sample
+		if state["applied"].get(table) != state["number"]:
+			apply_sample([blocks[number] for number in tables[table]], [values[number] for number in tables[table]], start_address, current_registers)
+			state["applied"][table] = state["number"]
+		if set_values is None:
+			for number in tables[table]:
+				block = blocks[number]
+				if values[number] is None and address < block["start"] + block["count"] and block["start"] < address + count:
+					return ExcCodes.DEVICE_FAILURE
+		return None
+
+	#The simulator tables start at 0 and reach the last recorded address
+	ends = {table: max([blocks[number]["start"] + blocks[number]["count"] for number in numbers] or [1]) for table, numbers in tables.items()}
+	device = make_sim_device(max(ends["register"], ends["input"]), max(ends["coil"], ends["discrete"]), action)
+	advance()
+	return device
+
+#Read a time as seconds since the epoch or an ISO 8601 date and time (local time unless it has an offset)
+def parse_time(text):
+	try:
+		return float(text)
+	except ValueError:
+		pass
+	try:
+		return datetime.datetime.fromisoformat(text).timestamp()
+	except ValueError:
+		raise argparse.ArgumentTypeError(f"invalid time {text}, use seconds since the epoch or an ISO 8601 date and time")
+
+#Poll the tags of the device into the recording until count samples are taken or the user interrupts
+def run_record(args, parser):
+	if args.ip is None:
+		parser.error("record requires --ip")
+	if (args.tags is None) == (args.tag_map is None):
+		parser.error("record requires one of --tags or --tag-map")
+	if args.poll <= 0:
+		parser.error("--poll INTERVAL should be greater than 0")
+	if args.count is not None and args.count < 1:
+		parser.error("--count should be at least 1")
+	if args.chunk < 1:
+		parser.error("--chunk should be at least 1")
+	if args.max_gap < 0:
+		parser.error("--max-gap should not be negative")
+
+	try:
+		if args.tag_map is not None:
+			plan = modbus_cli.load_tag_map(args.tag_map, args.max_gap, not args.no_plan_cache, args.order)
+		else:
+			plan = modbus_cli.compile_plan([modbus_cli.parse_tag(tag, args.order) for tag in args.tags], args.max_gap)
+	except ValueError as e:
+		parser.error(str(e))
+
+	policy_options = {"timeout": args.timeout, "retries": args.retries, "cooldown": args.cooldown}
+	device = f"{args.ip}:{args.port}"
+	try:
+		recorder = make_recorder(args.file, plan, device, args.poll, args.chunk)
+	except (OSError, ValueError) as e:
+		print(f"Error: {e}", file=sys.stderr)
+		return 1
+
+	client = None
+	try:
+		client = modbus_cli.connect(args.ip, args.port, policy_options)
+		modbus_cli.poll(client, plan, int(args.device_id), args.poll, lambda sample, responses: record_sample(recorder, time.time(), responses), args.count, modbus_cli.read_plan_blocks)
+	except KeyboardInterrupt:
+		pass
+	except ModbusException as e:
+		print(f"Error: {e}", file=sys.stderr)
+		return 1
+	finally:
+		close_recorder(recorder)
+		if client is not None:
+			modbus_cli.disconnect(client)
+	print(f"Recorded {recorder['recorded']} sample(s) of {device} to {args.file}", file=sys.stderr)
+	return 0
+
+#Output or serve the samples of a recording
+def run_replay(args, parser):
+	if args.speed < 0:
+		parser.error("--speed should not be negative")
+	if args.serve is not None and args.speed == 0:
+		parser.error("--serve requires a --speed greater than 0")
+	try:
+		recording = open_recording(args.file)
+	except (OSError, ValueError) as e:
+		print(f"Error: {e}", file=sys.stderr)
+		return 1
+
+	try:
+		if args.serve is not None:
+			device = make_replay_device(recording, args.start, args.end, args.speed, args.loop)
+			try:
+				asyncio.run(StartAsyncTcpServer(device, address=(args.host, args.serve)))
+			except KeyboardInterrupt:
+				pass
+			return 0
+
+		writer = modbus_cli.make_writer(args.format, args.flush_interval)
+		try:
+			replay(recording, writer, args.start, args.end, args.tag, args.speed if args.command == "replay" else 0)
+		except ValueError as e:
+			print(f"Error: {e}", file=sys.stderr)
+			return 1
+		except KeyboardInterrupt:
+			modbus_cli.flush_writer(writer)
+		return 0
+	finally:
+		close_recording(recording)
+
+def client():
+	parser = argparse.ArgumentParser(description="Record the tags of a Modbus device to a compressed file, then query or replay the recording")
+	parser.add_argument("command", choices=["record", "query", "replay"], help="record polls the device into FILE, query outputs the samples in a time range, replay outputs them at the speed they were recorded or serves them as a simulated device")
+	parser.add_argument("file", help="Recording file, record appends to it if it is a recording of the same device and tags")
+
+	#Add the record options, the same as modbus_cli.py
+	parser.add_argument("--ip", help="The IP address of the ModBus Device to record")
+	parser.add_argument("--port", default=502, help="The port of the the ModBus Service (Default: 502)")
+	parser.add_argument("-i", "--device_id", default=1, help="Set a Device ID to avoid potential conflicts (Default: 1)")
+	parser.add_argument("-t", "--tags", nargs="+", metavar="TAG", help="Tags to record, registers as ADDRESS:SIZE:DATATYPE (1024:16:INT), coils as ADDRESS:COIL or ADDRESS:DISCRETE")
+	parser.add_argument("--tag-map", metavar="FILE", help="Record the tags in a CSV or YAML tag map file")
+	parser.add_argument("--max-gap", type=int, default=modbus_cli.DEFAULT_MAX_GAP, help=f"Largest number of unused addresses read between two tags to save a request (Default: {modbus_cli.DEFAULT_MAX_GAP})")
+	parser.add_argument("--no-plan-cache", action="store_true", help="Compile the --tag-map every run, without loading or saving the compiled plan in $XDG_CACHE_HOME/modbus_cli")
+	parser.add_argument("-o", "--order", type=str.upper, choices=list(modbus_cli.ORDERS), default="ABCD", help="Byte/word order of the registers (Default: ABCD)")
+	parser.add_argument("--poll", type=float, default=1, metavar="INTERVAL", help="Seconds between samples (Default: 1)")
+	parser.add_argument("--count", type=int, help="Number of samples to record (Default: until interrupted)")
+	parser.add_argument("--chunk", type=int, default=600, metavar="SAMPLES", help="Number of samples compressed together. Samples are written to the file once a chunk is full (Default: 600)")
+	parser.add_argument("--timeout", type=float, default=3, metavar="SECONDS", help="Longest time to wait for a response (Default: 3)")
+	parser.add_argument("--retries", type=int, default=1, help="Number of times to retry a request that timed out or the device was busy for (Default: 1)")
+	parser.add_argument("--cooldown", type=float, default=30, metavar="SECONDS", help="Seconds the device is skipped for after 3 requests in a row have failed (Default: 30)")
+
+	#Add the query and replay options
+	parser.add_argument("--start", type=parse_time, metavar="TIME", help="First time to output, seconds since the epoch or an ISO 8601 date and time (Default: the first sample)")
+	parser.add_argument("--end", type=parse_time, metavar="TIME", help="Last time to output (Default: the last sample)")
+	parser.add_argument("--tag", nargs="+", metavar="NAME", help="Only output the tags with these names (Default: every tag)")
+	parser.add_argument("-f", "--format", choices=modbus_cli.OUTPUT_FORMATS, default="text", help="Output format (Default: text)")
+	parser.add_argument("--flush-interval", type=float, default=0, metavar="SECONDS", help="Write the output at most every SECONDS (Default: 0)")
+	parser.add_argument("--speed", type=float, default=1, help="With replay, replay this many times faster than recorded, 0 for as fast as possible (Default: 1)")
+	parser.add_argument("--serve", type=int, metavar="PORT", help="With replay, serve the recording as a simulated device on PORT instead of outputting it")
+	parser.add_argument("--host", default="127.0.0.1", help="Address to serve on with --serve (Default: 127.0.0.1)")
+	parser.add_argument("--loop", action="store_true", help="With --serve, start again from the first sample after the last one")
+	args = parser.parse_args()
+
+	if args.command != "replay" and (args.serve is not None or args.loop):
+		parser.error("--serve and --loop can only be used with replay")
+	if args.serve is None and args.loop:
+		parser.error("--loop requires --serve")
+	if args.timeout <= 0 or args.cooldown <= 0:
+		parser.error("--timeout and --cooldown should be greater than 0")
+	if args.retries < 0:
+		parser.error("--retries should not be negative")
+
+	if args.command == "record":
+		sys.exit(run_record(args, parser))
+	sys.exit(run_replay(args, parser))
+
+if __name__ == "__main__":
+	client()
@@ -0,0 +1,133 @@
+import argparse
+import asyncio
+import random
+import socket
+import subprocess
+import sys
+import time
+from pymodbus.constants import ExcCodes
+from pymodbus.server import StartAsyncTcpServer
+from pymodbus.simulator import SimData, SimDevice
+from pymodbus.simulator.simutils import DataType
+
+"""
+  ------------- SIMULATOR FUNCTIONS  -------------
+ - make_fault_action(latency, jitter, error_rate, drop_rate, seed)
+	-> latency -- seconds added to every request
+	-> jitter -- up to this many more seconds added to every request, chosen at random
+	-> error_rate -- fraction of requests (0 to 1) answered with a DEVICE_BUSY exception response
+	-> drop_rate -- fraction of requests (0 to 1) that are not answered, so the client times out
+	-> seed -- seed for the random numbers, so runs can be repeated (Default: None)
+	RETURN: async action function for SimDevice
+
+ - make_sim_device(registers, coils, action)
+	-> registers -- number of holding and input registers, starting at address 0. Each register holds its own address
+	-> coils -- number of coils and discrete inputs, starting at address 0, filled out to a whole 16 bit word. The ones at even addresses (0, 2, 4) are on, the odd ones are off
+	-> action -- action function from make_fault_action, None for no faults
+	RETURN: pymodbus SimDevice answering for every device_id
+
+ - start_simulator(port, host, options)
+	-> port -- port to listen on
+	-> host -- address to listen on (Default: 127.0.0.1)
+	-> options -- list of extra modbus_sim.py arguments, ["--latency", "2"]
+	RETURN: subprocess.Popen of the simulator, once it is accepting connections
+
+ - stop_simulator(process)
+	-> process -- subprocess.Popen from start_simulator
+	RETURN: None
+"""
+
+#Requests that are dropped are held this long before being answered, longer than any client timeout
+DROP_DELAY = 60
+
+#Build the function the datastore calls for every request, to add latency and faults
+def make_fault_action(latency=0, jitter=0, error_rate=0, drop_rate=0, seed=None):
+	rng = random.Random(seed)
+
+	async def action(function_code, start_address, address, count, current_registers, set_values):
+		delay = latency + (rng.uniform(0, jitter) if jitter else 0)
+		roll = rng.random()
+		if roll < drop_rate:
+			delay = DROP_DELAY
+		if delay:
+			await asyncio.sleep(delay)
+		if roll < drop_rate + error_rate:
+			return ExcCodes.DEVICE_BUSY
+		return None
+
+	return action
+
+#Build a device with coils, discrete inputs, holding registers and input registers all starting at address 0
+#pymodbus keeps the bits in 16 bit words, lowest address in the lowest bit, so tests/test_modbus_sim.py checks the bits are served in address order
+def make_sim_device(registers=10000, coils=10000, action=None):
+	bits = [i % 2 == 0 for i in range(coils)]
+	values = [i % 65536 for i in range(registers)]
+	return SimDevice(
+		0,
+		simdata=(
+			[SimData(0, values=bits, datatype=DataType.BITS)],
+			[SimData(0, values=list(bits), datatype=DataType.BITS)],
+			[SimData(0, values=values, datatype=DataType.UINT16)],
+			[SimData(0, values=list(values), datatype=DataType.UINT16)],
+		),
+		action=action,
+	)
+
+#Find a port nothing is listening on
+def free_port(host="127.0.0.1"):
+	with socket.socket() as sock:
+		sock.bind((host, 0))
+		return sock.getsockname()[1]
+
+#Run the simulator in its own process, so its CPU time is not counted with the client's
+def start_simulator(port, host="127.0.0.1", options=None, timeout=10):
+	process = subprocess.Popen([sys.executable, __file__, "--host", host, "--port", str(port)] + (options or []))
+	deadline = time.monotonic() + timeout
+	while True:
+		try:
+			socket.create_connection((host, port), timeout=1).close()
+			return process
+		except OSError:
+			if process.poll() is not None or time.monotonic() > deadline:
+				stop_simulator(process)
+				raise RuntimeError(f"simulator did not start on {host}:{port}")
+			time.sleep(0.05)
+
+#Stop a simulator from start_simulator
+def stop_simulator(process):
+	if process.poll() is None:
+		process.terminate()
+	process.wait()
+
+def client():
+	parser = argparse.ArgumentParser(description="Simulate a Modbus TCP device, with added latency and faults, for testing and benchmarks")
+	parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (Default: 127.0.0.1)")
+	parser.add_argument("--port", type=int, default=5020, help="Port to listen on (Default: 5020)")
+	parser.add_argument("--registers", type=int, default=10000, help="Number of holding and input registers, from address 0 (Default: 10000)")
+	parser.add_argument("--coils", type=int, default=10000, help="Number of coils and discrete inputs, from address 0 (Default: 10000)")
+	parser.add_argument("--latency", type=float, default=0, metavar="MS", help="Milliseconds added to every request (Default: 0)")
+	parser.add_argument("--jitter", type=float, default=0, metavar="MS", help="Up to this many more milliseconds added to every request, chosen at random (Default: 0)")
+	parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests (0 to 1) answered with a DEVICE_BUSY exception (Default: 0)")
+	parser.add_argument("--drop-rate", type=float, default=0, help="Fraction of requests (0 to 1) that are not answered, so the client times out (Default: 0)")
+	parser.add_argument("--seed", type=int, help="Seed for the random jitter and faults, so runs can be repeated")
+	args = parser.parse_args()
+
+	if not 1 <= args.registers <= 65536 or not 1 <= args.coils <= 65536:
+		parser.error("--registers and --coils should be between 1 and 65536")
+	if args.latency < 0 or args.jitter < 0:
+		parser.error("--latency and --jitter should not be negative")
+	if args.error_rate < 0 or args.drop_rate < 0 or args.error_rate + args.drop_rate > 1:
+		parser.error("--error-rate and --drop-rate should be between 0 and 1")
+
+	action = None
+	if args.latency or args.jitter or args.error_rate or args.drop_rate:
+		action = make_fault_action(args.latency / 1000, args.jitter / 1000, args.error_rate, args.drop_rate, args.seed)
+	device = make_sim_device(args.registers, args.coils, action)
+
+	try:
+		asyncio.run(StartAsyncTcpServer(device, address=(args.host, args.port)))
+	except KeyboardInterrupt:
+		pass
+
+if __name__ == "__main__":
+	client()
@@ -0,0 +1,46 @@
+import asyncio
+import os
+import sys
+import unittest
+from pymodbus.server import ModbusTcpServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modbus_cli import compile_plan, parse_tag
+from modbus_async import scan_devices
+from modbus_sim import DROP_DELAY, make_sim_device, free_port
+
+#Simulator action that does not answer the first request, and answers every request after it
+def make_drop_first_action():
+	requests = {"count": 0}
+
+	async def action(function_code, start_address, address, count, current_registers, set_values):
+		requests["count"] += 1
+		if requests["count"] == 1:
+			await asyncio.sleep(DROP_DELAY)
+		return None
+
+	return action
+
+class ScanDevicesTest(unittest.IsolatedAsyncioTestCase):
+	async def asyncSetUp(self):
+		self.port = free_port()
+		self.server = ModbusTcpServer(make_sim_device(100, 100, make_drop_first_action()), address=("127.0.0.1", self.port))
+		self.serving = asyncio.create_task(self.server.serve_forever())
+		await asyncio.sleep(0.2)
+
+	async def asyncTearDown(self):
+		await self.server.shutdown()
+		self.serving.cancel()
+
+	#A dropped reply closes the connection, the scans after it have to connect again and read the device
+	async def test_scan_after_dropped_reply(self):
+		plan = compile_plan([parse_tag("0:16:INT"), parse_tag("1:16:INT")])
+		device = {"ip": "127.0.0.1", "port": self.port, "device_id": 1, "tags": plan["tags"], "blocks": plan["blocks"]}
+		scans = []
+		await scan_devices([device], lambda device, results: scans.append([value for tag, value in results]), interval=0.05, count=3, policy_options={"timeout": 0.3, "retries": 0})
+		self.assertEqual(scans[0], [None, None])
+		self.assertEqual(scans[1:], [[0, 1], [0, 1]])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,46 @@
+import asyncio
+import os
+import sys
+import unittest
+from pymodbus.client import AsyncModbusTcpClient
+from pymodbus.server import ModbusTcpServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modbus_sim import make_sim_device, free_port
+
+class SimDeviceTest(unittest.IsolatedAsyncioTestCase):
+	async def asyncSetUp(self):
+		self.port = free_port()
+		self.server = ModbusTcpServer(make_sim_device(100, 40), address=("127.0.0.1", self.port))
+		self.serving = asyncio.create_task(self.server.serve_forever())
+		await asyncio.sleep(0.2)
+		self.client = AsyncModbusTcpClient("127.0.0.1", port=self.port)
+		await self.client.connect()
+
+	async def asyncTearDown(self):
+		self.client.close()
+		await self.server.shutdown()
+		self.serving.cancel()
+
+	#Coils and discrete inputs at even addresses are on, read from any address
+	async def test_bits_in_address_order(self):
+		for start in [0, 1, 5, 16]:
+			coils = await self.client.read_coils(start, count=16)
+			discrete = await self.client.read_discrete_inputs(start, count=16)
+			expected = [address % 2 == 0 for address in range(start, start + 16)]
+			self.assertEqual(coils.bits[:16], expected)
+			self.assertEqual(discrete.bits[:16], expected)
+
+	#The bits are filled out to a whole 16 bit word, and end there
+	async def test_bits_end_on_a_word(self):
+		self.assertEqual((await self.client.read_coils(40, count=8)).bits[:8], [False] * 8)
+		self.assertTrue((await self.client.read_coils(48, count=1)).isError())
+
+	#Each register holds its own address
+	async def test_registers_hold_their_address(self):
+		self.assertEqual((await self.client.read_holding_registers(0, count=10)).registers, list(range(10)))
+		self.assertEqual((await self.client.read_input_registers(90, count=10)).registers, list(range(90, 100)))
+
+if __name__ == "__main__":
+	unittest.main()